@@ -133,7 +133,8 @@ class RecordBone(BaseBone):
                 query = db.Query("viur-relations") \
                     .filter("viur_src_kind =", key.kind) \
                     .filter("src.__key__ =", key) \
-                    .filter("viur_src_property >", viur_src_property)
+                    .filter("viur_src_property >", viur_src_property) \
+                    .keys()
 
                 logging.debug(f"Delete viur-relations with {query=}")
                 tasks.DeleteEntitiesIter.startIterOnQuery(query)
@@ -561,28 +561,29 @@ class RelationalBone(BaseBone):
             .filter("viur_src_property =", viur_src_property) \
             .filter("src.__key__ =", key)
 
-        for entity in query.iter():
-            try:
-                if entity["dest"].key not in values_keys:  # Relation has been removed
-                    db.delete(entity.key)
-                    continue
+        with db.batch():
+            for entity in query.iter():
+                try:
+                    if entity["dest"].key not in values_keys:  # Relation has been removed
+                        db.delete(entity.key)
+                        continue
 
-            except KeyError:  # This entry is corrupt
-                db.delete(entity.key)
+                except KeyError:  # This entry is corrupt
+                    db.delete(entity.key)
 
-            else:  # Relation: Updated
-                # Find the newest item matching this key (this has to been done this way)...
-                value = [value for value in values if value["dest"]["key"] == entity["dest"].key][0]
-                # ... and remove it from the list of values
-                values.remove(value)
-                values_keys.remove(value["dest"]["key"])
+                else:  # Relation: Updated
+                    # Find the newest item matching this key (this has to been done this way)...
+                    value = [value for value in values if value["dest"]["key"] == entity["dest"].key][0]
+                    # ... and remove it from the list of values
+                    values.remove(value)
+                    values_keys.remove(value["dest"]["key"])
 
-                # Update existing database entry
-                __update_relation(entity, value)
+                    # Update existing database entry
+                    __update_relation(entity, value)
 
-        # Add new database entries for the remaining values
-        for value in values:
-            __update_relation(db.Entity(db.Key("viur-relations", parent=key)), value)
+            # Add new database entries for the remaining values
+            for value in values:
+                __update_relation(db.Entity(db.Key("viur-relations", parent=key)), value)
 
         # Call postSavedHandler on UsingSkel (RelSkel)
         if self.using:
@@ -609,7 +610,9 @@ class RelationalBone(BaseBone):
             .filter("viur_src_property =", boneName) \
             .filter("src.__key__ =", key)
 
-        db.delete([entity for entity in query.run()])
+        with db.batch():
+            for entity in query.keys().iter():
+                db.delete(entity.key)
 
     def isInvalid(self, key) -> None:
         """
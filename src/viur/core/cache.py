@@ -1,13 +1,30 @@
+import abc
+import collections
+import contextvars
+import dataclasses
+import gzip
 import logging
 import os
-from datetime import timedelta
-from functools import wraps
-from hashlib import sha512
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial, wraps
+from hashlib import blake2b, sha256
 import typing as t
 
+import jinja2.ext
+from jinja2 import nodes
+from markupsafe import Markup
+
 from viur.core import Method, current, db, tasks, utils
 from viur.core.config import conf
 
+try:
+    import brotli
+except ModuleNotFoundError:
+    brotli = None
+
 """
     This module implements a cache that can be used to serve entire requests or cache the output of any function
     (as long it's result can be stored in datastore). The intended use is to wrap functions that can be called from
@@ -27,10 +44,274 @@ from viur.core.config import conf
 """
 
 viurCacheName = "viur-cache"
+viurCacheDependencyName = "viur-cache-dependency"
+"""
+    Kind of the dependency index; it holds one entity per cache entry and each entity or kind the entry depends on,
+    named by the cache entry's key and a hash of the dependency, so it can be invalidated by a single keys-only query.
+    The index entities of a cache entry are replaced when it's rebuilt, and removed together with it.
+"""
+viurCacheChunkName = "viur-cache-chunk"
+viurCacheStatsName = "viur-cache-stats"
+
+CHUNK_SIZE = 900_000
+"""Cached bodies larger than this (in bytes, after compression) are split into chunks; entities are limited to 1 MB"""
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    """
+    A cached response, as kept by the :class:`FrontCache`.
+    """
+
+    data: str | bytes
+    content_type: str
+    creationtime: datetime
+    size: int
+    fetched: float = dataclasses.field(default_factory=time.monotonic)
+    """When this entry has been read from (or written to) the datastore, by :func:`time.monotonic`"""
+    encoding: str | None = None
+    """The Content-Encoding of data, if it has been stored compressed"""
+    text: bool = False
+    """If data is the encoded body of a string (as it has been compressed or chunked), which must be decoded
+    when served uncompressed"""
+    etag: str = ""
+    """Strong validator of the response, the hash of its body as stored"""
+
+    @classmethod
+    def from_entity(cls, entity: db.Entity, data: bytes | None = None) -> t.Self:
+        """
+        Creates the entry from an entity of the *viur-cache* kind; *data* is the body put together from its chunks.
+        """
+        if data is None:
+            data = entity["data"]
+        return cls(
+            data=data,
+            content_type=entity["content-type"],
+            creationtime=entity["creationtime"],
+            size=sys.getsizeof(data),
+            encoding=entity.get("encoding"),
+            text=bool(entity.get("text")),
+            etag=entity.get("etag") or _etag(data),  # entries cached before ETags were introduced have none
+        )
+
+
+class FrontCache:
+    """
+    LRU cache of this instance in front of the *viur-cache* kind, bounded by :attr:`conf.cache_front_size` bytes.
+
+    Entries are kept for :attr:`conf.cache_front_ttl` at most, as flushes on other instances can't invalidate them.
+    """
+
+    def __init__(self):
+        self._entries: collections.OrderedDict[str, CacheEntry] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+
+            if entry.fetched + conf.cache_front_ttl.total_seconds() < time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > conf.cache_front_size:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+
+            while self.size > conf.cache_front_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: str) -> None:
+        if (entry := self._entries.pop(key, None)) is not None:
+            self.size -= entry.size
+
+
+front_cache = FrontCache()
+"""The front cache of this instance"""
+
+_revalidating: set[str] = set()
+"""Keys of the entries currently rebuilt by stale-while-revalidate on this instance"""
+_revalidating_lock = threading.Lock()
+
+
+class _Flight:
+    """
+    A build of a cache entry in progress, which concurrent requests for the same entry wait for.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: CacheEntry | None = None
+
+
+_flights: dict[str, _Flight] = {}
+"""The builds in progress on this instance, by the key of the cache entry"""
+_flights_lock = threading.Lock()
+
+single_flight_stats: collections.Counter[str] = collections.Counter()
+"""
+    How cache misses have been handled on this instance:
+        - builds: The wrapped function has been called
+        - coalesced: The request waited for a build of another request on this instance
+        - lease_waits: The request waited for a build on another instance
+"""
+_single_flight_stats_lock = threading.Lock()
+
+LEASE_NAMESPACE = "viur-cache-lease"
+"""The memcache namespace of the leases, which ensure that only one instance builds a cache entry at a time"""
+
+
+@dataclasses.dataclass
+class PathStats:
+    """
+    Counters of the cache for one path.
+    """
+
+    hits: int = 0
+    """Requests served from the cache (including those waiting for a build of another request)"""
+    misses: int = 0
+    """Requests not served from the cache"""
+    stale: int = 0
+    """Requests served a stale entry"""
+    builds: int = 0
+    """Calls of the wrapped function, including rebuilds of stale entries"""
+    bytes: int = 0
+    """Size of the bodies served from the cache"""
+    build_time: float = 0.0
+    """Seconds spent in the wrapped function"""
+
+    def add(self, other: t.Self) -> None:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+class CacheStats:
+    """
+    Counters of the cache per path, aggregated on this instance.
+
+    If :attr:`conf.cache_stats_flush_interval` is set, they're periodically written to the *viur-cache-stats* kind
+    (after the response of a request), where :func:`statistics` aggregates them over all instances.
+    """
+
+    def __init__(self):
+        self._paths: dict[str, PathStats] = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._flushing = False
+
+    def record(self, path: str, **counters: int | float) -> None:
+        with self._lock:
+            stats = self._paths.setdefault(path, PathStats())
+            for name, value in counters.items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+            interval = conf.cache_stats_flush_interval
+            if self._flushing or interval is None or time.monotonic() - self._flushed < interval.total_seconds():
+                return
+            self._flushing = True
+
+        currReq = current.request.get()
+        if currReq is not None:
+            # The flush doesn't depend on the request, so it runs in an empty context (and isn't counted by its stats)
+            currReq.after_response_tasks.append(partial(contextvars.Context().run, self.flush))
+        else:
+            self.flush()
+
+    def snapshot(self, reset: bool = False) -> dict[str, PathStats]:
+        with self._lock:
+            res = {path: dataclasses.replace(stats) for path, stats in self._paths.items()}
+            if reset:
+                self._paths.clear()
+        return res
+
+    def flush(self) -> None:
+        """
+        Writes the counters collected since the last flush to the datastore.
+        """
+        try:
+            if stats := self.snapshot(reset=True):
+                dbEntity = db.Entity(db.Key(viurCacheStatsName))
+                dbEntity["creationtime"] = utils.utcNow()
+                dbEntity["instance"] = _instance
+                dbEntity["stats"] = utils.json.dumps({path: dataclasses.asdict(value) for path, value in stats.items()})
+                dbEntity.exclude_from_indexes = {"stats"}
+                db.put(dbEntity)
+        except Exception as e:
+            logging.error(f"Failed to flush the cache statistics with {e=}")
+        finally:
+            with self._lock:
+                self._flushed = time.monotonic()
+                self._flushing = False
+
+
+cache_stats = CacheStats()
+
+_instance = os.getenv("GAE_INSTANCE") or utils.string.random(8)
+"""Identifies this instance in the flushed statistics"""
+
+
+def statistics(since: timedelta = timedelta(days=1), top: int = 10) -> dict[str, t.Any]:
+    """
+        Aggregates the statistics of the caches, flushed by all instances since *since* ago and this instance's
+        current counters.
+
+        :param since: The period to aggregate the flushed statistics of.
+        :param top: The number of paths listed as top misses.
+        :returns: The counters and hit ratio per path, the paths with the most misses,
+            and the counters of the single-flight builds and the local entity cache of this instance.
+    """
+    paths: dict[str, PathStats] = collections.defaultdict(PathStats)
+
+    for dbEntity in db.Query(viurCacheStatsName).filter("creationtime >=", utils.utcNow() - since).iter():
+        for path, value in utils.json.loads(dbEntity["stats"]).items():
+            paths[path].add(PathStats(**value))
+
+    for path, value in cache_stats.snapshot().items():
+        paths[path].add(value)
+
+    def describe(path: str, stats: PathStats) -> dict[str, t.Any]:
+        served = stats.hits + stats.stale
+        return dataclasses.asdict(stats) | {
+            "path": path,
+            "hit_ratio": served / (served + stats.misses) if served + stats.misses else None,
+        }
+
+    return {
+        "paths": [describe(path, stats) for path, stats in sorted(paths.items())],
+        "top_misses": [
+            describe(path, stats)
+            for path, stats in sorted(paths.items(), key=lambda item: item[1].misses, reverse=True)[:top]
+            if stats.misses
+        ],
+        "single_flight": dict(single_flight_stats),
+        "entities": db.cache.local_cache.stats(),
+    }
 
 
 def keyFromArgs(f: t.Callable, userSensitive: int, languageSensitive: bool, evaluatedArgs: list[str], path: str,
-                args: tuple, kwargs: dict) -> str:
+                args: tuple, kwargs: dict) -> str | None:
     """
         Utility function to derive a unique but stable string-key that can be used in a datastore-key
         for the given wrapped function f, the parameter *args and **kwargs it has been called with,
@@ -38,7 +319,7 @@ def keyFromArgs(f: t.Callable, userSensitive: int, languageSensitive: bool, eval
         as well as the configuration (userSensitive, languageSensitive and evaluatedArgs) provided to the @enableCache
         decorator. To derive the key, we'll first map all positional arguments to their keyword equivalent, construct
         a dict with the parameters having an effect on the result, merge the context variables (language, session state)
-        in, sort this dict by key, cast it to string and return it's sha512 hash.
+        in, sort this dict by key, encode it and return its blake2b hash.
 
         :param f: Callable which is inspected for its signature
             (we need to figure out what positional arguments map to which key argument)
@@ -50,68 +331,82 @@ def keyFromArgs(f: t.Callable, userSensitive: int, languageSensitive: bool, eval
         :param evaluatedArgs: List of keyword-arguments having influence to the output generated by
             that function. This list *must* complete! Parameters not named here are ignored!
         :param path: Path to the function called but without parameters (ie. "/page/view")
-        :returns: The unique key derived
-    """
-    res = {}
-    argsOrder = list(f.__code__.co_varnames)[1: f.__code__.co_argcount]
-    # Map default values in
-    reversedArgsOrder = argsOrder[:: -1]
-    for defaultValue in list(f.__defaults__ or [])[:: -1]:
-        res[reversedArgsOrder.pop(0)] = defaultValue
-    del reversedArgsOrder
-    # Map args in
-    setArgs = []  # Store a list of args already set by *args
-    for idx in range(0, min(len(args), len(argsOrder))):
-        if argsOrder[idx] in evaluatedArgs:
-            setArgs.append(argsOrder[idx])
-            res[argsOrder[idx]] = args[idx]
-    # Last, we map the kwargs in
-    for k, v in kwargs.items():
-        if k in evaluatedArgs:
-            if k in setArgs:
-                raise AssertionError(f"Got duplicate arguments for {k}")
-            res[k] = v
-    if userSensitive:
-        user = current.user.get()
-        if userSensitive == 1 and user:  # We dont cache requests for each user separately
+        :returns: The unique key derived, or None if this call can't be cached
+
+        .. seealso:: :class:`KeyPlan`, which @enableCache compiles once per function to derive the keys.
+    """
+    return KeyPlan(f, userSensitive, languageSensitive, evaluatedArgs)(path, args, kwargs)
+
+
+class KeyPlan:
+    """
+        The mapping of the arguments of a function wrapped by @enableCache to its cache keys,
+        compiled once when the function is decorated, see :func:`keyFromArgs`.
+    """
+
+    __slots__ = ("userSensitive", "languageSensitive", "evaluatedArgs", "defaults", "positional", "required")
+
+    def __init__(self, f: t.Callable, userSensitive: int, languageSensitive: bool, evaluatedArgs: list[str]):
+        argsOrder = f.__code__.co_varnames[1: f.__code__.co_argcount]
+        defaults = f.__defaults__ or ()
+        self.userSensitive = userSensitive
+        self.languageSensitive = languageSensitive
+        self.evaluatedArgs = frozenset(evaluatedArgs)
+        # The default values of all parameters are part of the key, but don't vary
+        self.defaults = dict(zip(argsOrder[len(argsOrder) - len(defaults):], defaults))
+        # Positional arguments having an influence on the output, by their index
+        self.positional = tuple((idx, name) for idx, name in enumerate(argsOrder) if name in self.evaluatedArgs)
+        # Parameters without default values; these must be set by an evaluated argument
+        self.required = frozenset(argsOrder) - self.defaults.keys()
+
+    def __call__(self, path: str, args: tuple, kwargs: dict) -> str | None:
+        if not self.required <= self.evaluatedArgs:
+            # These parameters are never part of the key, so they must not be given
             return None
-        elif userSensitive == 2:
-            if user:
-                res["__user"] = "__ISUSER"
-            else:
-                res["__user"] = None
-        elif userSensitive == 3:
-            if user:
-                res["__user"] = user["key"]
-            else:
-                res["__user"] = None
-    if languageSensitive:
-        res["__lang"] = current.language.get()
-    if conf.cache_environment_key:
-        try:
-            res["_cacheEnvironment"] = conf.cache_environment_key()
-        except RuntimeError:
+
+        res = self.defaults.copy()
+        setArgs = set()
+        for idx, name in self.positional:
+            if idx >= len(args):
+                break
+            setArgs.add(name)
+            res[name] = args[idx]
+        for k, v in kwargs.items():
+            if k in self.evaluatedArgs:
+                if k in setArgs:
+                    raise AssertionError(f"Got duplicate arguments for {k}")
+                res[k] = v
+        if not self.required <= res.keys():
+            # we have too few parameters for this function; that wont work
             return None
-    res["__path"] = path  # Different path might have different output (html,xml,..)
-    try:
-        appVersion = os.getenv("GAE_VERSION")
-    except:
-        logging.error("Could not determine the current application version! Caching might produce unexpected results!")
-        appVersion = ""
-    res["__appVersion"] = appVersion
-    # Last check, that every parameter is satisfied:
-    if not all([x in res.keys() for x in argsOrder]):
-        # we have too few parameters for this function; that wont work
-        return None
-    res = list(res.items())  # flatten our dict to a list
-    res.sort(key=lambda x: x[0])  # sort by keys
-    mysha512 = sha512()
-    mysha512.update(str(res).encode("UTF8"))
-    return mysha512.hexdigest()
+
+        if self.userSensitive:
+            user = current.user.get()
+            if self.userSensitive == 1 and user:  # We dont cache requests for each user separately
+                return None
+            elif self.userSensitive == 2:
+                res["__user"] = "__ISUSER" if user else None
+            elif self.userSensitive == 3:
+                res["__user"] = user["key"] if user else None
+        if self.languageSensitive:
+            res["__lang"] = current.language.get()
+        if conf.cache_environment_key:
+            try:
+                res["_cacheEnvironment"] = conf.cache_environment_key()
+            except RuntimeError:
+                return None
+        res["__path"] = path  # Different path might have different output (html,xml,..)
+        res["__appVersion"] = conf.instance.app_version
+
+        return blake2b(
+            "\x00".join(f"{k}={res[k]!r}" for k in sorted(res)).encode("UTF-8"),
+            digest_size=32,
+        ).hexdigest()
 
 
 def wrapCallable(f, urls: list[str], userSensitive: int, languageSensitive: bool,
-                 evaluatedArgs: list[str], maxCacheTime: int | timedelta):
+                 evaluatedArgs: list[str], maxCacheTime: int | timedelta,
+                 staleWhileRevalidate: int | timedelta | None = None):
     """
         Does the actual work of wrapping a callable.
         Use the decorator enableCache instead of calling this directly.
@@ -122,6 +417,8 @@ def wrapCallable(f, urls: list[str], userSensitive: int, languageSensitive: bool
         method = f
         f = f._func
 
+    keyPlan = KeyPlan(f, userSensitive, languageSensitive, evaluatedArgs)
+
     @wraps(f)
     def wrapF(self, *args, **kwargs) -> str | bytes:
         currReq = current.request.get()
@@ -139,37 +436,43 @@ def wrapCallable(f, urls: list[str], userSensitive: int, languageSensitive: bool
             # This path (possibly a sub-render) should not be cached
             logging.info(f"No caching for {path}")
             return f(self, *args, **kwargs)
-        key = keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args, kwargs)
+        key = keyPlan(path, args, kwargs)
         if not key:
             # Something is wrong (possibly the parameter-count)
             # Let's call f, but we knew already that this will clash
             return f(self, *args, **kwargs)
-        dbRes = db.get(db.Key(viurCacheName, key))
-        if dbRes is not None:
-            if (
-                    not maxCacheTime or dbRes["creationtime"] > utils.utcNow()
-                    - utils.parse.timedelta(maxCacheTime)
-            ):
+        entry = None
+        if conf.cache_front_size > 0:
+            entry = front_cache.get(key)
+
+        if entry is None and (entry := _load(key)) is not None:
+            if conf.cache_front_size > 0:
+                front_cache.put(key, entry)
+
+        if entry is not None:
+            age = utils.utcNow() - entry.creationtime
+            if not maxCacheTime or age <= utils.parse.timedelta(maxCacheTime):
                 # We store it unlimited or the cache is fresh enough
                 logging.debug("This request was served from cache.")
-                currReq.response.headers['Content-Type'] = dbRes["content-type"]
-                return dbRes["data"]
-        # If we made it this far, the request wasn't cached or too old; we need to rebuild it
-        oldAccessLog = db.start_data_access_log()
-        try:
-            res = f(self, *args, **kwargs)
-        finally:
-            accessedEntries = db.end_data_access_log(oldAccessLog)
-        dbEntity = db.Entity(db.Key(viurCacheName, key))
-        dbEntity["data"] = res
-        dbEntity["creationtime"] = utils.utcNow()
-        dbEntity["path"] = path
-        dbEntity["content-type"] = currReq.response.headers['Content-Type']
-        dbEntity["accessedEntries"] = list(accessedEntries)
-        dbEntity.exclude_from_indexes = {"data", "content-type"}  # save two DB-writes.
-        db.put(dbEntity)
-        logging.debug("This request was a cache-miss. Cache has been updated.")
-        return res
+                cache_stats.record(path, hits=1, bytes=entry.size)
+                return _serve(entry)
+
+            if staleWhileRevalidate and age <= utils.parse.timedelta(maxCacheTime) \
+                    + utils.parse.timedelta(staleWhileRevalidate):
+                # Serve the stale entry, it's rebuilt once the response has been sent
+                with _revalidating_lock:
+                    if key not in _revalidating:
+                        _revalidating.add(key)
+                        rebuild = partial(_revalidate, key, f, self, path, args, kwargs)
+                        currReq.after_response_tasks.append(partial(contextvars.copy_context().run, rebuild))
+
+                logging.debug("This request was served stale from cache.")
+                cache_stats.record(path, stale=1, bytes=entry.size)
+                return _serve(entry)
+
+        # If we made it this far, the request wasn't cached or too old (even to be served stale); we need to rebuild it
+        cache_stats.record(path, misses=1)
+        return _serve(_build_single_flight(key, entry, f, self, path, args, kwargs))
 
     if method is None:
         return wrapF
@@ -178,8 +481,356 @@ def wrapCallable(f, urls: list[str], userSensitive: int, languageSensitive: bool
         return method
 
 
+def _build_single_flight(
+    key: str, outdated: CacheEntry | None, f: t.Callable, self, path: str, args: tuple, kwargs: dict
+) -> CacheEntry:
+    """
+        Builds a missing or *outdated* cache entry, but only once at a time for concurrent requests.
+
+        Requests on the same instance wait for the build that is already in progress.
+        Across instances, a lease in the memcache ensures that only one instance builds the entry;
+        others wait for the entry to be written. The *outdated* entry is never served.
+        If the build doesn't finish within :attr:`conf.cache_single_flight_timeout`, the entry is built
+        by the waiting request as well.
+    """
+    timeout = conf.cache_single_flight_timeout.total_seconds()
+
+    with _flights_lock:
+        if (flight := _flights.get(key)) is None:
+            flight = _flights[key] = _Flight()
+            is_leader = True
+        else:
+            is_leader = False
+
+    if not is_leader:
+        if flight.done.wait(timeout) and flight.entry is not None:
+            _count("coalesced")
+            logging.debug("This request waited for the cache entry built by another request.")
+            return flight.entry
+
+        return _build(key, f, self, path, args, kwargs)
+
+    has_lease = False
+    try:
+        if not (has_lease := _acquire_lease(key, timeout)):
+            _count("lease_waits")
+            if (entry := _wait_for_entry(key, timeout, outdated)) is not None:
+                flight.entry = entry
+                return entry
+
+        flight.entry = _build(key, f, self, path, args, kwargs)
+        logging.debug("This request was a cache-miss. Cache has been updated.")
+        return flight.entry
+
+    finally:
+        with _flights_lock:
+            del _flights[key]
+
+        flight.done.set()
+        if has_lease:
+            _release_lease(key)
+
+
+def _count(metric: str) -> None:
+    with _single_flight_stats_lock:
+        single_flight_stats[metric] += 1
+
+
+def _acquire_lease(key: str, timeout: float) -> bool:
+    """
+        Acquires the lease to build the cache entry *key* on this instance.
+        Without a memcache, there is nothing to coordinate, so the lease is always granted.
+    """
+    if not conf.db.memcache_client:
+        return True
+
+    try:
+        return bool(conf.db.memcache_client.add(key, 1, time=timeout, namespace=LEASE_NAMESPACE))
+    except Exception as e:
+        logging.error(f"Failed to acquire the lease for {key=} with {e=}")
+        return True
+
+
+def _release_lease(key: str) -> None:
+    if not conf.db.memcache_client:
+        return
+
+    try:
+        conf.db.memcache_client.delete(key, namespace=LEASE_NAMESPACE)
+    except Exception as e:
+        logging.error(f"Failed to release the lease for {key=} with {e=}")
+
+
+def _wait_for_entry(key: str, timeout: float, outdated: CacheEntry | None = None) -> CacheEntry | None:
+    """
+        Polls the datastore for the cache entry *key*, which is built by another instance
+        to replace the *outdated* entry.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+        if (entry := _load(key)) is not None and (outdated is None or entry.creationtime > outdated.creationtime):
+            return entry
+
+    return None
+
+
+def _load(key: str) -> CacheEntry | None:
+    """
+        Reads the cache entry *key* from the datastore, putting its body together from its chunks if necessary.
+    """
+    dbRes = db.get(db.Key(viurCacheName, key))
+    # Entries with an indexed access log predate the dependency index and can't be invalidated anymore
+    if dbRes is None or "accessedEntries" not in dbRes.exclude_from_indexes:
+        return None
+
+    if not (chunks := dbRes.get("chunks")):
+        return CacheEntry.from_entity(dbRes)
+
+    chunkEntities = {
+        chunk.key.name: chunk
+        for chunk in db.get([db.Key(viurCacheChunkName, _chunk_name(key, index)) for index in range(chunks)])
+        # Chunks of another version of the entry may be left over, or written concurrently
+        if chunk["creationtime"] == dbRes["creationtime"]
+    }
+    if len(chunkEntities) != chunks:
+        logging.warning(f"Cache entry {key} is missing some of its {chunks} chunks")
+        return None
+
+    return CacheEntry.from_entity(
+        dbRes,
+        data=b"".join(chunkEntities[_chunk_name(key, index)]["data"] for index in range(chunks))
+    )
+
+
+def _etag(data: t.Any) -> str:
+    if not isinstance(data, bytes):
+        data = str(data).encode("UTF-8")
+    return sha256(data).hexdigest()[:32]
+
+
+def _chunk_name(key: str, index: int) -> str:
+    return f"{key}_{index}"
+
+
+def _compress(data: bytes) -> tuple[str, bytes]:
+    """
+        Compresses a body to be cached, using brotli (at :attr:`conf.cache_compression_level`) if it's installed,
+        gzip otherwise. Returns the Content-Encoding and the result.
+    """
+    if brotli is not None:
+        return "br", brotli.compress(data, quality=conf.cache_compression_level)
+    return "gzip", gzip.compress(data)
+
+
+def _decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+def _serve(entry: CacheEntry) -> str | bytes:
+    """
+        Sets the headers of a cached response and returns its body.
+        Compressed bodies are served as they are to clients accepting the encoding, decompressed to all others.
+        Requests with a matching If-None-Match header are answered with 304 Not Modified.
+
+        Internal requests (e.g. by execRequest inside a template) always receive the decompressed body,
+        as it becomes part of another response.
+    """
+    currReq = current.request.get()
+    if currReq.internalRequest:
+        return _decompressed(entry)
+
+    currReq.response.headers['Content-Type'] = entry.content_type
+    if entry.encoding is None:
+        return "" if currReq.not_modified(entry.etag) else _decompressed(entry)
+
+    currReq.response.vary = tuple(currReq.response.vary or ()) + ("Accept-Encoding",)
+    acceptEncoding = currReq.request.accept_encoding
+    if acceptEncoding.header_value is not None and acceptEncoding.acceptable_offers([entry.encoding]):
+        # Each representation needs its own strong validator
+        if currReq.not_modified(f"{entry.etag}-{entry.encoding}"):
+            return ""
+        currReq.response.headers["Content-Encoding"] = entry.encoding
+        return entry.data
+
+    if currReq.not_modified(entry.etag):
+        return ""
+
+    return _decompressed(entry)
+
+
+def _decompressed(entry: CacheEntry) -> str | bytes:
+    """
+        Returns the decompressed body of *entry*, decoded to a string if it has been one.
+    """
+    data = entry.data if entry.encoding is None else _decompress(entry.encoding, entry.data)
+    return data.decode("UTF-8") if entry.text else data
+
+
+def _build(key: str, f: t.Callable, self, path: str, args: tuple, kwargs: dict) -> CacheEntry:
+    """
+        Calls the wrapped function and stores its result in the cache.
+    """
+    _count("builds")
+    currReq = current.request.get()
+    oldAccessLog = db.start_data_access_log()
+    start = time.perf_counter()
+    try:
+        res = f(self, *args, **kwargs)
+    finally:
+        accessedEntries = db.end_data_access_log(oldAccessLog)
+        cache_stats.record(path, builds=1, build_time=time.perf_counter() - start)
+    dbEntity = db.Entity(db.Key(viurCacheName, key))
+    dbEntity["data"] = res
+    dbEntity["creationtime"] = utils.utcNow()
+    dbEntity["path"] = path
+    dbEntity["content-type"] = currReq.response.headers['Content-Type']
+    dbEntity["accessedEntries"] = list(accessedEntries)
+    # accessedEntries is only kept for introspection, it's the dependency index that is queried.
+    dbEntity.exclude_from_indexes = {"data", "content-type", "accessedEntries", "encoding", "text", "chunks", "etag"}
+
+    data = res.encode("UTF-8") if isinstance(res, str) else res
+    if not isinstance(data, bytes):
+        pass  # stored as it is
+    elif conf.cache_compression_threshold and len(data) >= conf.cache_compression_threshold:
+        dbEntity["encoding"], dbEntity["data"] = _compress(data)
+        dbEntity["text"] = isinstance(res, str)
+    elif len(data) > CHUNK_SIZE:
+        dbEntity["data"] = data
+        dbEntity["text"] = isinstance(res, str)
+
+    dbEntity["etag"] = _etag(dbEntity["data"])
+
+    chunkEntities = []
+    if isinstance(dbEntity["data"], bytes) and len(dbEntity["data"]) > CHUNK_SIZE:
+        data = dbEntity["data"]
+        for index, offset in enumerate(range(0, len(data), CHUNK_SIZE)):
+            chunkEntity = db.Entity(db.Key(viurCacheChunkName, _chunk_name(key, index)))
+            chunkEntity["data"] = data[offset:offset + CHUNK_SIZE]
+            chunkEntity["creationtime"] = dbEntity["creationtime"]
+            chunkEntity["path"] = path  # for flushCache
+            chunkEntity.exclude_from_indexes = {"data"}
+            chunkEntities.append(chunkEntity)
+        dbEntity["data"] = None
+        dbEntity["chunks"] = len(chunkEntities)
+
+    with db.batch():  # written together with the dependency index in a single call
+        for chunkEntity in chunkEntities:
+            db.put(chunkEntity)
+        _put_dependencies(key, path, accessedEntries)
+        db.put(dbEntity)
+    entry = CacheEntry.from_entity(dbEntity, data=data if chunkEntities else None)
+    if conf.cache_front_size > 0:
+        front_cache.put(key, entry)
+    return entry
+
+
+def _put_dependencies(key: str, path: str, accessedEntries: t.Iterable[db.Key | str]) -> None:
+    """
+        Writes the dependency index of the cache entry *key*, replacing the index of a previous build.
+    """
+    dependencies = {_dependency(entry) for entry in accessedEntries}
+    indexNames = {_dependency_index_name(key, dependency) for dependency in dependencies}
+
+    if outdated := [indexKey for indexKey in _dependency_index_keys([key]) if indexKey.name not in indexNames]:
+        db.delete(outdated)
+
+    for dependency in dependencies:
+        indexEntity = db.Entity(db.Key(viurCacheDependencyName, _dependency_index_name(key, dependency)))
+        indexEntity["dependency"] = dependency
+        indexEntity["entry"] = key
+        indexEntity["path"] = path  # for flushCache
+        db.put(indexEntity)
+
+
+def _dependency_index_keys(cacheKeys: t.Iterable[str]) -> list[db.Key]:
+    """
+        Returns the keys of the dependency index entities of the cache entries *cacheKeys*.
+    """
+    return [
+        item.key
+        for cacheKey in cacheKeys
+        for item in db.Query(viurCacheDependencyName).filter("entry =", cacheKey).keys().iter()
+    ]
+
+
+def _dependency(entry: db.Key | str) -> str:
+    """
+        Returns the name of a dependency in the index, for an entity key or a kind from the access log.
+    """
+    if isinstance(entry, db.Key):
+        return f"key:{entry.to_legacy_urlsafe().decode('ASCII')}"
+    return f"kind:{entry}"
+
+
+def _dependency_index_name(key: str, dependency: str) -> str:
+    return f"{key}_{sha256(dependency.encode('UTF-8')).hexdigest()[:32]}"
+
+
+def invalidate(key: db.Key | str | None = None, kind: str | None = None) -> int:
+    """
+        Removes all cache entries depending on an entity or a kind right away, using the dependency index.
+
+        :param key: Removes all cache entries which accessed this entity or executed a query over its kind.
+        :param kind: Removes all cache entries which executed a query over that kind.
+        :returns: The number of cache entries removed.
+    """
+    dependencies = set()
+    if key is not None:
+        if not isinstance(key, db.Key):
+            key = db.Key.from_legacy_urlsafe(key)  # hopefully is a string
+        dependencies |= {_dependency(key), _dependency(key.kind)}
+    if kind is not None:
+        dependencies.add(_dependency(kind))
+
+    indexKeys = []
+    for dependency in dependencies:
+        indexKeys.extend(
+            item.key for item in db.Query(viurCacheDependencyName).filter("dependency =", dependency).keys().iter()
+        )
+
+    cacheKeys = {indexKey.name.rsplit("_", 1)[0] for indexKey in indexKeys}
+    indexKeys = list(set(indexKeys) | set(_dependency_index_keys(cacheKeys)))  # the entries' other dependencies
+    chunkKeys = [
+        db.Key(viurCacheChunkName, _chunk_name(dbRes.key.name, index))
+        for dbRes in (db.get([db.Key(viurCacheName, cacheKey) for cacheKey in cacheKeys]) if cacheKeys else ())
+        for index in range(dbRes.get("chunks") or 0)
+    ]
+    with db.batch():
+        for cacheKey in cacheKeys:
+            db.delete(db.Key(viurCacheName, cacheKey))
+            front_cache.delete(cacheKey)
+        db.delete(indexKeys)
+        db.delete(chunkKeys)
+    if conf.cache_fragment_backend is not None and cacheKeys:
+        conf.cache_fragment_backend.delete(list(cacheKeys))
+
+    if cacheKeys:
+        logging.info(f"Invalidated {len(cacheKeys)} cache entries depending on {key=}, {kind=}")
+    return len(cacheKeys)
+
+
+def _revalidate(key: str, f: t.Callable, self, path: str, args: tuple, kwargs: dict) -> None:
+    """
+        Rebuilds a stale cache entry after the response serving it has been sent.
+    """
+    try:
+        _build(key, f, self, path, args, kwargs)
+        logging.debug(f"Stale cache entry for {path} has been rebuilt.")
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
 def enableCache(urls: list[str], userSensitive: int = 0, languageSensitive: bool = False,
-                evaluatedArgs: list[str] | None = None, maxCacheTime: int | None = None):
+                evaluatedArgs: list[str] | None = None, maxCacheTime: int | None = None,
+                staleWhileRevalidate: int | timedelta | None = None):
     """
         Decorator to wrap this cache around a function. In order for this to function correctly, you must provide
         additional information so ViUR can determine in which situations it's possible to re-use an already cached
@@ -207,11 +858,16 @@ def enableCache(urls: list[str], userSensitive: int = 0, languageSensitive: bool
         :param maxCacheTime: Specifies the maximum time an entry stays in the cache in seconds.
             Note: Its not erased from the db after that time, but it won't be served anymore.
             If None, the cache stays valid forever (until manually erased by calling flushCache.
+        :param staleWhileRevalidate: Specifies how long (in seconds) an entry older than maxCacheTime may
+            still be served. The first request serving such a stale entry rebuilds it after its response
+            has been sent.
     """
     if evaluatedArgs is None:
         evaluatedArgs = []
     assert not any([x.startswith("_") for x in evaluatedArgs]), "A evaluated Parameter cannot start with an underscore!"
-    return lambda f: wrapCallable(f, urls, userSensitive, languageSensitive, evaluatedArgs, maxCacheTime)
+    return lambda f: wrapCallable(
+        f, urls, userSensitive, languageSensitive, evaluatedArgs, maxCacheTime, staleWhileRevalidate
+    )
 
 
 @tasks.CallDeferred
@@ -223,7 +879,7 @@ def flushCache(prefix: str = None, key: db.Key | None = None, kind:  str | None
 
         :param prefix: Path or prefix that should be flushed.
         :param key: Flush all cache entries which may contain this key. Also flushes entries
-            which executed a query over that kind.
+            which executed a query over that kind. See :meth:`invalidate`, which does this right away.
         :param kind: Flush all cache entries which executed a query over that kind.
 
         Examples:
@@ -234,33 +890,271 @@ def flushCache(prefix: str = None, key: db.Key | None = None, kind:  str | None
     if prefix is None and key is None and kind is None:
         prefix = "/*"
     if prefix is not None:
-        items = db.Query(viurCacheName).filter("path =", prefix.rstrip("*")).iter()
-        for item in items:
-            db.delete(item)
-        if prefix.endswith("*"):
-            items = db.Query(viurCacheName) \
-                .filter("path >", prefix.rstrip("*")) \
-                .filter("path <", prefix.rstrip("*") + u"\ufffd") \
-                .iter()
-            for item in items:
-                db.delete(item)
+        front_cache.clear()
+        if conf.cache_fragment_backend is not None and prefix == "/*":
+            conf.cache_fragment_backend.clear()
+        with db.batch():
+            for cacheKind in (viurCacheName, viurCacheChunkName, viurCacheDependencyName):
+                items = db.Query(cacheKind).filter("path =", prefix.rstrip("*")).keys().iter()
+                for item in items:
+                    db.delete(item.key)
+                if prefix.endswith("*"):
+                    items = db.Query(cacheKind) \
+                        .filter("path >", prefix.rstrip("*")) \
+                        .filter("path <", prefix.rstrip("*") + u"\ufffd") \
+                        .keys() \
+                        .iter()
+                    for item in items:
+                        db.delete(item.key)
         logging.debug(f"Flushing cache succeeded. Everything matching {prefix=} is gone.")
-    if key is not None:
-        items = db.Query(viurCacheName).filter("accessedEntries =", key).iter()
-        for item in items:
-            logging.info(f"""Deleted cache entry {item["path"]!r}""")
-            db.delete(item.key)
-        if not isinstance(key, db.Key):
-            key = db.Key.from_legacy_urlsafe(key)  # hopefully is a string
-        items = db.Query(viurCacheName).filter("accessedEntries =", key.kind).iter()
-        for item in items:
-            logging.info(f"""Deleted cache entry {item["path"]!r}""")
-            db.delete(item.key)
-    if kind is not None:
-        items = db.Query(viurCacheName).filter("accessedEntries =", kind).iter()
-        for item in items:
-            logging.info(f"""Deleted cache entry {item["path"]!r}""")
-            db.delete(item.key)
+    if key is not None or kind is not None:
+        invalidate(key=key, kind=kind)
+
+
+class FragmentBackend(abc.ABC):
+    """
+    Storage of the fragment cache, see :func:`fragment` and :attr:`conf.cache_fragment_backend`.
+
+    Fragments are stored together with the entities and kinds accessed while building them.
+    """
+
+    STATS_PATH = "/:fragment"
+    """The path the cache statistics of the fragments in this storage are recorded under"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> tuple[str, list[db.Key | str]] | None:
+        """
+        Returns the fragment *key* and its dependencies, or None if it isn't cached (anymore).
+        """
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, dependencies: list[db.Key | str], ttl: timedelta | None) -> None:
+        """
+        Stores the fragment *key* for *ttl*, or until it's invalidated if *ttl* is None.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete(self, keys: list[str]) -> None:
+        ...
+
+    def clear(self) -> None:
+        """
+        Removes all fragments, if the storage supports it. Fragments which can't be removed expire by their ttl.
+        """
+        pass
+
+
+class LocalFragmentBackend(FragmentBackend):
+    """
+    Keeps the fragments in an LRU cache of this instance, holding up to *size* fragments.
+
+    Invalidations only reach the instance running them, others serve the fragment until its ttl expires.
+    """
+
+    STATS_PATH = "/:fragment:local"
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        self._entries: collections.OrderedDict[str, tuple[str, list, float | None]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[str, list[db.Key | str]] | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            value, dependencies, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, dependencies
+
+    def set(self, key: str, value: str, dependencies: list[db.Key | str], ttl: timedelta | None) -> None:
+        expires = time.monotonic() + ttl.total_seconds() if ttl else None
+        with self._lock:
+            self._entries[key] = (value, dependencies, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys: list[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class MemcacheFragmentBackend(FragmentBackend):
+    """
+    Keeps the fragments in the memcache configured as :attr:`conf.db.memcache_client`.
+    """
+
+    NAMESPACE = "viur-cache-fragment"
+    STATS_PATH = "/:fragment:memcache"
+
+    def get(self, key: str) -> tuple[str, list[db.Key | str]] | None:
+        return conf.db.memcache_client.get(key, namespace=self.NAMESPACE)
+
+    def set(self, key: str, value: str, dependencies: list[db.Key | str], ttl: timedelta | None) -> None:
+        conf.db.memcache_client.set(
+            key, (value, dependencies), time=ttl.total_seconds() if ttl else 0, namespace=self.NAMESPACE
+        )
+
+    def delete(self, keys: list[str]) -> None:
+        conf.db.memcache_client.delete_multi(keys, namespace=self.NAMESPACE)
+
+
+class DatastoreFragmentBackend(FragmentBackend):
+    """
+    Keeps the fragments in the *viur-cache* kind, next to the responses cached by @enableCache.
+    This is the default backend; :func:`invalidate` and :func:`flushCache` remove its fragments along with them.
+    """
+
+    PATH = "/:fragment"
+    """The path of the fragments in the *viur-cache* kind, so flushCache("/*") removes them"""
+    STATS_PATH = PATH
+
+    def get(self, key: str) -> tuple[str, list[db.Key | str]] | None:
+        dbRes = db.get(db.Key(viurCacheName, key))
+        if dbRes is None or (dbRes.get("expires") and dbRes["expires"] < utils.utcNow()):
+            return None
+        return dbRes["data"], dbRes["accessedEntries"]
+
+    def set(self, key: str, value: str, dependencies: list[db.Key | str], ttl: timedelta | None) -> None:
+        dbEntity = db.Entity(db.Key(viurCacheName, key))
+        dbEntity["data"] = value
+        dbEntity["creationtime"] = utils.utcNow()
+        dbEntity["expires"] = dbEntity["creationtime"] + ttl if ttl else None
+        dbEntity["path"] = self.PATH
+        dbEntity["accessedEntries"] = dependencies
+        dbEntity.exclude_from_indexes = {"data", "accessedEntries", "expires"}
+        db.put(dbEntity)
+
+    def delete(self, keys: list[str]) -> None:
+        db.delete([db.Key(viurCacheName, key) for key in keys])
+
+
+_datastore_fragment_backend = DatastoreFragmentBackend()
+
+
+def fragment(name: t.Any, ttl: int | timedelta | None, build: t.Callable[[], str]) -> str:
+    """
+        Returns a fragment (like a section of a template) from the fragment cache, or builds and caches it.
+
+        Like the responses cached by @enableCache, fragments are invalidated when an entity or a kind they
+        accessed changes (see :func:`invalidate`). They are dependencies of the cache entries built around them,
+        even if they're served from the fragment cache.
+
+        :param name: Identifies the fragment; it is combined with the language of the request,
+            :attr:`conf.cache_environment_key` and the application version. Anything else the fragment
+            depends on (like the current user) must be part of the name.
+        :param ttl: How long the fragment is cached (as seconds or timedelta), or None to keep it until it's
+            invalidated. Zero disables caching.
+        :param build: Builds the fragment if it isn't cached. Only strings are cached, they're returned as plain
+            str whether they have been cached or just built (e.g. a Markup is returned as str).
+    """
+    request = current.request.get()
+    if (ttl is not None and not ttl) or conf.debug.disable_cache or (request is not None and request.disableCache) \
+            or not conf.db.create_access_log:
+        return build()
+
+    parts = (name, current.language.get(), conf.instance.app_version)
+    if conf.cache_environment_key:
+        try:
+            parts += (conf.cache_environment_key(),)
+        except RuntimeError:
+            return build()
+
+    key = f"fragment-{blake2b(repr(parts).encode('UTF-8'), digest_size=32).hexdigest()}"
+    backend = conf.cache_fragment_backend or _datastore_fragment_backend
+
+    if (cached := backend.get(key)) is not None:
+        value, dependencies = cached
+        if (accessLog := db.current_db_access_log.get(None)) is not None:
+            accessLog.update(dependencies)
+        cache_stats.record(backend.STATS_PATH, hits=1, bytes=len(value))
+        return value
+
+    oldAccessLog = db.start_data_access_log()
+    start = time.perf_counter()
+    try:
+        res = build()
+    finally:
+        accessedEntries = db.end_data_access_log(oldAccessLog)
+        cache_stats.record(backend.STATS_PATH, misses=1, builds=1, build_time=time.perf_counter() - start)
+
+    if isinstance(res, str):
+        res = str(res)  # the same type as served from the cache
+        with db.batch():
+            _put_dependencies(key, DatastoreFragmentBackend.PATH, accessedEntries)
+            backend.set(key, res, list(accessedEntries), utils.parse.timedelta(ttl) if ttl else None)
+
+    return res
+
+
+class CacheExtension(jinja2.ext.Extension):
+    """
+    Caches a section of a template in the fragment cache, see :func:`fragment`.
+
+    .. code-block:: jinja
+
+        {% cache "navigation", 3600 %}
+            {% for page in getList("page", limit=99) %}...{% endfor %}
+        {% endcache %}
+
+    The first argument names the section within its template, the optional second one is
+    its ttl in seconds; without, the section is cached until it's invalidated.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_cache", args), [], [], body).set_lineno(lineno)
+
+    def _cache(self, template: str, name: t.Any, ttl: int | None, caller: t.Callable[[], str]) -> Markup:
+        # The section has been rendered already, it must not be escaped again
+        return Markup(fragment(("template", template, name), ttl, caller))
+
+
+@tasks.PeriodicTask(interval=timedelta(days=1))
+def cleanup_cache_stats() -> None:
+    """
+        Removes the statistics flushed to the *viur-cache-stats* kind, which are older than
+        :attr:`conf.cache_stats_retention`.
+        Does nothing unless :attr:`conf.cache_stats_flush_interval` is set.
+    """
+    if conf.cache_stats_flush_interval is None:
+        return
+
+    tasks.DeleteEntitiesIter.startIterOnQuery(
+        db.Query(viurCacheStatsName).filter("creationtime <", utils.utcNow() - conf.cache_stats_retention).keys()
+    )
 
 
-__all__ = ["enableCache", "flushCache"]
+__all__ = [
+    "cache_stats",
+    "CacheExtension",
+    "DatastoreFragmentBackend",
+    "enableCache",
+    "flushCache",
+    "fragment",
+    "FragmentBackend",
+    "front_cache",
+    "invalidate",
+    "KeyPlan",
+    "LocalFragmentBackend",
+    "MemcacheFragmentBackend",
+    "statistics",
+]
@@ -15,6 +15,9 @@ from viur.core.current import user as current_user
 
 if t.TYPE_CHECKING:  # pragma: no cover
     from viur.core.bones.text import HtmlBoneConfiguration
+    from viur.core.cache import FragmentBackend
+    from viur.core.ratelimit import RateLimitBackend
+    from viur.core.session import SessionBackend
     from viur.core.email import EmailTransport
     from viur.core.skeleton import SkeletonInstance
     from viur.core.module import Module
@@ -320,12 +323,73 @@ class Database(ConfigType):
     query_default_limit: int = 30
     """Sets the default query limit for all queries."""
 
+    multi_query_workers: int = 4
+    """
+    Number of threads used to run the queries of a multi-query (like IN-filters or spatial queries) concurrently.
+    A value of 1 (or less) runs them one after another.
+    """
+
     memcache_client: Client | None = None
     """If set, ViUR cache data for the db.get in the Memcache for faster access."""
 
+    cache_entities: bool = False
+    """
+    Enables the read-through/write-invalidate entity cache in the Memcache
+    (requires `memcache_client` or `cache_local_size`).
+
+    When enabled, :func:`db.get` looks up entities in the Memcache first and only fetches missing keys
+    from the Datastore. :func:`db.put` and :func:`db.delete` invalidate the affected entries; inside a
+    transaction, the invalidation is repeated after the transaction has been committed.
+    """
+
+    cache_local_size: int = 0
+    """
+    Number of entries the entity cache (see `cache_entities`) keeps in an LRU cache of each instance,
+    in front of the Memcache; 0 disables it. Keys that don't exist are remembered as well.
+    """
+
+    cache_local_ttl: datetime.timedelta = datetime.timedelta(seconds=5)
+    """
+    Time entries are kept in the local cache. Writes on other instances can't invalidate it,
+    so it may serve outdated entities for this time.
+    """
+
+    cache_local_kinds: t.Optional[set[str]] = None
+    """If set, only entities of these kinds are kept in the local cache."""
+
+    identity_map: bool = False
+    """
+    Enables a request-scoped identity map for :func:`db.get`.
+
+    Repeated lookups of the same key within one request (and outside of transactions) are served from the
+    entities already fetched; :func:`db.put` and :func:`db.delete` remove the affected keys from the map.
+    Use :func:`db.get_identity_map` to inspect how many lookups have been avoided.
+    """
+
     create_access_log: bool = True
     """If False no access log will be created. But then the caching is disabled too."""
 
+    stats: bool = False
+    """
+    Collects statistics on the datastore calls of each request (calls, entities, bytes and time spent
+    by operation), which are available as :attr:`db.current_db_stats` while the request is processed.
+    """
+
+    stats_server_timing: bool = False
+    """
+    Emits the statistics collected by `stats` in a ``Server-Timing`` header.
+    Don't enable this in production unless the timings may be disclosed to every client.
+    """
+
+    stats_log: bool = False
+    """Logs a summary line of the statistics collected by `stats` at the end of each request."""
+
+    stats_exporter: t.Optional[t.Callable[["db.DatabaseStats"], None]] = None
+    """
+    Called with the statistics collected by `stats` at the end of each request, e.g. to export them
+    into a metrics pipeline. The request is still available as :attr:`current.request`.
+    """
+
 
 class Security(ConfigType):
     """Security related settings"""
@@ -430,6 +494,19 @@ class Security(ConfigType):
     password_recovery_key_length: int = 42
     """Length of the Password recovery key"""
 
+    stateless_skeys: bool = False
+    """Issue CSRF-security-keys as signed, expiring tokens instead of datastore entities,
+    see :func:`viur.core.securitykey.create`."""
+
+    stateless_skeys_max_data: int = 256
+    """Maximum size in bytes of the JSON-serialized custom data of a stateless CSRF-security-key;
+    security-keys with larger payloads are stored in the datastore."""
+
+    ratelimit_backend: t.Optional["RateLimitBackend"] = None
+    """Storage of the attempts counted by :class:`viur.core.ratelimit.RateLimit`. Defaults to the datastore;
+    use :class:`viur.core.ratelimit.MemcacheRateLimitBackend` or, on a single instance,
+    :class:`viur.core.ratelimit.LocalRateLimitBackend` to avoid a datastore transaction per attempt."""
+
     closed_system: bool = False
     """If `True` it activates a mode in which only authenticated users can access all routes."""
 
@@ -705,6 +782,24 @@ class User(ConfigType):
     The preset roles are for guidiance, and already fit to most projects.
     """
 
+    session_backend: t.Optional["SessionBackend"] = None
+    """Storage of the sessions, see :class:`viur.core.session.SessionBackend`. Defaults to the datastore;
+    use :class:`viur.core.session.MemcacheSessionBackend` to serve them from the memcache."""
+
+    session_guest_cookie: bool = False
+    """Keep the sessions of guests inside a signed cookie instead of the session backend, as long as their data is
+    JSON-serializable and fits into :attr:`session_guest_cookie_max_size`. Such sessions are moved into the session
+    backend on login, or when they grow too large. Requires :attr:`session_secret` or :attr:`conf.file_hmac_key`."""
+
+    session_guest_cookie_encrypt: bool = False
+    """Encrypt the guest session cookies, so the client can't read their data. Requires the cryptography package."""
+
+    session_guest_cookie_max_size: int = 3072
+    """Maximum length in bytes of a guest session cookie value"""
+
+    session_secret: t.Optional[bytes] = None
+    """Secret to sign (and encrypt) the guest session cookies with; defaults to :attr:`conf.file_hmac_key`"""
+
     session_life_time: datetime.timedelta = datetime.timedelta(hours=1)
     """Default is 60 minutes lifetime for ViUR sessions"""
 
@@ -877,6 +972,41 @@ class Conf(ConfigType):
     """If set, this function will be called for each cache-attempt
     and the result will be included in the computed cache-key"""
 
+    cache_front_size: int = 0
+    """Size in bytes of the LRU cache each instance keeps in front of the cache of @enableCache; 0 disables it."""
+
+    cache_front_ttl: datetime.timedelta = datetime.timedelta(seconds=30)
+    """Time entries are kept in the front cache. Flushes on other instances can't invalidate it,
+    so it may serve outdated responses for this time."""
+
+    cache_compression_threshold: int = 1024
+    """Responses cached by @enableCache of at least this size in bytes are stored compressed (with brotli if it is
+    installed, gzip otherwise) and served that way to clients accepting the encoding; 0 disables compression."""
+
+    cache_compression_level: int = 5
+    """Quality (0-11) of the brotli compression of cached responses; the compression runs within the request
+    building the entry, so the slowest levels may cost more than the cache saves."""
+
+    cache_single_flight_timeout: datetime.timedelta = datetime.timedelta(seconds=10)
+    """Time concurrent requests wait for a cache entry being built by another request (or instance),
+    before they build it on their own."""
+
+    cache_fragment_backend: t.Optional["FragmentBackend"] = None
+    """Storage of the fragment cache (used by {% cache %} in templates and execRequest's cachetime),
+    see :class:`viur.core.cache.FragmentBackend`. Defaults to the datastore."""
+
+    cache_stats_flush_interval: t.Optional[datetime.timedelta] = None
+    """If set, each instance writes its cache statistics (hits, misses, build time per path) to the datastore
+    in this interval, see :func:`viur.core.cache.statistics`."""
+
+    cache_stats_retention: datetime.timedelta = datetime.timedelta(days=7)
+    """Time the cache statistics written to the datastore are kept."""
+
+    cache_invalidate_on_write: bool = False
+    """If set, Skeleton.write and Skeleton.delete invalidate the cache entries depending on the entity (or its kind)
+    right away (or once the surrounding transaction has been committed), see :meth:`viur.core.cache.invalidate`.
+    The prototypes then skip their deferred :meth:`viur.core.cache.flushCache`."""
+
     # FIXME VIUR4: REMOVE ALL COMPATIBILITY MODES!
     compatibility: Multiple[str] = [
         # "json.bone.structure.camelcasenames",  # use camelCase attribute names (see #637 for details)
@@ -947,6 +1077,10 @@ class Conf(ConfigType):
     search_valid_chars: str = "abcdefghijklmnopqrstuvwxyzäöüß0123456789"
     """Characters valid for the internal search functionality (all other chars are ignored)"""
 
+    skeleton_etags: bool = False
+    """If set, the view and list actions of List modules emit weak ETags derived from the keys and change dates
+    of the entries, and answer a matching If-None-Match with 304 Not Modified before rendering."""
+
     skeleton_search_path: Multiple[str] = [
         "/skeletons/",  # skeletons of the project
         "/viur/core/",  # system-defined skeletons of viur-core
@@ -1006,6 +1140,17 @@ class Conf(ConfigType):
     The default queue can be changed by overwriting `"__default__"`.
     """
 
+    tasks_enqueue_after_response: bool = False
+    """
+    Collect the @CallDeferred tasks created during a request and create them concurrently after the response
+    has been sent, instead of creating each one synchronously while the request is handled.
+    Tasks created inside a transaction are only collected once the transaction has been committed.
+    Identical unnamed calls of functions decorated with ``@CallDeferred(deduplicate=True)`` are created only once.
+
+    The collected tasks are lost if the instance dies before the response has been sent;
+    use :func:`viur.core.tasks.flush_deferred_tasks` where they must be enqueued before answering.
+    """
+
     valid_application_ids: list[str] = ["*"]
     """Which application-ids we're supposed to run on"""
 
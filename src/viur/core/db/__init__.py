@@ -2,30 +2,42 @@ import logging
 import warnings
 
 from . import cache
+from .backends import Backend, DatastoreBackend
 from .config import conf as config
+from .memory import MemoryBackend
 from .query import Query
 # new exports for 3.8
 from .transport import (
     allocate_ids,
     AllocateIDs,
+    batch,
+    Batch,
     count,
     Count,
     delete,
     Delete,
     get,
     Get,
+    get_backend,
+    get_identity_map,
+    on_commit,
     put,
     Put,
     run_in_transaction,
     RunInTransaction,
+    set_backend,
 )
 from .types import (
     current_db_access_log,
+    current_db_stats,
     DATASTORE_BASE_TYPES,
+    DatabaseStats,
     Entity,
+    IdentityMap,
     KEY_SPECIAL_PROPERTY,
     Key,
     KeyType,
+    OperationStats,
     QueryDefinition,
     SortOrder,
 )
@@ -52,6 +64,9 @@ __all__ = [
     "DATASTORE_BASE_TYPES",
     "SortOrder",
     "Entity",
+    "IdentityMap",
+    "DatabaseStats",
+    "OperationStats",
     "QueryDefinition",
     "Key",
     "KeyType",
@@ -66,6 +81,7 @@ __all__ = [
     "RunInTransaction",
     "IsInTransaction",
     "current_db_access_log",
+    "current_db_stats",
     "GetOrInsert",
     "encodeKey",
     "acquire_transaction_success_marker",
@@ -76,10 +92,19 @@ __all__ = [
     "cache",
     # new exports
     "allocate_ids",
+    "Backend",
+    "batch",
+    "Batch",
+    "DatastoreBackend",
     "get",
+    "get_backend",
+    "get_identity_map",
+    "MemoryBackend",
     "put",
     "is_in_transaction",
+    "on_commit",
     "run_in_transaction",
+    "set_backend",
     "count",
     "get_or_insert",
     "normalize_key",
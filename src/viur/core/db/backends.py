@@ -0,0 +1,214 @@
+"""
+The storage backends used by :mod:`viur.core.db.transport`.
+
+The transport layer doesn't talk to the datastore directly, but through a :class:`Backend`.
+By default, this is a :class:`DatastoreBackend` wrapping a :class:`google.cloud.datastore.Client`;
+other backends (like the in-process :class:`viur.core.db.memory.MemoryBackend`) can be installed
+with :func:`viur.core.db.set_backend`.
+"""
+from __future__ import annotations
+
+import abc
+import typing as t
+
+from google.cloud import datastore
+
+from .types import Entity, Key, QueryDefinition, SortOrder
+
+
+class Backend(abc.ABC):
+    """
+    Interface of the storage behind :mod:`viur.core.db.transport`.
+
+    The names and signatures of its methods follow :class:`google.cloud.datastore.Client`,
+    queries are passed as :class:`QueryDefinition` instead.
+    """
+
+    @property
+    @abc.abstractmethod
+    def project(self) -> str:
+        """The project the keys of this backend belong to"""
+        ...
+
+    @property
+    @abc.abstractmethod
+    def current_transaction(self) -> t.Any:
+        """
+        The transaction running in the current thread, or None outside of transactions.
+        The transaction must provide an unique ``id``.
+        """
+        ...
+
+    @abc.abstractmethod
+    def transaction(self) -> t.ContextManager:
+        """
+        Returns a context manager which runs its block in a new transaction.
+        The transaction is committed when the block is left, or rolled back if the block raises an exception.
+
+        :raises google.cloud.exceptions.Conflict: If the transaction could not be committed.
+        """
+        ...
+
+    def get(self, key: Key) -> t.Optional[Entity]:
+        """
+        Returns the entity stored under *key*, or None if it does not exist.
+        """
+        res = self.get_multi([key])
+        return res[0] if res else None
+
+    @abc.abstractmethod
+    def get_multi(self, keys: list[Key]) -> list[Entity]:
+        """
+        Returns the entities stored under *keys*; keys which do not exist are omitted.
+        """
+        ...
+
+    def put(self, entity: Entity) -> None:
+        """
+        Writes *entity*. If its key is incomplete, it is completed by the backend.
+        """
+        self.put_multi([entity])
+
+    @abc.abstractmethod
+    def put_multi(self, entities: list[Entity]) -> None:
+        """
+        Writes *entities*. Incomplete keys are completed by the backend.
+        """
+        ...
+
+    def delete(self, key: Key) -> None:
+        """
+        Deletes the entity stored under *key*.
+        """
+        self.delete_multi([key])
+
+    @abc.abstractmethod
+    def delete_multi(self, keys: list[Key]) -> None:
+        """
+        Deletes the entities stored under *keys*.
+        """
+        ...
+
+    @abc.abstractmethod
+    def allocate_ids(self, incomplete_key: Key, num_ids: int, retry=None, timeout=None) -> list[Key]:
+        """
+        Returns *num_ids* complete keys based on *incomplete_key*, which won't be assigned to any other entity.
+        """
+        ...
+
+    @abc.abstractmethod
+    def run_query(self, query: QueryDefinition, limit: int) -> tuple[list[Entity], t.Optional[bytes]]:
+        """
+        Runs a single query definition (filters, orders, distinct, cursors, keys-only or projection).
+
+        :param query: The query to run
+        :param limit: How many results should at most be returned
+        :return: The results in the order given by the query, and a cursor pointing behind the last result
+            (or None if there are no more results).
+        """
+        ...
+
+    @abc.abstractmethod
+    def count(self, query: QueryDefinition, up_to: int) -> int:
+        """
+        Returns the number of entities matching the filters of *query*, but at most *up_to*.
+        """
+        ...
+
+
+class DatastoreBackend(Backend):
+    """
+    Backend for the Google Cloud Datastore (and its emulator).
+
+    Attributes not provided by this class are looked up on the wrapped client, so it can
+    be used wherever a :class:`google.cloud.datastore.Client` has been used before.
+    """
+
+    def __init__(self, client: t.Optional[datastore.Client] = None):
+        self.client = client or datastore.Client()
+
+    def __getattr__(self, attr: str) -> t.Any:
+        return getattr(self.client, attr)
+
+    @property
+    def project(self) -> str:
+        return self.client.project
+
+    @property
+    def current_transaction(self) -> t.Optional[datastore.Transaction]:
+        return self.client.current_transaction
+
+    def transaction(self) -> datastore.Transaction:
+        return self.client.transaction()
+
+    def get(self, key: Key) -> t.Optional[Entity]:
+        return self.client.get(key)
+
+    def get_multi(self, keys: list[Key]) -> list[Entity]:
+        return self.client.get_multi(keys)
+
+    def put(self, entity: Entity) -> None:
+        return self.client.put(entity)
+
+    def put_multi(self, entities: list[Entity]) -> None:
+        return self.client.put_multi(entities=entities)
+
+    def delete(self, key: Key) -> None:
+        return self.client.delete(key)
+
+    def delete_multi(self, keys: list[Key]) -> None:
+        return self.client.delete_multi(keys)
+
+    def allocate_ids(self, incomplete_key: Key, num_ids: int, retry=None, timeout=None) -> list[Key]:
+        return self.client.allocate_ids(incomplete_key, num_ids, retry, timeout)
+
+    def _build_query(self, query: QueryDefinition) -> datastore.Query:
+        qry = self.client.query(kind=query.kind)
+
+        if query.filters:
+            for k, v in query.filters.items():
+                key, op = k.split(" ")
+                if not isinstance(v, list):  # multi equal filters
+                    v = [v]
+                for val in v:
+                    f = datastore.query.PropertyFilter(key, op, val)
+                    qry.add_filter(filter=f)
+
+        return qry
+
+    def run_query(self, query: QueryDefinition, limit: int) -> tuple[list[Entity], t.Optional[bytes]]:
+        qry = self._build_query(query)
+        hasInvertedOrderings = None
+
+        if query.orders:
+            hasInvertedOrderings = any(
+                [
+                    x[1] in [SortOrder.InvertedAscending, SortOrder.InvertedDescending]
+                    for x in query.orders
+                ]
+            )
+            qry.order = [
+                x[0] if x[1] in [SortOrder.Ascending, SortOrder.InvertedDescending] else f"-{x[0]}"
+                for x in query.orders
+            ]
+
+        if query.distinct:
+            qry.distinct_on = query.distinct
+
+        if query.keys_only:
+            qry.keys_only()
+        elif query.projection:
+            qry.projection = query.projection
+
+        qryRes = qry.fetch(limit=limit, start_cursor=query.startCursor, end_cursor=query.endCursor)
+        res = list(qryRes)
+
+        if hasInvertedOrderings:
+            res.reverse()
+
+        return res, qryRes.next_page_token
+
+    def count(self, query: QueryDefinition, up_to: int) -> int:
+        aggregation_query = self.client.aggregation_query(self._build_query(query))
+        result = aggregation_query.count(alias="total").fetch(limit=up_to)
+        return list(result)[0][0].value
@@ -1,15 +1,28 @@
+import collections
+import copy
 import datetime
 import logging
 import sys
+import threading
+import time
 import typing as t
+import zlib
+
+from google.cloud import datastore
+from google.cloud.datastore_v1.types import entity as entity_pb2
 
 from viur.core.config import conf
+from .overrides import entity_from_protobuf
 from .types import Entity, Key
 
 MEMCACHE_MAX_BATCH_SIZE = 30
 MEMCACHE_NAMESPACE = "viur-datastore"
 MEMCACHE_TIMEOUT: int | datetime.timedelta = datetime.timedelta(days=1)
 MEMCACHE_MAX_SIZE: t.Final[int] = 1_000_000
+MEMCACHE_COMPRESSION_THRESHOLD: int | None = 1024
+"""Entities encoded larger than this number of bytes are compressed; None disables compression"""
+MEMCACHE_LOCK_TIMEOUT: int = 32
+"""Seconds a write locks the memcache entries of its entities, so concurrent reads can't put back the old state"""
 TESTBED = None
 """
 
@@ -20,6 +33,13 @@ TESTBED = None
     from viur.core import conf
     from google.appengine.api.memcache import Client
     conf.db.memcache_client = Client()
+
+    Entries are only filled if they are neither cached nor locked. Writes lock the entries of their entities
+    for :const:`MEMCACHE_LOCK_TIMEOUT` seconds instead of deleting them, so a read which has fetched an entity
+    before it has been written can't put the outdated entity back into the cache.
+
+    Optionally, a per-instance LRU cache with a short TTL is put in front of the Memcache,
+    which also remembers keys that don't exist (see :attr:`conf.db.cache_local_size`).
 """
 
 __all__ = [
@@ -27,30 +47,162 @@ __all__ = [
     "MEMCACHE_NAMESPACE",
     "MEMCACHE_TIMEOUT",
     "MEMCACHE_MAX_SIZE",
+    "MEMCACHE_COMPRESSION_THRESHOLD",
+    "MEMCACHE_LOCK_TIMEOUT",
+    "LocalCache",
+    "local_cache",
     "get",
+    "lookup",
     "put",
+    "put_missing",
     "delete",
     "flush",
+    "serialize",
+    "deserialize",
 ]
 
+_FORMAT_PROTOBUF: t.Final[bytes] = b"\x01"
+_FORMAT_ZLIB: t.Final[bytes] = b"\x02"
+_LOCKED: t.Final[bytes] = b"\x00"
+"""The value of memcache entries locked by a write"""
+
+
+class LocalCache:
+    """
+    Size-bounded LRU cache of this instance, which is put in front of the Memcache.
+
+    It stores entities (or None for keys known not to exist) for :attr:`conf.db.cache_local_ttl`,
+    as writes on other instances can't invalidate it. Only keys of kinds in
+    :attr:`conf.db.cache_local_kinds` are cached, if set.
+    """
+
+    def __init__(self):
+        self._entries: collections.OrderedDict[tuple[str, str], tuple[float, t.Optional[Entity]]] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def accepts(key: t.Union[Key, str]) -> bool:
+        """
+        Returns if *key* may be cached, according to the configuration.
+        """
+        if conf.db.cache_local_size <= 0:
+            return False
+
+        if conf.db.cache_local_kinds is None:
+            return True
+
+        return isinstance(key, Key) and key.kind in conf.db.cache_local_kinds
+
+    def get(self, namespace: str, key: t.Union[Key, str]) -> tuple[bool, t.Optional[Entity]]:
+        """
+        Looks up *key*.
+
+        :return: If the key has been found, and the cached entity or None if the key is known not to exist.
+        """
+        entry_key = (namespace, str(key))
+
+        with self._lock:
+            if (entry := self._entries.get(entry_key)) is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(entry_key)
+
+            if entry[1] is None:
+                self.negative_hits += 1
+                return True, None
+
+            self.hits += 1
+
+        return True, copy.deepcopy(entry[1])
+
+    def put(self, namespace: str, key: t.Union[Key, str], entity: t.Optional[Entity]) -> None:
+        """
+        Caches *entity* under *key*; None remembers that *key* does not exist.
+        """
+        entry = (time.monotonic() + conf.db.cache_local_ttl.total_seconds(), copy.deepcopy(entity))
+
+        with self._lock:
+            self._entries[(namespace, str(key))] = entry
+            self._entries.move_to_end((namespace, str(key)))
+
+            while len(self._entries) > conf.db.cache_local_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, namespace: str, key: t.Union[Key, str]) -> None:
+        with self._lock:
+            self._entries.pop((namespace, str(key)), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of cached entries, hits, negative hits and misses.
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+        }
+
+
+local_cache = LocalCache()
+"""The local cache of this instance"""
+
 
 def get(keys: t.Union[Key, list[Key]], namespace: t.Optional[str] = None) -> t.Union[Entity, list[Entity], None]:
     """
-    Reads data form the memcache.
+    Reads data form the local cache and the memcache.
     :param keys: Unique identifier(s) for one or more entry(s).
     :param namespace: Optional namespace to use.
     :return: The entity (or None if it has not been found), or a list of entities.
     """
-    if not check_for_memcache():
-        return None
-
-    namespace = namespace or MEMCACHE_NAMESPACE
     single_request = not isinstance(keys, (list, tuple, set))
     if single_request:
         keys = [keys]
-    keys = [str(key) for key in keys]  # Enforce that all keys are strings
+    result = [entity for entity in lookup(keys, namespace).values() if entity is not None]
+
+    if single_request:
+        return result[0] if result else None
+    return result if result else None
+
+
+def lookup(
+    keys: t.Iterable[t.Union[Key, str]],
+    namespace: t.Optional[str] = None,
+) -> dict[t.Union[Key, str], t.Optional[Entity]]:
+    """
+    Looks up *keys* in the local cache and the memcache.
+    :param keys: Unique identifiers of the entries.
+    :param namespace: Optional namespace to use.
+    :return: The entries found, by their key; None for keys which are known not to exist.
+    """
+    namespace = namespace or MEMCACHE_NAMESPACE
+    result = {}
+    remaining = []
+
+    for key in keys:
+        if local_cache.accepts(key) and (cached := local_cache.get(namespace, key))[0]:
+            result[key] = cached[1]
+        else:
+            remaining.append(key)
+
+    if not remaining or not check_for_memcache(warn=not conf.db.cache_local_size):
+        return result
+
+    keys_by_str = {str(key): key for key in remaining}  # Enforce that all keys are strings
+    keys = list(keys_by_str)
     cached_data = {}
-    result = []
     try:
         while keys:
             cached_data |= conf.db.memcache_client.get_multi(keys[:MEMCACHE_MAX_BATCH_SIZE], namespace=namespace)
@@ -58,12 +210,23 @@ def get(keys: t.Union[Key, list[Key]], namespace: t.Optional[str] = None) -> t.U
     except Exception as e:
         logging.error(f"""Failed to get keys form the memcache with {e=}""")
     for key, value in cached_data.items():
-        entity = Entity(Key(key))
-        entity |= value
-        result.append(entity)
-    if single_request:
-        return result[0] if result else None
-    return result if result else None
+        if value == _LOCKED:
+            continue  # written recently, must be read from the datastore
+        if isinstance(value, bytes):
+            try:
+                entity = deserialize(value)
+            except Exception as e:
+                logging.error(f"""Failed to decode {key=} from the memcache with {e=}""")
+                continue
+        elif isinstance(value, Entity):
+            entity = value
+        else:
+            entity = Entity(Key.from_legacy_urlsafe(key))
+            entity |= value
+        result[keys_by_str[key]] = entity
+        if local_cache.accepts(keys_by_str[key]):
+            local_cache.put(namespace, keys_by_str[key], entity)
+    return result
 
 
 def put(
@@ -72,15 +235,15 @@ def put(
     timeout: t.Optional[t.Union[int, datetime.timedelta]] = None
 ) -> bool:
     """
-    Writes Data to the memcache.
+    Fills the local cache and the memcache with entities read from the datastore.
+
+    Memcache entries which already exist (or are locked by a concurrent write, see :func:`delete`) are left alone,
+    as *data* may be outdated then.
     :param data: Data to write
     :param namespace: Optional namespace to use.
     :param timeout: Optional timeout in seconds or a timedelta object.
     :return: A boolean indicating success.
     """
-    if not check_for_memcache():
-        return False
-
     namespace = namespace or MEMCACHE_NAMESPACE
     timeout = timeout or MEMCACHE_TIMEOUT
     if isinstance(timeout, datetime.timedelta):
@@ -92,47 +255,99 @@ def put(
         data = {data.key: data}
     elif not isinstance(data, dict):
         raise TypeError(f"Invalid type {type(data)}. Expected a db.Entity, list or dict.")
+
+    if not check_for_memcache(warn=not conf.db.cache_local_size):
+        for key, value in data.items():
+            if local_cache.accepts(key):
+                local_cache.put(namespace, key, value)
+
+        return bool(conf.db.cache_local_size)
+
     # Add only values to cache <= MEMMAX_SIZE (1.000.000)
-    data = {str(key): value for key, value in data.items() if get_size(value) <= MEMCACHE_MAX_SIZE}
+    encoded_data = {}
+    for key, value in data.items():
+        if isinstance(value, Entity):
+            try:
+                value = serialize(value)
+            except Exception as e:
+                logging.error(f"""Failed to encode {key=} for the memcache with {e=}""")
+                continue
+            size = len(value)
+        else:
+            size = get_size(value)
+
+        if size <= MEMCACHE_MAX_SIZE:
+            encoded_data[str(key)] = value
 
-    keys = list(data.keys())
+    keys = list(encoded_data.keys())
+    rejected = set()
     try:
         while keys:
-            data_batch = {key: data[key] for key in keys[:MEMCACHE_MAX_BATCH_SIZE]}
-            conf.db.memcache_client.set_multi(data_batch, namespace=namespace, time=timeout)
+            data_batch = {key: encoded_data[key] for key in keys[:MEMCACHE_MAX_BATCH_SIZE]}
+            rejected.update(conf.db.memcache_client.add_multi(data_batch, namespace=namespace, time=timeout) or ())
             keys = keys[MEMCACHE_MAX_BATCH_SIZE:]
-        return True
     except Exception as e:
         logging.error(f"""Failed to put data to the memcache with {e=}""")
         return False
 
+    # The local cache must not keep what the memcache rejected either
+    for key, value in data.items():
+        if str(key) in encoded_data and str(key) not in rejected and local_cache.accepts(key):
+            local_cache.put(namespace, key, value)
+
+    return True
+
+
+def put_missing(keys: t.Iterable[t.Union[Key, str]], namespace: t.Optional[str] = None) -> None:
+    """
+    Remembers in the local cache that the entries with *keys* don't exist.
+    :param keys: Unique identifiers of the entries.
+    :param namespace: Optional namespace to use.
+    """
+    namespace = namespace or MEMCACHE_NAMESPACE
+
+    for key in keys:
+        if local_cache.accepts(key):
+            local_cache.put(namespace, key, None)
+
 
 def delete(keys: t.Union[Key, list[Key]], namespace: t.Optional[str] = None) -> None:
     """
-    Deletes an Entry form memcache.
+    Deletes an Entry form the local cache and locks it in the memcache for :const:`MEMCACHE_LOCK_TIMEOUT` seconds,
+    so reads which have fetched it before can't fill it again.
     :param keys: Unique identifier(s) for one or more entry(s).
     :param namespace: Optional namespace to use.
     """
-    if not check_for_memcache():
-        return None
-
     namespace = namespace or MEMCACHE_NAMESPACE
     if not isinstance(keys, list):
         keys = [keys]
+
+    for key in keys:
+        local_cache.delete(namespace, key)
+
+    if not check_for_memcache(warn=not conf.db.cache_local_size):
+        return None
+
     keys = [str(key) for key in keys]  # Enforce that all keys are strings
     try:
         while keys:
-            conf.db.memcache_client.delete_multi(keys[:MEMCACHE_MAX_BATCH_SIZE], namespace=namespace)
+            conf.db.memcache_client.set_multi(
+                dict.fromkeys(keys[:MEMCACHE_MAX_BATCH_SIZE], _LOCKED),
+                namespace=namespace,
+                time=MEMCACHE_LOCK_TIMEOUT
+            )
             keys = keys[MEMCACHE_MAX_BATCH_SIZE:]
     except Exception as e:
-        logging.error(f"""Failed to delete keys form the memcache with {e=}""")
+        logging.error(f"""Failed to lock keys in the memcache with {e=}""")
 
 
 def flush() -> bool:
     """
-    Deletes everything in memcache.
+    Deletes everything in the local cache and the memcache.
     :return: A boolean indicating success.
     """
+    local_cache.clear()
+
     if not check_for_memcache():
         return False
     try:
@@ -143,6 +358,35 @@ def flush() -> bool:
     return True
 
 
+def serialize(entity: Entity) -> bytes:
+    """
+    Encodes *entity* for the memcache, in the datastore's protobuf format.
+    The encoded entity is compressed if it is larger than :const:`MEMCACHE_COMPRESSION_THRESHOLD`.
+    """
+    data = datastore.helpers.entity_to_protobuf(entity)._pb.SerializeToString()
+
+    if MEMCACHE_COMPRESSION_THRESHOLD is not None and len(data) > MEMCACHE_COMPRESSION_THRESHOLD:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return _FORMAT_ZLIB + compressed
+
+    return _FORMAT_PROTOBUF + data
+
+
+def deserialize(data: bytes) -> Entity:
+    """
+    Decodes an entity encoded by :func:`serialize`.
+    """
+    encoding, data = data[:1], data[1:]
+
+    if encoding == _FORMAT_ZLIB:
+        data = zlib.decompress(data)
+    elif encoding != _FORMAT_PROTOBUF:
+        raise ValueError(f"Unknown encoding {encoding!r}")
+
+    return entity_from_protobuf(entity_pb2.Entity.deserialize(data))
+
+
 def get_size(obj: t.Any) -> int:
     """
     Utility function that counts the size of an object in bytes.
@@ -155,9 +399,10 @@ def get_size(obj: t.Any) -> int:
     return sys.getsizeof(obj)
 
 
-def check_for_memcache() -> bool:
+def check_for_memcache(warn: bool = True) -> bool:
     if conf.db.memcache_client is None:
-        logging.warning(f"""conf.db.memcache_client is 'None'. It can not be used.""")
+        if warn:
+            logging.warning(f"""conf.db.memcache_client is 'None'. It can not be used.""")
         return False
     init_testbed()
     return True
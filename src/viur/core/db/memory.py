@@ -0,0 +1,329 @@
+"""
+An in-process stand-in for the datastore, to run tests and benchmarks without the Cloud Datastore or its emulator.
+
+.. code-block:: python
+
+    from viur.core import db
+    from viur.core.db.memory import MemoryBackend
+
+    db.set_backend(MemoryBackend())
+"""
+from __future__ import annotations
+
+import base64
+import copy
+import itertools
+import operator
+import secrets
+import threading
+import typing as t
+
+from google.cloud import exceptions
+
+from viur.core.config import conf
+from .backends import Backend
+from .types import Entity, KEY_SPECIAL_PROPERTY, Key, QueryDefinition, SortKey, SortOrder, sort_value
+
+_OPERATORS: t.Final[dict[str, t.Callable[[t.Any, t.Any], bool]]] = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+"""The filter operators supported by the datastore (IN and != filters are resolved by :class:`db.Query`)"""
+
+MAX_CURSORS: t.Final[int] = 10_000
+"""Number of cursors the backend remembers; older cursors become invalid"""
+
+
+def _indexed_values(entity: Entity, name: str) -> list:
+    """
+    Returns the indexed values of property *name* of *entity*, as the datastore sees them.
+    Lists are flattened, properties of embedded entities are addressed by a dotted path
+    and properties excluded from indexes have no values at all.
+    """
+    if name == KEY_SPECIAL_PROPERTY:
+        return [entity.key]
+
+    values = [entity]
+    parts = (name,) if name in entity else name.split(".")
+
+    for part in parts:
+        next_values = []
+
+        for value in values:
+            if isinstance(value, dict) and part in value \
+                    and part not in (getattr(value, "exclude_from_indexes", None) or ()):
+                value = value[part]
+                next_values.extend(value if isinstance(value, list) else (value,))
+
+        values = next_values
+
+    return values
+
+
+class MemoryTransaction:
+    """
+    A transaction of the :class:`MemoryBackend`.
+
+    Transactions are serialized, so they never conflict. Like in the datastore, reads inside a transaction
+    return the committed state, the writes of the transaction become visible when it has been committed.
+    """
+
+    def __init__(self, backend: MemoryBackend, id: int):
+        self.backend = backend
+        self.id = id
+        self.mutations: dict[Key, t.Optional[Entity]] = {}  # key -> copy of the entity to put, or None to delete
+        self.incomplete: list[tuple[Entity, Entity]] = []  # (entity, copy) of entities without a complete key
+
+    def __enter__(self) -> t.Self:
+        if self.backend.current_transaction is not None:
+            raise ValueError("Nested transactions are not supported")
+
+        self.backend._transaction_lock.acquire()
+        self.backend._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.backend._commit(self)
+        finally:
+            self.backend._local.transaction = None
+            self.backend._transaction_lock.release()
+
+
+class MemoryBackend(Backend):
+    """
+    Keeps all entities in memory and evaluates queries like the datastore does:
+
+    - Filters match if any value of a multi-valued property matches, all inequality filters
+      on the same property must be matched by the same value.
+    - Values of different types are compared and sorted by the datastore's order of value types.
+    - Entities without a value for a filtered or sorted property, or with that property excluded
+      from indexes, are not part of the result.
+    - Results are ordered by their keys after all sort orders, cursors point behind the last result.
+
+    It is thread-safe, but not shared between processes. Use :meth:`clear` to reset it.
+    """
+
+    def __init__(self, project: t.Optional[str] = None):
+        self._project = project or conf.instance.project_id
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._transaction_ids = itertools.count(1)
+        self._kinds: dict[str, dict[Key, Entity]] = {}
+        self._cursors: dict[bytes, tuple[tuple, SortKey]] = {}
+
+    @property
+    def project(self) -> str:
+        return self._project
+
+    @property
+    def current_transaction(self) -> t.Optional[MemoryTransaction]:
+        return getattr(self._local, "transaction", None)
+
+    def transaction(self) -> MemoryTransaction:
+        return MemoryTransaction(self, next(self._transaction_ids))
+
+    def clear(self) -> None:
+        """
+        Removes all entities.
+        """
+        with self._lock:
+            self._kinds.clear()
+            self._cursors.clear()
+
+    def get_multi(self, keys: list[Key]) -> list[Entity]:
+        with self._lock:
+            entities = [self._kinds.get(key.kind, {}).get(key) for key in keys]
+
+        return [copy.deepcopy(entity) for entity in entities if entity is not None]
+
+    def put_multi(self, entities: list[Entity]) -> None:
+        if (transaction := self.current_transaction) is not None:
+            for entity in entities:
+                if entity.key.is_partial:
+                    transaction.incomplete.append((entity, copy.deepcopy(entity)))
+                else:
+                    transaction.mutations[entity.key] = copy.deepcopy(entity)
+
+            return
+
+        with self._lock:
+            for entity in entities:
+                if entity.key.is_partial:
+                    entity.key = self._complete_key(entity.key)
+
+                self._kinds.setdefault(entity.key.kind, {})[entity.key] = copy.deepcopy(entity)
+
+    def delete_multi(self, keys: list[Key]) -> None:
+        if (transaction := self.current_transaction) is not None:
+            transaction.mutations.update(dict.fromkeys(keys))
+            return
+
+        with self._lock:
+            for key in keys:
+                self._kinds.get(key.kind, {}).pop(key, None)
+
+    def allocate_ids(self, incomplete_key: Key, num_ids: int, retry=None, timeout=None) -> list[Key]:
+        with self._lock:
+            return [self._complete_key(incomplete_key) for _ in range(num_ids)]
+
+    def run_query(self, query: QueryDefinition, limit: int) -> tuple[list[Entity], t.Optional[bytes]]:
+        # Inverted orders are fetched in the opposite direction, the results are flipped afterward
+        orders = [
+            (name, direction in (SortOrder.Descending, SortOrder.InvertedAscending))
+            for name, direction in query.orders or ()
+        ]
+        if not any(name == KEY_SPECIAL_PROPERTY for name, _ in orders):
+            orders.append((KEY_SPECIAL_PROPERTY, False))
+
+        signature = (query.kind, tuple(orders))
+        descending = tuple(desc for _, desc in orders)
+        start = self._get_cursor(query.startCursor, signature)
+        end = self._get_cursor(query.endCursor, signature)
+
+        results = []
+        for entity in self._matches(query):
+            sort_values = []
+            for name, desc in orders:
+                if not (values := _indexed_values(entity, name)):
+                    break  # not part of the index for this order
+
+                sort_values.append((max if desc else min)(sort_value(value) for value in values))
+            else:
+                sort_key = SortKey(tuple(sort_values), descending)
+                if (start is None or start < sort_key) and (end is None or not end < sort_key):
+                    results.append((sort_key, entity))
+
+        results.sort(key=operator.itemgetter(0))
+
+        if query.distinct:
+            seen = set()
+            distinct_results = []
+
+            for sort_key, entity in results:
+                value = tuple(tuple(sort_value(x) for x in _indexed_values(entity, name)) for name in query.distinct)
+                if value not in seen:
+                    seen.add(value)
+                    distinct_results.append((sort_key, entity))
+
+            results = distinct_results
+
+        cursor = None
+        if limit is not None and 0 <= limit < len(results):
+            results = results[:limit]
+            cursor = self._make_cursor(signature, results[-1][0]) if results else None
+
+        entities = [self._shape(entity, query) for _, entity in results]
+
+        if any(direction in (SortOrder.InvertedAscending, SortOrder.InvertedDescending)
+               for _, direction in query.orders or ()):
+            entities.reverse()
+
+        return entities, cursor
+
+    def count(self, query: QueryDefinition, up_to: int) -> int:
+        return min(sum(1 for _ in self._matches(query)), up_to)
+
+    def _complete_key(self, key: Key) -> Key:
+        kind = self._kinds.get(key.kind, {})
+
+        while (completed := key.completed_key(next(self._ids))) in kind:
+            pass
+
+        return completed
+
+    def _commit(self, transaction: MemoryTransaction) -> None:
+        with self._lock:
+            for entity, entity_copy in transaction.incomplete:
+                entity.key = entity_copy.key = self._complete_key(entity.key)
+                self._kinds.setdefault(entity.key.kind, {})[entity.key] = entity_copy
+
+            for key, entity in transaction.mutations.items():
+                if entity is None:
+                    self._kinds.get(key.kind, {}).pop(key, None)
+                else:
+                    self._kinds.setdefault(key.kind, {})[key] = entity
+
+    def _matches(self, query: QueryDefinition) -> t.Iterator[Entity]:
+        """
+        Yields all entities matching the kind and filters of *query*.
+        """
+        equalities: list[tuple[str, t.Any]] = []
+        inequalities: dict[str, list[tuple[t.Callable, tuple]]] = {}
+
+        for filter_str, filter_value in (query.filters or {}).items():
+            name, op = filter_str.split(" ")
+            if op not in _OPERATORS:
+                raise NotImplementedError(f"The {op!r} filter operator is not supported")
+
+            for value in filter_value if isinstance(filter_value, list) else (filter_value,):  # multi equal filters
+                if op == "=":
+                    equalities.append((name, sort_value(value)))
+                else:
+                    inequalities.setdefault(name, []).append((_OPERATORS[op], sort_value(value)))
+
+        with self._lock:
+            if query.kind:
+                entities = list(self._kinds.get(query.kind, {}).values())
+            else:
+                entities = [entity for kind in self._kinds.values() for entity in kind.values()]
+
+        for entity in entities:
+            if all(
+                any(sort_value(value) == filter_value for value in _indexed_values(entity, name))
+                for name, filter_value in equalities
+            ) and all(
+                any(
+                    all(op(sort_value(value), filter_value) for op, filter_value in filters)
+                    for value in _indexed_values(entity, name)
+                )
+                for name, filters in inequalities.items()
+            ):
+                yield entity
+
+    @staticmethod
+    def _shape(entity: Entity, query: QueryDefinition) -> Entity:
+        """
+        Returns a copy of *entity*, reduced to its key or projected properties if requested by *query*.
+        """
+        if query.keys_only:
+            return Entity(copy.deepcopy(entity.key))
+
+        if query.projection:
+            res = Entity(copy.deepcopy(entity.key))
+            res.update({name: copy.deepcopy(entity[name]) for name in query.projection if name in entity})
+            return res
+
+        return copy.deepcopy(entity)
+
+    def _make_cursor(self, signature: tuple, position: SortKey) -> bytes:
+        cursor = base64.urlsafe_b64encode(secrets.token_bytes(12))
+
+        with self._lock:
+            while len(self._cursors) >= MAX_CURSORS:
+                del self._cursors[next(iter(self._cursors))]
+
+            self._cursors[cursor] = (signature, position)
+
+        return cursor
+
+    def _get_cursor(self, cursor: t.Optional[str | bytes], signature: tuple) -> t.Optional[SortKey]:
+        if not cursor:
+            return None
+
+        if isinstance(cursor, str):
+            cursor = cursor.encode("ASCII")
+
+        with self._lock:
+            cursor_signature, position = self._cursors.get(cursor, (None, None))
+
+        if cursor_signature != signature:
+            raise exceptions.BadRequest("Invalid cursor")
+
+        return position
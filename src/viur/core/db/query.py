@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import base64
+import concurrent.futures
+import contextlib
+import contextvars
 import copy
-import functools
+import heapq
 import logging
+import threading
 import typing as t
 
 from viur.core.config import conf
@@ -11,11 +15,13 @@ from .transport import count, get, run_single_filter
 from .types import (
     DATASTORE_BASE_TYPES,
     Entity,
+    Key,
     KEY_SPECIAL_PROPERTY,
     QueryDefinition,
     SortOrder,
     TFilters,
     TOrders,
+    compile_sort_key,
 )
 from . import utils
 
@@ -28,6 +34,31 @@ TFilterHook = t.TypeVar("TFilterHook", bound=t.Callable[
 ])
 
 
+_executor: t.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Returns the thread pool used to run the queries of a multi-query concurrently.
+    It's (re-)created whenever :attr:`conf.db.multi_query_workers` has been changed.
+    """
+    global _executor, _executor_workers
+
+    with _executor_lock:
+        if _executor is None or _executor_workers != conf.db.multi_query_workers:
+            # The previous pool isn't shut down, as other threads may still submit queries to it;
+            # its workers exit on their own, once it has been garbage collected.
+            _executor_workers = conf.db.multi_query_workers
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_executor_workers,
+                thread_name_prefix="viur-db-query",
+            )
+
+        return _executor
+
+
 def _entryMatchesQuery(entry: Entity, singleFilter: dict) -> bool:
     """
     Utility function which checks if the given entity could have been returned by a query filtering by the
@@ -420,6 +451,44 @@ class Query(object):
                 query.distinct = keyList
         return self
 
+    def keys(self) -> t.Self:
+        """
+        Only fetch the keys of the matching entities.
+
+        Keys-only queries are billed as small operations and transfer much less data, so they should be used
+        whenever only the keys are needed (e.g. to delete the entities found).
+        The entities returned by :meth:`run` contain no properties;
+        :meth:`fetch` returns skeletons with the key bone only.
+
+        :returns: Returns the query itself for chaining.
+        """
+        if isinstance(self.queries, QueryDefinition):
+            self.queries.keys_only = True
+        elif isinstance(self.queries, list):
+            for query in self.queries:
+                query.keys_only = True
+
+        return self
+
+    def project(self, *props: str) -> t.Self:
+        """
+        Only fetch the given properties of the matching entities (a projection query).
+
+        Only indexed properties can be projected, and projecting more than one property requires a
+        matching composite index. Entities with multiple values for a projected property are returned
+        once per value. :meth:`fetch` returns skeletons with the projected bones only.
+
+        :param props: The names of the properties to fetch.
+        :returns: Returns the query itself for chaining.
+        """
+        if isinstance(self.queries, QueryDefinition):
+            self.queries.projection = list(props)
+        elif isinstance(self.queries, list):
+            for query in self.queries:
+                query.projection = list(props)
+
+        return self
+
     def getCursor(self) -> t.Optional[str]:
         """
         Get a valid cursor from the last run of this query.
@@ -481,24 +550,96 @@ class Query(object):
         """
         return run_single_filter(query, limit)
 
-    def _merge_multi_query_results(self, input_result: t.List[t.List[Entity]]) -> t.List[Entity]:
+    def _run_multi_filter_queries(self, queries: t.List[QueryDefinition], limit: int) -> t.List[t.List[Entity]]:
+        """
+        Internal helper function that runs all query definitions of a multi-query and returns their results
+        in the order of *queries*.
+
+        The queries are run concurrently on a thread pool of :attr:`conf.db.multi_query_workers` threads.
+        Inside transactions, they are run one after another, as the transaction is bound to the current thread.
+        :param queries: The querydefinitions to run against the datastore
+        :param limit: How many results should at most be returned by each query
+        :return: A list of results, one for each query definition
+        """
+        if conf.db.multi_query_workers <= 1 or len(queries) <= 1 or utils.is_in_transaction():
+            return [self._run_single_filter_query(query, limit) for query in queries]
+
+        executor = _get_executor()
+        # Every query runs in a copy of our context, so the access log and request data are available
+        futures = [
+            executor.submit(contextvars.copy_context().run, self._run_single_filter_query, query, limit)
+            for query in queries
+        ]
+        return [future.result() for future in futures]
+
+    @contextlib.contextmanager
+    def _sort_properties_projected(self) -> t.Iterator[set[str]]:
+        """
+        Makes keys-only and projection multi-queries also fetch the properties they're ordered by,
+        as their results can't be merged otherwise.
+
+        Yields the names of the properties which have been added, and must be removed from the results again.
+        """
+        first = self.queries[0]
+        sort_properties = [name for name, _ in first.orders or () if name != KEY_SPECIAL_PROPERTY]
+        if not sort_properties or not (first.keys_only or first.projection):
+            yield set()
+            return
+
+        previous = [(query.keys_only, query.projection) for query in self.queries]
+        projection = [] if first.keys_only else list(first.projection)
+        for query in self.queries:
+            query.keys_only = False
+            query.projection = list(dict.fromkeys(projection + sort_properties))
+
+        try:
+            yield set(sort_properties) - set(projection)
+        finally:
+            for query, (keys_only, projection) in zip(self.queries, previous):
+                query.keys_only, query.projection = keys_only, projection
+
+    def _merge_multi_query_results(self, input_result: t.List[t.List[Entity]], limit: int = -1) -> t.List[Entity]:
         """
-        Merge the lists of entries into a single list; removing duplicates and restoring sort-order
+        Merge the lists of entries into a single list; removing duplicates and restoring sort-order.
+
+        As every list is already sorted by the same orders, they are merged lazily, stopping as soon as
+        *limit* entries have been produced.
         :param input_result: Nested Lists of Entries returned by each individual query run
+        :param limit: The maximum number of entries to return; -1 for all of them
         :return: Sorted & deduplicated list of entries
         """
-        seen_keys = set()
-        res = []
-        for subList in input_result:
-            for entry in subList:
-                key = entry.key
-                if key in seen_keys:
-                    continue
-                seen_keys.add(key)
-                res.append(entry)
         # FIXME: What about filters that mix different inequality filters?
         # Currently, we'll now simply ignore any implicit sortorder.
-        return self._resort_result(res, {}, self.queries[0].orders)
+        orders = self.queries[0].orders or [(KEY_SPECIAL_PROPERTY, SortOrder.Ascending)]
+        inverted = any(direction in (SortOrder.InvertedAscending, SortOrder.InvertedDescending)
+                       for _, direction in orders)
+
+        if inverted:
+            # The results have been flipped after fetching. Merge them in the order they've been fetched,
+            # so the entries closest to the cursor are kept, and flip the merged result afterwards.
+            input_result = [sub_result[::-1] for sub_result in input_result]
+            orders = [
+                (name, SortOrder.Descending if direction in (SortOrder.Descending, SortOrder.InvertedAscending)
+                 else SortOrder.Ascending)
+                for name, direction in orders
+            ]
+
+        seen_keys = set()
+        res = []
+        for entry in heapq.merge(*input_result, key=compile_sort_key(orders)):
+            if len(res) == limit:
+                break
+
+            if entry.key in seen_keys:
+                continue
+
+            seen_keys.add(entry.key)
+            res.append(entry)
+
+        if inverted:
+            res.reverse()
+
+        return res
 
     def _resort_result(
             self,
@@ -516,32 +657,6 @@ class Query(object):
         :param orders: The sort-orders to apply
         :return: The sorted list
         """
-
-        def getVal(src: Entity, fieldVars: t.Union[str, t.Tuple[str]], direction: SortOrder) -> t.Any:
-            # Descent into the target until we reach the property we're looking for
-            if isinstance(fieldVars, tuple):
-                for fv in fieldVars:
-                    if fv not in src:
-                        return None
-                    src = src[fv]
-            else:
-                if fieldVars not in src:
-                    return (str(type(None)), 0)
-                src = src[fieldVars]
-            # Lists are handled differently, here the smallest or largest value determines it's position in the result
-            if isinstance(src, list) and len(src):
-                try:
-                    src.sort()
-                except TypeError:
-                    # It's a list of dicts or the like for which no useful sort-order is specified
-                    pass
-                if direction == SortOrder.Ascending:
-                    src = src[0]
-                else:
-                    src = src[-1]
-            # We must return this tuple because inter-type comparison isn't possible in Python3 anymore
-            return str(type(src)), src if src is not None else 0
-
         # Check if we have an inequality filter which implies a sortorder
         ineqFilter = None
         for k, _ in filters.items():
@@ -552,17 +667,9 @@ class Query(object):
         if ineqFilter and (not orders or not orders[0][0] == ineqFilter):
             orders = [(ineqFilter, SortOrder.Ascending)] + (orders or [])
 
-        for orderField, direction in orders[::-1]:
-            if orderField == KEY_SPECIAL_PROPERTY:
-                pass  # FIXME !!
-            # entities.sort(key=lambda x: x.key, reverse=direction == SortOrder.Descending)
-            else:
-                try:
-                    entities.sort(key=functools.partial(getVal, fieldVars=orderField, direction=direction),
-                                  reverse=direction == SortOrder.Descending)
-                except TypeError:
-                    # We hit some incomparable types
-                    pass
+        if orders:
+            entities.sort(key=compile_sort_key(orders))
+
         return entities
 
     def _fixKind(self, resultList: t.List[Entity]) -> t.List[Entity]:
@@ -625,10 +732,9 @@ class Query(object):
             if self._calculateInternalMultiQueryLimit:
                 limit = self._calculateInternalMultiQueryLimit(self, limit)
 
-            res = []
             # We run all queries first (preventing multiple round-trips to the server)
-            for singleQuery in self.queries:
-                res.append(self._run_single_filter_query(singleQuery, limit))
+            with self._sort_properties_projected() as stripped:
+                res = self._run_multi_filter_queries(self.queries, limit)
 
             # Wait for the actual results to arrive and convert the protobuffs to Entries
             res = [self._fixKind(x) for x in res]
@@ -637,7 +743,11 @@ class Query(object):
                 res = self._customMultiQueryMerge(self, res, limit)
             else:
                 # We must merge (and sort) the results ourself
-                res = self._merge_multi_query_results(res)
+                res = self._merge_multi_query_results(res, limit)
+
+            for entity in res:
+                for name in stripped:
+                    entity.pop(name, None)
 
         else:  # We have just one single query
             res = self._fixKind(self._run_single_filter_query(
@@ -690,10 +800,20 @@ class Query(object):
             raise NotImplementedError("This query has not been created using skel.all()")
 
         res = SkelList(self.srcSkel)
+        bone_map = self.srcSkel.boneMap
+
+        # Keys-only and projection queries provide the key and the projected bones only
+        query = self.queries[0] if isinstance(self.queries, list) and self.queries else self.queries
+        if isinstance(query, QueryDefinition):
+            if query.keys_only:
+                bone_map = {name: bone for name, bone in bone_map.items() if name == "key"}
+            elif query.projection:
+                bone_map = {name: bone for name, bone in bone_map.items()
+                            if name == "key" or name in query.projection}
 
         # FIXME: Why is this not like in ViUR2?
         for entity in self.run(limit):
-            skel_instance = SkeletonInstance(self.srcSkel.skeletonCls, bone_map=self.srcSkel.boneMap)
+            skel_instance = SkeletonInstance(self.srcSkel.skeletonCls, bone_map=bone_map)
             skel_instance.dbEntity = entity
             res.append(skel_instance)
 
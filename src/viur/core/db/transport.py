@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import contextlib
+import copy
 import logging
 import time
 import typing as t
+from contextvars import ContextVar
 
 from deprecated.sphinx import deprecated
 from google.cloud import datastore, exceptions
 
+from . import cache
+from .backends import Backend, DatastoreBackend
 from .overrides import entity_from_protobuf, key_from_protobuf
-from .types import Entity, Key, QueryDefinition, SortOrder, current_db_access_log
+from .types import Entity, IdentityMap, Key, QueryDefinition, current_db_access_log, current_db_stats
+from viur.core import current
 from viur.core.config import conf
 from viur.core.errors import HTTPException
 
@@ -16,7 +22,19 @@ from viur.core.errors import HTTPException
 datastore.helpers.key_from_protobuf = key_from_protobuf
 datastore.helpers.entity_from_protobuf = entity_from_protobuf
 
-__client__ = datastore.Client()
+__client__: Backend = DatastoreBackend()
+"""The backend all calls to the datastore are made on, see :func:`set_backend`"""
+
+_on_commit_callbacks: ContextVar[t.Optional[list[t.Callable[[], None]]]] = ContextVar(
+    "Transaction-OnCommit", default=None
+)
+"""Callbacks to be run after the current transaction has been committed successfully"""
+
+_current_batch: ContextVar[t.Optional[Batch]] = ContextVar("Database-Batch", default=None)
+"""The batch currently buffering calls to put() and delete()"""
+
+MAX_MUTATIONS_PER_COMMIT: t.Final[int] = 500
+"""The maximum number of entities the datastore accepts to be written or deleted in a single commit"""
 
 
 def allocate_ids(kind_name: str, num_ids: int = 1, retry=None, timeout=None) -> list[Key]:
@@ -41,17 +59,71 @@ def get(keys: t.Union[Key, t.List[Key]]) -> t.Union[t.List[Entity], Entity, None
     Retrieves an entity (or a list thereof) from datastore.
     If only a single key has been given we'll return the entity or none in case the key has not been found,
     otherwise a list of all entities that have been looked up (which may be empty)
+
+    Outside of transactions, entities are served from the request's identity map
+    (see :attr:`conf.db.identity_map`) and the entity cache (see :attr:`conf.db.cache_entities`) first,
+    if enabled. Only the remaining keys are fetched from the datastore, unless they are known not to exist.
+
     :param keys: A datastore key (or a list thereof) to lookup
     :return: The entity (or None if it has not been found), or a list of entities.
     """
     _write_to_access_log(keys)
 
-    if isinstance(keys, (list, set, tuple)):
-        res_list = list(__client__.get_multi(keys))
-        res_list.sort(key=lambda k: keys.index(k.key) if k else -1)
-        return res_list
+    multi = isinstance(keys, (list, set, tuple))
+    lookup = list(dict.fromkeys(keys)) if multi else [keys]
+    found: dict[Key, Entity] = {}
+
+    if (identity_map := _get_identity_map()) is not None:
+        for key in lookup:
+            if (entity := identity_map.entities.get(key)) is not None:
+                found[key] = copy.deepcopy(entity)
+
+        identity_map.hits += len(found)
+        if len(found) == len(lookup):
+            identity_map.rpcs_avoided += 1
+
+    missing_keys = [key for key in lookup if key not in found]
+    use_cache = _use_entity_cache()
+
+    if missing_keys and use_cache:
+        cached = cache.lookup(missing_keys)
+
+        for key, entity in cached.items():
+            if entity is not None:  # otherwise the key is known not to exist
+                found[key] = entity
+                if identity_map is not None:
+                    identity_map.entities[key] = copy.deepcopy(entity)
+
+        missing_keys = [key for key in missing_keys if key not in cached]
+
+    if (stats := current_db_stats.get()) is not None:
+        stats.cache_hits += len(lookup) - len(missing_keys)
+
+    if missing_keys:
+        with _instrument("get") as measured:
+            if multi:
+                fetched = list(__client__.get_multi(missing_keys))
+            else:
+                fetched = [entity] if (entity := __client__.get(missing_keys[0])) is not None else []
+
+            measured.extend(fetched)
 
-    return __client__.get(keys)
+        if use_cache:
+            if fetched:
+                cache.put(fetched)
+
+            fetched_keys = {entity.key for entity in fetched}
+            cache.put_missing(key for key in missing_keys if key not in fetched_keys)
+
+        for entity in fetched:
+            found[entity.key] = entity
+            if identity_map is not None:
+                identity_map.entities[entity.key] = copy.deepcopy(entity)
+
+    if multi:
+        return [found[key] for key in lookup if key in found]
+
+    return found.get(keys)
 
 
 @deprecated(version="3.8.0", reason="Use 'db.get' instead")
@@ -63,13 +135,26 @@ def put(entities: t.Union[Entity, t.List[Entity]]):
     """
     Save an entity in the Cloud Datastore.
     Also ensures that no string-key with a digit-only name can be used.
+
+    Inside a :func:`batch`, the entities are buffered and written when the batch is flushed.
     :param entities: The entities to be saved to the datastore.
     """
     _write_to_access_log(entities)
-    if isinstance(entities, Entity):
-        return __client__.put(entities)
 
-    return __client__.put_multi(entities=entities)
+    if (current_batch := _get_batch()) is not None:
+        current_batch.put(entities)
+        return None
+
+    with _instrument("put") as measured:
+        if isinstance(entities, Entity):
+            res = __client__.put(entities)
+            measured.append(entities)
+        else:
+            res = __client__.put_multi(entities=entities)
+            measured.extend(entities)
+
+    _invalidate_entity_cache(entities)
+    return res
 
 
 @deprecated(version="3.8.0", reason="Use 'db.put' instead")
@@ -80,14 +165,27 @@ def Put(entities: t.Union[Entity, t.List[Entity]]) -> t.Union[Entity, None]:
 def delete(keys: t.Union[Entity, t.List[Entity], Key, t.List[Key]]):
     """
     Deletes the entities with the given key(s) from the datastore.
+
+    Inside a :func:`batch`, the keys are buffered and deleted when the batch is flushed.
     :param keys: A Key (or a t.List of Keys) to delete
     """
 
     _write_to_access_log(keys)
-    if not isinstance(keys, (set, list, tuple)):
-        return __client__.delete(keys)
 
-    return __client__.delete_multi(keys)
+    if (current_batch := _get_batch()) is not None:
+        current_batch.delete(keys)
+        return None
+
+    with _instrument("delete") as measured:
+        if not isinstance(keys, (set, list, tuple)):
+            res = __client__.delete(keys)
+            measured.append(keys)
+        else:
+            res = __client__.delete_multi(keys)
+            measured.extend(keys)
+
+    _invalidate_entity_cache(keys)
+    return res
 
 
 @deprecated(version="3.8.0", reason="Use 'db.delete' instead")
@@ -95,6 +193,136 @@ def Delete(keys: t.Union[Entity, t.List[Entity], Key, t.List[Key]]):
     return delete(keys)
 
 
+class Batch:
+    """
+    Buffers calls to :func:`put` and :func:`delete` and writes them in chunks of
+    :const:`MAX_MUTATIONS_PER_COMMIT` entities, see :func:`batch`.
+    """
+
+    def __init__(self, chunk_size: int = MAX_MUTATIONS_PER_COMMIT):
+        if not 0 < chunk_size <= MAX_MUTATIONS_PER_COMMIT:
+            raise ValueError(f"chunk_size must be between 1 and {MAX_MUTATIONS_PER_COMMIT}")
+
+        self.chunk_size = chunk_size
+        self._mutations: dict[Key, t.Optional[Entity]] = {}  # key -> entity to put, or None to delete
+        self._incomplete: list[Entity] = []  # entities without a complete key, which can't be coalesced
+        self._token = None
+
+    def __len__(self) -> int:
+        return len(self._mutations) + len(self._incomplete)
+
+    def __enter__(self) -> t.Self:
+        self._token = _current_batch.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _current_batch.reset(self._token)
+        self._token = None
+        if exc_type is None:
+            self.flush()
+        else:  # The block failed, so its remaining operations may be based on an inconsistent state
+            self._mutations.clear()
+            self._incomplete.clear()
+
+    def put(self, entities: t.Union[Entity, t.Iterable[Entity]]) -> None:
+        """
+        Buffers *entities* to be written; replaces any operation buffered for the same key.
+        """
+        if isinstance(entities, Entity):
+            entities = (entities,)
+
+        for entity in entities:
+            if entity.key is None or entity.key.is_partial:
+                self._incomplete.append(entity)
+            else:
+                self._mutations.pop(entity.key, None)  # re-insert at the end, so the latest operation wins
+                self._mutations[entity.key] = entity
+
+        self._flush_full_chunks()
+
+    def delete(self, keys: t.Union[Entity, Key, t.Iterable[t.Union[Entity, Key]]]) -> None:
+        """
+        Buffers *keys* to be deleted; replaces any operation buffered for the same key.
+        """
+        if not isinstance(keys, (set, list, tuple)):
+            keys = (keys,)
+
+        for key in keys:
+            if isinstance(key, Entity):
+                key = key.key
+
+            self._mutations.pop(key, None)
+            self._mutations[key] = None
+
+        self._flush_full_chunks()
+
+    def flush(self) -> None:
+        """
+        Writes all buffered operations to the datastore.
+        """
+        while self:
+            self._flush_chunk()
+
+    def _flush_full_chunks(self) -> None:
+        while len(self) >= self.chunk_size:
+            self._flush_chunk()
+
+    def _flush_chunk(self) -> None:
+        to_put = self._incomplete[:self.chunk_size]
+        del self._incomplete[:self.chunk_size]
+        to_delete = []
+
+        while self._mutations and len(to_put) + len(to_delete) < self.chunk_size:
+            key, entity = next(iter(self._mutations.items()))
+            del self._mutations[key]
+
+            if entity is None:
+                to_delete.append(key)
+            else:
+                to_put.append(entity)
+
+        if to_put:
+            with _instrument("put") as measured:
+                __client__.put_multi(entities=to_put)
+                measured.extend(to_put)
+
+            _invalidate_entity_cache(to_put)
+
+        if to_delete:
+            with _instrument("delete") as measured:
+                __client__.delete_multi(to_delete)
+                measured.extend(to_delete)
+
+            _invalidate_entity_cache(to_delete)
+
+
+def batch(chunk_size: int = MAX_MUTATIONS_PER_COMMIT) -> Batch:
+    """
+    Returns a context manager which buffers all calls to :func:`put` and :func:`delete` within its block.
+
+    Operations on the same key are coalesced, so only the latest one is executed. The buffered operations are
+    written with a single call to the datastore per *chunk_size* entities, whenever the buffer is full and
+    at the end of the block. Keys of new entities are completed when they have been written.
+    If the block raises an exception, the operations which haven't been flushed yet are discarded.
+
+    Inside a transaction, calls to :func:`put` and :func:`delete` are passed on directly, as the transaction
+    already sends all of them together on commit.
+
+    ..Warning: Entities written inside the block are not visible to :func:`get` or queries before they
+        have been flushed.
+
+    .. code-block:: python
+
+        with db.batch():
+            for entity in entities:
+                entity["counter"] += 1
+                db.put(entity)
+
+    :param chunk_size: The maximum number of entities written by a single call to the datastore.
+    """
+    return Batch(chunk_size)
+
+
 def run_in_transaction(func: t.Callable, *args, **kwargs) -> t.Any:
     """
     Runs the function given in :param:callee inside a transaction.
@@ -118,6 +346,10 @@ def run_in_transaction(func: t.Callable, *args, **kwargs) -> t.Any:
         res = func(*args, **kwargs)
     else:
         for i in range(3):
+            # Callbacks registered by a failed attempt must not run, so every attempt gets its own list
+            callbacks = []
+            token = _on_commit_callbacks.set(callbacks)
+
             try:
                 with __client__.transaction():
                     res = func(*args, **kwargs)
@@ -128,35 +360,51 @@ def run_in_transaction(func: t.Callable, *args, **kwargs) -> t.Any:
                 time.sleep(2 ** i)
                 continue
 
+            finally:
+                _on_commit_callbacks.reset(token)
+
         else:
             raise RuntimeError("Maximum transaction retries exceeded")
 
+        # The transaction has been committed, so a failing callback must neither skip the others nor fail it
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception(f"On-commit callback {callback!r} failed")
+
     return res
 
 
+def on_commit(callback: t.Callable[[], None]) -> None:
+    """
+    Registers *callback* to be called after the current transaction has been committed successfully.
+
+    If the transaction fails, the callback is discarded. Outside of transactions, *callback* is called immediately.
+    Exceptions raised by callbacks after the commit are logged, and don't affect the other callbacks.
+
+    :param callback: The function to call; it receives no arguments.
+    """
+    if (callbacks := _on_commit_callbacks.get()) is not None and __client__.current_transaction:
+        callbacks.append(callback)
+    else:
+        callback()
+
+
 @deprecated(version="3.8.0", reason="Use 'db.run_in_transaction' instead")
 def RunInTransaction(callee: t.Callable, *args, **kwargs) -> t.Any:
     return run_in_transaction(callee, *args, **kwargs)
 
 
 def count(kind: str = None, up_to=2 ** 31 - 1, queryDefinition: QueryDefinition = None) -> int:
-    if not kind:
-        kind = queryDefinition.kind
-
-    query = __client__.query(kind=kind)
-    if queryDefinition and queryDefinition.filters:
-        for k, v in queryDefinition.filters.items():
-            key, op = k.split(" ")
-            if not isinstance(v, list):  # multi equal filters
-                v = [v]
-            for val in v:
-                f = datastore.query.PropertyFilter(key, op, val)
-                query.add_filter(filter=f)
+    if queryDefinition is None:
+        queryDefinition = QueryDefinition(kind, {}, [])
+    elif kind and kind != queryDefinition.kind:
+        queryDefinition = copy.copy(queryDefinition)
+        queryDefinition.kind = kind
 
-    aggregation_query = __client__.aggregation_query(query)
-
-    result = aggregation_query.count(alias="total").fetch(limit=up_to)
-    return list(result)[0][0].value
+    with _instrument("count"):
+        return __client__.count(queryDefinition, up_to)
 
 
 @deprecated(version="3.8.0", reason="Use 'db.count' instead")
@@ -173,45 +421,10 @@ def run_single_filter(query: QueryDefinition, limit: int) -> t.List[Entity]:
         :return: The first *limit* entities that matches this query
     """
 
-    qry = __client__.query(kind=query.kind)
-    startCursor = None
-    endCursor = None
-    hasInvertedOrderings = None
-
-    if query:
-        if query.filters:
-            for k, v in query.filters.items():
-                key, op = k.split(" ")
-                if not isinstance(v, list):  # multi equal filters
-                    v = [v]
-                for val in v:
-                    f = datastore.query.PropertyFilter(key, op, val)
-                    qry.add_filter(filter=f)
-
-        if query.orders:
-            hasInvertedOrderings = any(
-                [
-                    x[1] in [SortOrder.InvertedAscending, SortOrder.InvertedDescending]
-                    for x in query.orders
-                ]
-            )
-            qry.order = [
-                x[0] if x[1] in [SortOrder.Ascending, SortOrder.InvertedDescending] else f"-{x[0]}"
-                for x in query.orders
-            ]
-
-        if query.distinct:
-            qry.distinct_on = query.distinct
-
-        startCursor = query.startCursor
-        endCursor = query.endCursor
-
-    qryRes = qry.fetch(limit=limit, start_cursor=startCursor, end_cursor=endCursor)
-    res = list(qryRes)
-
-    query.currentCursor = qryRes.next_page_token
-    if hasInvertedOrderings:
-        res.reverse()
+    with _instrument("run_single_filter") as measured:
+        res, query.currentCursor = __client__.run_query(query, limit)
+        measured.extend(res)
+
     return res
 
 
@@ -220,6 +433,129 @@ def runSingleFilter(query: QueryDefinition, limit: int) -> t.List[Entity]:
     run_single_filter(query, limit)
 
 
+def set_backend(backend: Backend) -> Backend:
+    """
+    Installs *backend* for all subsequent calls to the datastore, e.g. a
+    :class:`viur.core.db.memory.MemoryBackend` to run tests and benchmarks without the Cloud Datastore.
+
+    :param backend: The backend to use
+    :return: The backend used before, so it can be restored.
+    """
+    global __client__
+
+    old_backend, __client__ = __client__, backend
+    return old_backend
+
+
+def get_backend() -> Backend:
+    """
+    Returns the backend all calls to the datastore are made on.
+    """
+    return __client__
+
+
+# helper functions for the request statistics
+@contextlib.contextmanager
+def _instrument(operation: str) -> t.Iterator[list[t.Union[Entity, Key]]]:
+    """
+    Records the datastore call made within the block in the statistics of the current request, if any.
+    The block adds the entities (or keys) read or written to the yielded list.
+    """
+    measured = []
+
+    if (stats := current_db_stats.get()) is None:
+        yield measured
+        return
+
+    started = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        duration = time.perf_counter() - started
+        stats.record(operation, len(measured), sum(_encoded_size(entry) for entry in measured), duration)
+
+
+def _encoded_size(entry: t.Union[Entity, Key]) -> int:
+    if isinstance(entry, Entity):
+        return datastore.helpers.entity_to_protobuf(entry)._pb.ByteSize()
+
+    if isinstance(entry, Key):
+        return entry.to_protobuf()._pb.ByteSize()
+
+    return 0
+
+
+# helper function for batches
+def _get_batch() -> t.Optional[Batch]:
+    if __client__.current_transaction:
+        return None
+
+    return _current_batch.get()
+
+
+# helper functions for the entity cache
+def _use_entity_cache() -> bool:
+    return _entity_cache_enabled() and not __client__.current_transaction
+
+
+def _entity_cache_enabled() -> bool:
+    return bool(conf.db.cache_entities and (conf.db.memcache_client or conf.db.cache_local_size > 0))
+
+
+def _invalidate_entity_cache(data: t.Union[Key, list[Key], Entity, list[Entity]]) -> None:
+    identity_map = _get_identity_map(in_transaction=True)
+    use_cache = _entity_cache_enabled()
+
+    if identity_map is None and not use_cache:
+        return
+
+    if not isinstance(data, (list, set, tuple)):
+        data = [data]
+
+    keys = [entry.key if isinstance(entry, Entity) else entry for entry in data]
+    keys = [key for key in keys if key is not None and not key.is_partial]
+    if not keys:
+        return
+
+    if identity_map is not None:
+        for key in keys:
+            identity_map.entities.pop(key, None)
+
+    if use_cache:
+        cache.delete(keys)
+
+        # Concurrent readers may re-populate the cache with the old state until the transaction is committed
+        if __client__.current_transaction:
+            on_commit(lambda: cache.delete(keys))
+
+
+# helper functions for the identity map
+IDENTITY_MAP_KEY = "__viur-db-identity-map__"
+
+
+def _get_identity_map(in_transaction: bool = False) -> t.Optional[IdentityMap]:
+    if not conf.db.identity_map or (__client__.current_transaction and not in_transaction):
+        return None
+
+    if (request_data := current.request_data.get()) is None:
+        return None
+
+    if (identity_map := request_data.get(IDENTITY_MAP_KEY)) is None:
+        identity_map = request_data[IDENTITY_MAP_KEY] = IdentityMap()
+
+    return identity_map
+
+
+def get_identity_map() -> t.Optional[IdentityMap]:
+    """
+    Returns the identity map of the current request, which provides the entities fetched so far
+    and counters on the lookups served from it.
+
+    :return: The identity map, or None if it is disabled or there is no current request.
+    """
+    return _get_identity_map(in_transaction=True)
+
+
 # helper function for access log
 def _write_to_access_log(data: t.Union[Key, list[Key], Entity, list[Entity]]) -> None:
     if not conf.db.create_access_log:
@@ -241,4 +577,4 @@ def _write_to_access_log(data: t.Union[Key, list[Key], Entity, list[Entity]]) ->
                 access_log.add(entry)
 
 
-__all__ = [allocate_ids, delete, get, put, run_in_transaction, count]
+__all__ = [allocate_ids, delete, get, put, run_in_transaction, count, set_backend, get_backend]
@@ -5,7 +5,9 @@ from __future__ import annotations
 
 import datetime
 import enum
+import functools
 import itertools
+import threading
 import typing as t
 from contextvars import ContextVar
 from dataclasses import dataclass, field
@@ -22,6 +24,9 @@ DATASTORE_BASE_TYPES = t.Union[None, str, int, float, bool, datetime.datetime, d
 current_db_access_log: ContextVar[t.Optional[set[t.Union[Key, str]]]] = ContextVar("Database-Accesslog", default=None)
 """If set to a set for the current thread/request, we'll log all entities / kinds accessed"""
 
+current_db_stats: ContextVar[t.Optional[DatabaseStats]] = ContextVar("Database-Stats", default=None)
+"""If set for the current request, all calls to the datastore are recorded in it"""
+
 """The current projectID, which can't be imported from transport.py"""
 
 
@@ -58,8 +63,8 @@ class Key(Datastore_key):
             new_path_args.extend((kind, id_or_name))
 
         if project is None:
-            from .transport import __client__  # noqa: E402 # import works only here because circular imports
-            project = __client__.project
+            from . import transport  # noqa: E402 # import works only here because circular imports
+            project = transport.__client__.project
 
         super().__init__(*new_path_args, project=project, **kwargs)
 
@@ -169,6 +174,97 @@ TOrders: t.TypeAlias = list[tuple[str, SortOrder]]
 TFilters: t.TypeAlias = dict[str, DATASTORE_BASE_TYPES | list[DATASTORE_BASE_TYPES]]
 
 
+def _key_sort_value(key: Key) -> tuple:
+    """
+    Returns a comparable representation of *key*, which follows the datastore's ordering of keys:
+    By the path elements from the root, each by its kind, then numeric IDs before names.
+    """
+    return tuple(
+        (kind, (0, id_or_name) if isinstance(id_or_name, int) else (1, id_or_name))
+        for kind, id_or_name in itertools.batched(key.flat_path, 2)
+    )
+
+
+def sort_value(value: t.Any) -> tuple[int, t.Any]:
+    """
+    Maps *value* onto a tuple that is comparable across types.
+    Different types are ordered by the datastore's ordering of value types.
+    """
+    if value is None:
+        return 0, 0
+    elif isinstance(value, bool):
+        return 3, value
+    elif isinstance(value, int):
+        return 1, value
+    elif isinstance(value, datetime.datetime):
+        return 2, value
+    elif isinstance(value, bytes):
+        return 4, value
+    elif isinstance(value, str):
+        return 5, value
+    elif isinstance(value, float):
+        return 6, value
+    elif isinstance(value, Key):
+        return 8, _key_sort_value(value)
+
+    return 9, 0  # Not orderable by the datastore (e.g. embedded entities)
+
+
+def _property_sort_value(entity: Entity, name: str, descending: bool) -> tuple[int, t.Any]:
+    value = entity.get(name)
+
+    # Lists are handled differently, here the smallest or largest value determines it's position in the result
+    if isinstance(value, list):
+        if not value:
+            return sort_value(None)
+
+        return (max if descending else min)(sort_value(x) for x in value)
+
+    return sort_value(value)
+
+
+class SortKey:
+    """
+    Sort key of a single entity; holds one comparable value per sort order.
+    """
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values: tuple, descending: tuple[bool, ...]):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other: "SortKey") -> bool:
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value != other_value:
+                return value > other_value if descending else value < other_value
+
+        return False
+
+    def __eq__(self, other: "SortKey") -> bool:
+        return self.values == other.values
+
+
+def compile_sort_key(orders: TOrders) -> t.Callable[[Entity], SortKey]:
+    """
+    Builds a key function for :func:`sorted` and :func:`heapq.merge`, which orders entities by *orders*.
+    Inverted sort orders are treated like the direction of the results they yield.
+    """
+    descending = tuple(
+        direction in (SortOrder.Descending, SortOrder.InvertedDescending)
+        for _, direction in orders
+    )
+    getters = tuple(
+        (lambda entity: sort_value(entity.key)) if name == KEY_SPECIAL_PROPERTY
+        else functools.partial(_property_sort_value, name=name, descending=desc)
+        for (name, _), desc in zip(orders, descending)
+    )
+
+    def sort_key(entity: Entity) -> SortKey:
+        return SortKey(tuple(getter(entity) for getter in getters), descending)
+
+    return sort_key
+
+
 @dataclass
 class QueryDefinition:
     """
@@ -199,5 +295,108 @@ class QueryDefinition:
     currentCursor: t.Optional[str] = None
     """Will be set after this query has been run, pointing after the last entity returned"""
 
+    keys_only: bool = False
+    """If set, only the keys of the matching entities are fetched"""
+
+    projection: t.Optional[list[str]] = None
+    """If set, only these properties of the matching entities are fetched"""
+
     def __post_init__(self):
         self.limit = conf.db.query_default_limit
+
+
+@dataclass
+class IdentityMap:
+    """
+    Request-scoped map of the entities already fetched from the datastore,
+    see :attr:`viur.core.config.Database.identity_map`.
+    """
+
+    entities: dict[Key, Entity] = field(default_factory=dict)
+    """The entities fetched so far, by their key"""
+
+    hits: int = 0
+    """Number of entities served from this map instead of being fetched again"""
+
+    rpcs_avoided: int = 0
+    """Number of :func:`db.get` calls that have been served completely from this map"""
+
+
+@dataclass
+class OperationStats:
+    """
+    Statistics on one kind of datastore operation, see :class:`DatabaseStats`.
+    """
+
+    calls: int = 0
+    """Number of calls"""
+
+    entities: int = 0
+    """Number of entities (or keys) read or written"""
+
+    bytes: int = 0
+    """Encoded size of the entities (or keys) read or written"""
+
+    duration: float = 0.0
+    """Time spent in these calls, in seconds"""
+
+
+@dataclass
+class DatabaseStats:
+    """
+    Request-scoped statistics on the calls to the datastore, see :attr:`viur.core.config.Database.stats`.
+    """
+
+    operations: dict[str, OperationStats] = field(default_factory=dict)
+    """The statistics by operation (get, put, delete, run_single_filter, count)"""
+
+    cache_hits: int = 0
+    """Number of keys :func:`db.get` resolved from the identity map or the entity cache, without a datastore call"""
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, operation: str, entities: int, size: int, duration: float) -> None:
+        """
+        Records a call to the datastore; may be called from multiple threads (e.g. by multi-queries).
+        """
+        with self._lock:
+            if (stats := self.operations.get(operation)) is None:
+                stats = self.operations[operation] = OperationStats()
+
+            stats.calls += 1
+            stats.entities += entities
+            stats.bytes += size
+            stats.duration += duration
+
+    @property
+    def calls(self) -> int:
+        """Total number of calls to the datastore"""
+        return sum(stats.calls for stats in self.operations.values())
+
+    @property
+    def duration(self) -> float:
+        """Total time spent in calls to the datastore, in seconds"""
+        return sum(stats.duration for stats in self.operations.values())
+
+    def server_timing(self) -> str:
+        """
+        Returns the statistics as value for a ``Server-Timing`` header, with one metric per operation
+        and the total as ``db``.
+        """
+        metrics = [f'db;dur={self.duration * 1000:.1f};desc="{self.calls} calls"']
+        metrics.extend(
+            f"db-{operation.replace('_', '-')};dur={stats.duration * 1000:.1f}"
+            for operation, stats in sorted(self.operations.items())
+        )
+        return ", ".join(metrics)
+
+    def summary(self) -> str:
+        """
+        Returns a one-line summary of the statistics for logging.
+        """
+        operations = " ".join(
+            f"{operation}={stats.calls}/{stats.entities}e/{stats.bytes}b/{stats.duration * 1000:.1f}ms"
+            for operation, stats in sorted(self.operations.items())
+        )
+        return f"{self.calls} datastore calls in {self.duration * 1000:.1f}ms, " \
+            f"{self.cache_hits} cache hits ({operations or 'none'})"
@@ -8,7 +8,8 @@ from google.cloud.datastore.transaction import Transaction
 
 from viur.core import current
 from viur.core.config import conf
-from .transport import __client__, get, put, run_in_transaction
+from . import transport
+from .transport import get, put, run_in_transaction
 from .types import Entity, Key, current_db_access_log
 
 
@@ -144,7 +145,7 @@ def keyHelper(
 
 
 def is_in_transaction() -> bool:
-    return __client__.current_transaction is not None
+    return transport.__client__.current_transaction is not None
 
 
 @deprecated(version="3.8.0", reason="Use 'db.utils.is_in_transaction' instead")
@@ -198,7 +199,7 @@ def acquire_transaction_success_marker() -> str:
         or if the transaction it was created in failed.
         :return: Name of the entry in viur-transactionmarker
     """
-    txn: Transaction | None = __client__.current_transaction
+    txn: Transaction | None = transport.__client__.current_transaction
     assert txn, "acquire_transaction_success_marker cannot be called outside an transaction"
     marker = str(txn.id)
     request_data = current.request_data.get()
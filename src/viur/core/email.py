@@ -91,6 +91,7 @@ def clean_old_emails_from_log(*args, **kwargs):
         db.Query(EMAIL_KINDNAME)
         .filter("isSend =", True)
         .filter("creationDate <", utils.utcNow() - conf.email.log_retention)
+        .keys()
     )
     DeleteEntitiesIter.startIterOnQuery(qry)
 
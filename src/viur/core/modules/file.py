@@ -1480,16 +1480,16 @@ def doCheckForUnreferencedBlobs(cursor=None):
             db.put(obj)
         return res
 
-    query = db.Query("viur-blob-locks").filter("has_old_blob_references", True).setCursor(cursor)
+    query = db.Query("viur-blob-locks").filter("has_old_blob_references", True).setCursor(cursor).keys()
     for lockObj in query.run(100):
         oldBlobKeys = db.run_in_transaction(getOldBlobKeysTxn, lockObj.key)
         for blobKey in oldBlobKeys:
-            if db.Query("viur-blob-locks").filter("active_blob_references =", blobKey).getEntry():
+            if db.Query("viur-blob-locks").filter("active_blob_references =", blobKey).keys().getEntry():
                 # This blob is referenced elsewhere
                 logging.info(f"Stale blob is still referenced, {blobKey}")
                 continue
             # Add a marker and schedule it for deletion
-            fileObj = db.Query("viur-deleted-files").filter("dlkey", blobKey).getEntry()
+            fileObj = db.Query("viur-deleted-files").filter("dlkey", blobKey).keys().getEntry()
             if fileObj:  # Its already marked
                 logging.info(f"Stale blob already marked for deletion, {blobKey}")
                 return
@@ -1518,34 +1518,41 @@ def doCleanupDeletedFiles(cursor=None):
     query = db.Query("viur-deleted-files")
     if cursor:
         query.setCursor(cursor)
-    for file in query.run(100):
-        if "dlkey" not in file:
-            db.delete(file.key)
-        elif db.Query("viur-blob-locks").filter("active_blob_references =", file["dlkey"]).getEntry():
-            logging.info(f"""is referenced, {file["dlkey"]}""")
-            db.delete(file.key)
-        else:
-            if file["itercount"] > maxIterCount:
-                logging.info(f"""Finally deleting, {file["dlkey"]}""")
-                bucket = conf.main_app.file.get_bucket(file["dlkey"])
-                blobs = bucket.list_blobs(prefix=f"""{file["dlkey"]}/""")
-                for blob in blobs:
-                    blob.delete()
+    files = query.run(100)
+    expired = []
+    with db.batch():
+        for file in files:
+            if "dlkey" not in file:
+                db.delete(file.key)
+            elif db.Query("viur-blob-locks").filter("active_blob_references =", file["dlkey"]).keys().getEntry():
+                logging.info(f"""is referenced, {file["dlkey"]}""")
                 db.delete(file.key)
-                # There should be exactly 1 or 0 of these
-                for f in skeletonByKind("file")().all().filter("dlkey =", file["dlkey"]).fetch(99):
-                    f.delete()
-
-                    if f["serving_url"]:
-                        bucket = conf.main_app.file.get_bucket(f["dlkey"])
-                        blob_key = blobstore.create_gs_key(
-                            f"/gs/{bucket.name}/{f['dlkey']}/source/{f['name']}"
-                        )
-                        images.delete_serving_url(blob_key)  # delete serving url
+            elif file["itercount"] > maxIterCount:
+                expired.append(file)
             else:
                 logging.debug(f"""Increasing count, {file["dlkey"]}""")
                 file["itercount"] += 1
                 db.put(file)
+
+    # Not batched, so the entries are only removed along with their blobs
+    for file in expired:
+        logging.info(f"""Finally deleting, {file["dlkey"]}""")
+        bucket = conf.main_app.file.get_bucket(file["dlkey"])
+        blobs = bucket.list_blobs(prefix=f"""{file["dlkey"]}/""")
+        for blob in blobs:
+            blob.delete()
+        db.delete(file.key)
+        # There should be exactly 1 or 0 of these
+        for f in skeletonByKind("file")().all().filter("dlkey =", file["dlkey"]).fetch(99):
+            f.delete()
+
+            if f["serving_url"]:
+                bucket = conf.main_app.file.get_bucket(f["dlkey"])
+                blob_key = blobstore.create_gs_key(
+                    f"/gs/{bucket.name}/{f['dlkey']}/source/{f['name']}"
+                )
+                images.delete_serving_url(blob_key)  # delete serving url
+
     newCursor = query.getCursor()
     if newCursor:
         doCleanupDeletedFiles(newCursor)
@@ -151,7 +151,7 @@ class ModuleConf(List):
     @tasks.StartupTask
     @staticmethod
     def read_all_modules():
-        db_module_names = (m["name"] for m in db.Query(MODULECONF_KINDNAME).run(999))
+        db_module_names = {m["name"] for m in db.Query(MODULECONF_KINDNAME).run(999)}
         visited_modules = set()
 
         def collect_modules(parent, depth: int = 0, prefix: str = "") -> None:
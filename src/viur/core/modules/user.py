@@ -32,7 +32,7 @@ from viur.core.bones.password import PBKDF2_DEFAULT_ITERATIONS, encode_password
 from viur.core.prototypes.list import List
 from viur.core.ratelimit import RateLimit
 from viur.core.securityheaders import extendCsp
-from viur.core.session import Session
+from viur.core.session import Session, get_backend as get_session_backend
 
 
 @functools.total_ordering
@@ -1850,7 +1850,7 @@ class User(List):
         db_session["lastseen"] = time.time()
         db_session["user"] = str(current.user.get()["key"])
         db_session.exclude_from_indexes = {"data"}
-        db.put(db_session)
+        get_session_backend().put(db_session)
 
         # Provide Set-Cookie header entry with configured properties
         return f"{Session.cookie_name}={cookie_key};{Session.build_flags()}"
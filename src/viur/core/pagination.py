@@ -1,7 +1,12 @@
+import datetime
+import logging
 from hashlib import sha256
 import typing as t
 
+from google.api_core.exceptions import AlreadyExists
+
 from viur.core import db, utils
+from viur.core.tasks import CallDeferred
 
 
 class Pagination:
@@ -21,6 +26,10 @@ class Pagination:
     page. When the entities returned by the query change (eg a new post is added), call :meth:refresh_index for
     each affected query.
 
+    Indexes are built lazily: a request only extends the index up to the requested page (plus *prefetch* pages),
+    the remaining pages are added by a deferred task. Refreshed indexes are rebuilt the same way,
+    until then the previous index is used.
+
     .. Note::
 
         The refreshAll Method is missing - intentionally. Whenever data changes you have to call
@@ -30,16 +39,19 @@ class Pagination:
 
     _db_type = "viur_pagination"
 
-    def __init__(self, page_size: int = 10, max_pages: int = 100):
+    def __init__(self, page_size: int = 10, max_pages: int = 100, prefetch: int = 2):
         """
         :param page_size: How many entities shall fit on one page
         :param max_pages: How many pages are build.
             Items become unreachable if the amount of items exceeds
             page_size*max_pages (i.e. if a forum-thread has more than
             page_size*max_pages Posts, Posts after that barrier won't show up).
+        :param prefetch: How many pages after the requested page are added to an incomplete index
+            before the response is sent.
         """
         self.page_size = page_size
         self.max_pages = max_pages
+        self.prefetch = prefetch
 
     def key_from_query(self, query: db.Query) -> str:
         """
@@ -65,7 +77,7 @@ class Pagination:
         filter_key = "".join(f"{x}{y}" for x, y in orig_filter)
         return sha256(filter_key.encode()).hexdigest()
 
-    def get_or_build_index(self, orig_query: db.Query) -> list[str]:
+    def get_or_build_index(self, orig_query: db.Query, pages: t.Optional[int] = None) -> list[str]:
         """
         Builds a specific index based on origQuery
         AND local variables (self.page_size and self.max_pages)
@@ -73,34 +85,122 @@ class Pagination:
         You probably shouldn't call this directly. Use cursor_for_query.
 
         :param orig_query: Query to build the index for
+        :param pages: How many pages the index must contain at least (if the query has that many);
+            the remaining pages are added by a deferred task. Defaults to max_pages.
         """
         key = self.key_from_query(orig_query)
 
         # We don't have it cached - try to load it from DB
-        index = db.get(db.Key(self._db_type, key))
-        if index is not None:
-            return index["data"]
+        if index := db.get(db.Key(self._db_type, key)):
+            cursors = index["data"]
+            complete = index.get("complete", True)  # indexes built before were always complete
+            stale = index.get("stale", False)
+        else:
+            cursors, complete, stale = [None], False, False
+
+        # Extend the index as far as it's needed right now
+        if not complete and len(cursors) < min(pages or self.max_pages, self.max_pages):
+            complete = self._extend(orig_query, cursors, pages or self.max_pages)
+            version = index["creationdate"] if index else None
+            # The index may have been refreshed in the meantime, its new state is built later
+            index = self._write(key, cursors, complete, stale, version=version) \
+                or db.get(db.Key(self._db_type, key))
+
+        if stale or not complete:
+            self._build_later(orig_query, key, index.get("creationdate") if index else None)
+
+        return cursors
+
+    def _extend(self, query: db.Query, cursors: list[t.Optional[str]], pages: int) -> bool:
+        """
+        Appends the starting-cursors of the pages following *cursors*, until there are *pages* of them.
+
+        :returns: True if the index is complete, because the query has no more data or max_pages has been reached.
+        """
+        query = query.clone()
+        if cursors and cursors[-1]:
+            query.setCursor(cursors[-1])
 
-        # We don't have this index yet... Build it
-        query = orig_query.clone()
-        cursors = [None]
-        while len(cursors) < self.max_pages:
+        while cursors and len(cursors) < min(pages, self.max_pages):
             query_res = query.run(limit=self.page_size)
             if not query_res:
                 # This cursor returns no data, remove it
                 cursors.pop()
-                break
+                return True
             if query.getCursor() is None:
                 # We reached the end of our data
-                break
+                return True
             cursors.append(query.getCursor())
             query.setCursor(query.getCursor())
 
+        return not cursors or len(cursors) >= self.max_pages
+
+    def _write(
+        self,
+        key: str,
+        cursors: list[t.Optional[str]],
+        complete: bool,
+        stale: bool = False,
+        version: t.Optional[datetime.datetime] | t.Literal[False] = False,
+    ) -> t.Optional[db.Entity]:
+        """
+        Writes the index; if a *version* is given, only if the stored index still has this creationdate
+        (or doesn't exist, for None), so a concurrent refresh isn't overwritten.
+
+        :returns: The written index, or None if it has been changed concurrently.
+        """
         entry = db.Entity(db.Key(self._db_type, key))
         entry["data"] = cursors
+        entry["complete"] = complete
+        entry["stale"] = stale
         entry["creationdate"] = utils.utcNow()
-        db.put(entry)
-        return cursors
+
+        if version is False:
+            db.put(entry)
+            return entry
+
+        def txn() -> t.Optional[db.Entity]:
+            current = db.get(entry.key)
+            if (current["creationdate"] if current else None) != version:
+                return None
+
+            db.put(entry)
+            return entry
+
+        return db.run_in_transaction(txn)
+
+    def _build(self, query: db.Query, key: str) -> None:
+        """
+        Completes the index for *query*, or rebuilds it from scratch if it has been refreshed.
+        """
+        index = db.get(db.Key(self._db_type, key))
+        version = index["creationdate"] if index else None
+        if index and index.get("stale"):
+            index = None
+        elif index and index.get("complete", True):
+            return
+
+        cursors = index["data"] if index else [None]
+        if not self._write(key, cursors, self._extend(query, cursors, self.max_pages), version=version):
+            logging.debug(f"Pagination index {key} has been changed while it has been built")
+
+    def _build_later(self, query: db.Query, key: str, version: t.Optional[datetime.datetime]) -> None:
+        """
+        Runs :meth:`_build` in a deferred task.
+
+        The task is named after the index and the *version* (the creationdate) it has been requested for,
+        so each state of an index is only built once, regardless how many requests ask for it.
+        Queries which can't be passed to a task (like fulltext searches) are built right away.
+        """
+        if (query_dict := _dump_query(query)) is None:
+            self._build(query, key)
+            return
+
+        name = f"viur-pagination-{key}-{int(version.timestamp() * 1000) if version else 0}"
+        try:
+            _build_index(self._db_type, self.page_size, self.max_pages, query_dict, key, _name=name)
+        except AlreadyExists:
+            logging.debug(f"Pagination index {key} is already being built")
 
     def cursor_for_query(self, query: db.Query, page: int) -> t.Optional[str]:
         """
@@ -117,7 +217,7 @@ class Pagination:
         :returns: Cursor or None if no cursor is applicable
         """
         page = int(page)
-        pages = self.get_or_build_index(query)
+        pages = self.get_or_build_index(query, page + 1 + self.prefetch)
         if 0 <= page < len(pages):
             return pages[page]
         else:
@@ -128,15 +228,69 @@ class Pagination:
         Returns a list of all starting-cursors for this query.
         The first element is always None as the first page doesn't
         have any start-cursor
+
+        While the index is built, only the starting-cursors of the first pages are returned.
         """
-        return self.get_or_build_index(query)
+        return self.get_or_build_index(query, 1 + self.prefetch)
 
     def refresh_index(self, query: db.Query) -> None:
         """
         Refreshes the Index for the given query
-        (Actually it removes it from the db, so it gets rebuild on next use)
+        (Actually it marks it as stale, so it gets rebuild after its next use)
 
         :param query: Query for which the index should be refreshed
         """
         key = self.key_from_query(query)
-        db.delete(db.Key(self._db_type, key))
+        if index := db.get(db.Key(self._db_type, key)):
+            self._write(key, index["data"], index.get("complete", True), stale=True)
+
+
+def _dump_query(query: db.Query) -> t.Optional[dict[str, t.Any]]:
+    """
+    Serializes *query* for :func:`_build_index`, like :meth:`viur.core.tasks.QueryIter.startIterOnQuery` does.
+
+    :returns: The query as JSON-serializable dict, or None if it depends on state which can't be serialized.
+    """
+    if query._fulltextQueryString or query.customQueryInfo \
+            or query._customMultiQueryMerge or query._calculateInternalMultiQueryLimit:
+        return None
+
+    return {
+        "kind": query.kind,
+        "srcSkel": query.srcSkel.kindName if query.srcSkel is not None else None,
+        "filters": query.queries.filters,
+        "orders": [(field, order.value) for field, order in query.queries.orders],
+        "origKind": query.origKind,
+        "distinct": query.queries.distinct,
+        "keysOnly": query.queries.keys_only,
+        "projection": query.queries.projection,
+        "limit": query.queries.limit,
+    }
+
+
+def _load_query(query_dict: dict[str, t.Any]) -> db.Query:
+    """
+    Restores a query serialized by :func:`_dump_query`.
+    """
+    from viur.core.skeleton import skeletonByKind
+
+    query = db.Query(query_dict["kind"])
+    query.srcSkel = skeletonByKind(query_dict["srcSkel"])() if query_dict["srcSkel"] else None
+    query.queries.filters = query_dict["filters"]
+    query.queries.orders = [(field, db.SortOrder(order)) for field, order in query_dict["orders"]]
+    query.origKind = query_dict["origKind"]
+    query.queries.distinct = query_dict["distinct"]
+    query.queries.keys_only = query_dict["keysOnly"]
+    query.queries.projection = query_dict["projection"]
+    query.queries.limit = query_dict["limit"]
+    return query
+
+
+@CallDeferred
+def _build_index(db_type: str, page_size: int, max_pages: int, query_dict: dict[str, t.Any], key: str) -> None:
+    """
+    Completes (or rebuilds) a pagination index, see :meth:`Pagination._build_later`.
+    """
+    pagination = Pagination(page_size=page_size, max_pages=max_pages)
+    pagination._db_type = db_type
+    pagination._build(_load_query(query_dict), key)
@@ -3,6 +3,7 @@ import typing as t
 from viur.core import current, db, errors, utils
 from viur.core.decorators import *
 from viur.core.cache import flushCache
+from viur.core.config import conf
 from viur.core.skeleton import SkeletonInstance
 from .skelmodule import SkelModule
 
@@ -177,6 +178,9 @@ class List(SkelModule):
             raise errors.Forbidden()
 
         self.onView(skel)
+        if self._not_modified(skel["key"], skel["changedate"], kwargs):
+            return ""
+
         return self.render.view(skel)
 
     @exposed
@@ -203,7 +207,11 @@ class List(SkelModule):
             raise errors.Unauthorized()
 
         self._apply_default_order(query)
-        return self.render.list(query.fetch())
+        res = query.fetch()
+        if self._not_modified(kwargs, res.getCursor(), [(entry["key"], entry["changedate"]) for entry in res]):
+            return ""
+
+        return self.render.list(res)
 
     @force_ssl
     @exposed
@@ -594,7 +602,8 @@ class List(SkelModule):
             .. seealso:: :func:`add`, , :func:`onAdd`
         """
         logging.info(f"""Entry added: {skel["key"]!r}""")
-        flushCache(kind=skel.kindName)
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(kind=skel.kindName)
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -622,7 +631,8 @@ class List(SkelModule):
             .. seealso:: :func:`edit`, :func:`onEdit`
         """
         logging.info(f"""Entry changed: {skel["key"]!r}""")
-        flushCache(key=skel["key"])
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(key=skel["key"])
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -663,7 +673,8 @@ class List(SkelModule):
             .. seealso:: :func:`delete`, :func:`onDelete`
         """
         logging.info(f"""Entry deleted: {skel["key"]!r}""")
-        flushCache(key=skel["key"])
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(key=skel["key"])
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -692,7 +703,8 @@ class List(SkelModule):
         .. seealso:: :func:`clone`, :func:`onClone`
         """
         logging.info(f"""Entry cloned: {skel["key"]!r}""")
-        flushCache(kind=skel.kindName)
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(kind=skel.kindName)
 
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
@@ -3,6 +3,7 @@ import typing as t
 from viur.core import db, current, utils, errors
 from viur.core.decorators import *
 from viur.core.cache import flushCache
+from viur.core.config import conf
 from viur.core.skeleton import SkeletonInstance
 from .skelmodule import SkelModule
 
@@ -296,7 +297,8 @@ class Singleton(SkelModule):
         .. seealso:: :func:`edit`, :func:`onEdit`
         """
         logging.info(f"""Entry changed: {skel["key"]!r}""")
-        flushCache(key=skel["key"])
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(key=skel["key"])
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -1,6 +1,7 @@
 import os
 import yaml
 import logging
+from hashlib import sha256
 from viur.core import Module, db, current, errors
 from viur.core.decorators import *
 from viur.core.config import conf
@@ -165,6 +166,39 @@ class SkelModule(Module):
         # Otherwise, return full skeleton
         return skel_cls()
 
+    def _not_modified(self, *validators: t.Any) -> bool:
+        """
+        Answers the request with 304 Not Modified, if the client's copy of the response is still valid.
+
+        The weak ETag of the response is derived from *validators* and everything else a render depends on:
+        the module, the render, the language, the current user, the application version and
+        :attr:`conf.cache_environment_key`. Only used if :attr:`conf.skeleton_etags` is set.
+
+        As the validators are usually taken from the entities to be rendered, a 304 response only saves
+        rendering and transferring the response, not reading its data.
+
+        :return: True, if rendering the response can be skipped.
+        """
+        if not conf.skeleton_etags:
+            return False
+
+        user = current.user.get()
+        validators = (
+            self.modulePath,
+            getattr(self.render, "kind", None),
+            current.language.get(),
+            user and str(user["key"]),
+            conf.instance.app_version,
+            *validators,
+        )
+        if conf.cache_environment_key:
+            try:
+                validators += (conf.cache_environment_key(),)
+            except RuntimeError:  # the environment can't be determined, like the cache of @enableCache handles it
+                return False
+
+        return current.request.get().not_modified(sha256(repr(validators).encode("UTF-8")).hexdigest()[:32], weak=True)
+
     def _apply_default_order(self, query: db.Query):
         """
         Apply the setting from `default_order` to a given db.Query.
@@ -7,6 +7,7 @@ from deprecated.sphinx import deprecated
 from viur.core import current, db, errors
 from viur.core.bones import BooleanBone, KeyBone, SortIndexBone
 from viur.core.cache import flushCache
+from viur.core.config import conf
 from viur.core.decorators import *
 from viur.core.skeleton import Skeleton, SkeletonInstance
 from viur.core.tasks import CallDeferred
@@ -249,22 +250,29 @@ class Tree(SkelModule):
             logging.debug(f"{parentNode=}, {newRepoKey=}")
             return
 
-        def fixTxn(nodeKey, newRepoKey):
-            node = db.get(nodeKey)
-            node["parentrepo"] = newRepoKey
-            db.put(node)
+        def fixTxn(keys: list[db.Key]):
+            # Re-read the entries in a transaction, so changes made since they have been queried aren't overwritten;
+            # a batch can't do that, as it only buffers the writes
+            entities = [entity for entity in db.get(keys) if entity]
+            for entity in entities:
+                entity["parentrepo"] = newRepoKey
+
+            db.put(entities)
+
+        def fixEntries(query: db.Query) -> list[db.Key]:
+            keys = [entity.key for entity in query.keys().iter()]
+            for i in range(0, len(keys), 100):
+                db.run_in_transaction(fixTxn, keys[i:i + 100])
+
+            return keys
 
         # Fix all nodes
-        q = db.Query(self.viewSkel("node").kindName).filter("parententry =", parentNode)
-        for repo in q.iter():
-            self.updateParentRepo(repo.key, newRepoKey, depth=depth + 1)
-            db.run_in_transaction(fixTxn, repo.key, newRepoKey)
+        for key in fixEntries(db.Query(self.viewSkel("node").kindName).filter("parententry =", parentNode)):
+            self.updateParentRepo(key, newRepoKey, depth=depth + 1)
 
         # Fix the leafs on this level
         if self.leafSkelCls:
-            q = db.Query(self.viewSkel("leaf").kindName).filter("parententry =", parentNode)
-            for repo in q.iter():
-                db.run_in_transaction(fixTxn, repo.key, newRepoKey)
+            fixEntries(db.Query(self.viewSkel("leaf").kindName).filter("parententry =", parentNode))
 
     ## Internal exposed functions
 
@@ -999,7 +1007,8 @@ class Tree(SkelModule):
         .. seealso:: :func:`add`, :func:`onAdd`
         """
         logging.info(f"""Entry of kind {skelType!r} added: {skel["key"]!r}""")
-        flushCache(kind=skel.kindName)
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(kind=skel.kindName)
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -1029,7 +1038,8 @@ class Tree(SkelModule):
         .. seealso:: :func:`edit`, :func:`onEdit`
         """
         logging.info(f"""Entry of kind {skelType!r} changed: {skel["key"]!r}""")
-        flushCache(key=skel["key"])
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(key=skel["key"])
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -1076,7 +1086,8 @@ class Tree(SkelModule):
         .. seealso:: :func:`delete`, :func:`onDelete`
         """
         logging.info(f"""Entry deleted: {skel["key"]!r} ({skelType!r})""")
-        flushCache(key=skel["key"])
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(key=skel["key"])
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
 
@@ -1151,7 +1162,8 @@ class Tree(SkelModule):
         .. seealso:: :func:`clone`, :func:`onClone`
         """
         logging.info(f"""Entry cloned: {skel["key"]!r} ({skelType!r})""")
-        flushCache(kind=skel.kindName)
+        if not conf.cache_invalidate_on_write:  # otherwise Skeleton.write/delete invalidate it already
+            flushCache(kind=skel.kindName)
 
         if user := current.user.get():
             logging.info(f"""User: {user["name"]!r} ({user["key"]!r})""")
@@ -1,11 +1,156 @@
+import abc
+import collections
 import datetime
+import logging
+import threading
+import time
 
-from viur.core import current, db, errors, utils
+from viur.core import conf, current, db, errors, utils
 from viur.core.tasks import PeriodicTask, DeleteEntitiesIter
 import typing as t
 from datetime import timedelta
 
 
+class RateLimitBackend(abc.ABC):
+    """
+    Storage of the attempts counted by :class:`RateLimit`, see :attr:`conf.security.ratelimit_backend`.
+    """
+
+    @abc.abstractmethod
+    def increment(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> None:
+        """
+        Counts an attempt of *endpoint* (an IP or user key) on the resource of *ratelimit*.
+        """
+        ...
+
+    @abc.abstractmethod
+    def count(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> float:
+        """
+        Returns the number of attempts of *endpoint* on the resource of *ratelimit* within its time-span.
+        """
+        ...
+
+
+class DatastoreRateLimitBackend(RateLimitBackend):
+    """
+    Counts the attempts in entities of the *viur-ratelimit* kind, one per step of the time-span.
+    Each attempt runs a transaction, expired entities are removed by :func:`cleanOldRateLocks`.
+    """
+
+    def increment(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> None:
+        def updateTxn(cacheKey: str) -> None:
+            key = db.Key(ratelimit.rateLimitKind, cacheKey)
+            obj = db.get(key)
+            if obj is None:
+                obj = db.Entity(key)
+                obj["value"] = 0
+            obj["value"] += 1
+            obj["expires"] = utils.utcNow() + timedelta(minutes=2 * ratelimit.minutes)
+            db.put(obj)
+
+        db.run_in_transaction(updateTxn, ratelimit._getStepKeys(endpoint)[0])
+
+    def count(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> float:
+        currentDateTime = utils.utcNow()
+        tmpRes = db.get([db.Key(ratelimit.rateLimitKind, key) for key in ratelimit._getStepKeys(endpoint)])
+        return sum([x["value"] for x in tmpRes if x and currentDateTime < x["expires"]])
+
+
+class MemcacheRateLimitBackend(RateLimitBackend):
+    """
+    Counts the attempts in the memcache configured as :attr:`conf.db.memcache_client`, one atomic counter
+    per step of the time-span, which expires on its own. Each check costs a single memcache round-trip.
+
+    If the memcache isn't reachable, the quota is considered as exceeded. As the memcache client of App Engine
+    returns empty results on service errors instead of raising, a marker kept in the namespace tells an unavailable
+    memcache apart from endpoints without attempts.
+    """
+
+    NAMESPACE = "viur-ratelimit"
+    AVAILABLE_KEY = "__available__"
+    """Key of the marker which is always kept in the namespace"""
+
+    def increment(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> None:
+        key = ratelimit._getStepKeys(endpoint)[0]
+
+        try:
+            client = self._client()
+            if client.incr(key, namespace=self.NAMESPACE) is None \
+                    and not client.add(key, 1, time=2 * 60 * ratelimit.minutes, namespace=self.NAMESPACE):
+                client.incr(key, namespace=self.NAMESPACE)  # the counter has been added concurrently
+        except Exception as e:
+            logging.error(f"Failed to count the attempt on {ratelimit.resource} with {e=}")
+
+    def count(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> float:
+        keys = ratelimit._getStepKeys(endpoint)
+
+        try:
+            client = self._client()
+            values = client.get_multi(keys + [self.AVAILABLE_KEY], namespace=self.NAMESPACE)
+
+            # The marker is missing if it has been evicted, or the memcache is unavailable and returned nothing
+            if self.AVAILABLE_KEY not in values and not client.set(self.AVAILABLE_KEY, 1, namespace=self.NAMESPACE):
+                raise ConnectionError("The memcache is unavailable")
+        except Exception as e:
+            logging.error(f"Failed to read the attempts on {ratelimit.resource} with {e=}")
+            return float("inf")  # fail closed, as the attempts can't be verified
+
+        return sum(int(values[key]) for key in keys if key in values)
+
+    @staticmethod
+    def _client():
+        """
+        Returns :attr:`conf.db.memcache_client`, which is resolved on each use to not depend on the order
+        of the configuration.
+        """
+        if not (client := conf.db.memcache_client):
+            raise ValueError("MemcacheRateLimitBackend requires conf.db.memcache_client to be set")
+
+        return client
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    Counts the attempts in a token bucket per endpoint inside this instance, holding up to *size* buckets.
+
+    Each attempt takes a token, which is given back after the time-span divided by *maxRate*.
+    The attempts aren't shared between instances, so this is meant for applications running on a single instance.
+    """
+
+    def __init__(self, size: int = 10_000):
+        self.size = size
+        self._buckets: collections.OrderedDict[tuple[str, str], tuple[float, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _taken(self, ratelimit: "RateLimit", bucket: tuple[str, str], now: float) -> float:
+        """
+        Returns the number of tokens currently taken from *bucket*.
+        """
+        taken, last = self._buckets.get(bucket, (0.0, now))
+        return max(taken - (now - last) * ratelimit.maxRate / (60 * ratelimit.minutes), 0.0)
+
+    def increment(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> None:
+        bucket = (ratelimit.resource, str(endpoint))
+        now = time.monotonic()
+
+        with self._lock:
+            self._buckets[bucket] = (self._taken(ratelimit, bucket, now) + 1, now)
+            self._buckets.move_to_end(bucket)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+
+    def count(self, ratelimit: "RateLimit", endpoint: db.Key | str) -> float:
+        with self._lock:
+            return self._taken(ratelimit, (ratelimit.resource, str(endpoint)), time.monotonic())
+
+
+def get_backend() -> RateLimitBackend:
+    """
+    Returns the configured :class:`RateLimitBackend`.
+    """
+    return conf.security.ratelimit_backend or _datastore_backend
+
+
 class RateLimit(object):
     """
         This class is used to restrict access to certain functions to *maxRate* calls per minute.
@@ -60,51 +205,29 @@ class RateLimit(object):
             else:  # It's IPv4, simply return that address
                 return remoteAddr
 
-    def _getCurrentTimeKey(self) -> str:
+    def _getStepKeys(self, endPoint: db.Key | str) -> list[str]:
         """
-        :return: the current lockperiod used in second position of the memcache key
+        :return: the keys of the lockperiods within the time-span for *endPoint*, starting with the current one
         """
-        dateTime = utils.utcNow()
-        key = dateTime.strftime("%Y-%m-%d-%%s")
-        secsinceMidnight = (dateTime - dateTime.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
-        currentStep = int(secsinceMidnight / self.secondsPerStep)
-        return key % currentStep
+        currentDateTime = utils.utcNow()
+        secSinceMidnight = (currentDateTime - currentDateTime.replace(hour=0, minute=0, second=0,
+                                                                      microsecond=0)).total_seconds()
+        currentStep = int(secSinceMidnight / self.secondsPerStep)
+        keyBase = currentDateTime.strftime("%Y-%m-%d-%%s")
+        return [f"{self.resource}-{endPoint}-{keyBase % (currentStep - x)}" for x in range(0, self.steps)]
 
     def decrementQuota(self) -> None:
         """
         Removes one attempt from the pool of available Quota for that user/ip
         """
-
-        def updateTxn(cacheKey: str) -> None:
-            key = db.Key(self.rateLimitKind, cacheKey)
-            obj = db.get(key)
-            if obj is None:
-                obj = db.Entity(key)
-                obj["value"] = 0
-            obj["value"] += 1
-            obj["expires"] = utils.utcNow() + timedelta(minutes=2 * self.minutes)
-            db.put(obj)
-
-        lockKey = f"{self.resource}-{self._getEndpointKey()}-{self._getCurrentTimeKey()}"
-        db.run_in_transaction(updateTxn, lockKey)
+        get_backend().increment(self, self._getEndpointKey())
 
     def isQuotaAvailable(self) -> bool:
         """
         Checks if there's currently quota available for the current user/ip
         :return: True if there's quota available, False otherwise
         """
-        endPoint = self._getEndpointKey()
-        currentDateTime = utils.utcNow()
-        secSinceMidnight = (currentDateTime - currentDateTime.replace(hour=0, minute=0, second=0,
-                                                                      microsecond=0)).total_seconds()
-        currentStep = int(secSinceMidnight / self.secondsPerStep)
-        keyBase = currentDateTime.strftime("%Y-%m-%d-%%s")
-        cacheKeys = []
-        for x in range(0, self.steps):
-            cacheKeys.append(
-                db.Key(self.rateLimitKind, f"{self.resource}-{endPoint}-{keyBase % (currentStep - x)}"))
-        tmpRes = db.get(cacheKeys)
-        return sum([x["value"] for x in tmpRes if x and currentDateTime < x["expires"]]) <= self.maxRate
+        return get_backend().count(self, self._getEndpointKey()) <= self.maxRate
 
     def assertQuotaIsAvailable(self, setRetryAfterHeader: bool = True) -> bool:
         """Assert quota is available.
@@ -129,4 +252,10 @@ class RateLimit(object):
 
 @PeriodicTask(interval=datetime.timedelta(hours=1))
 def cleanOldRateLocks(*args, **kwargs) -> None:
-    DeleteEntitiesIter.startIterOnQuery(db.Query(RateLimit.rateLimitKind).filter("expires <", utils.utcNow()))
+    if not isinstance(get_backend(), DatastoreRateLimitBackend):
+        return  # other backends expire the attempts on their own
+
+    DeleteEntitiesIter.startIterOnQuery(db.Query(RateLimit.rateLimitKind).filter("expires <", utils.utcNow()).keys())
+
+
+_datastore_backend = DatastoreRateLimitBackend()
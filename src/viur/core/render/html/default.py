@@ -9,6 +9,7 @@ import typing as t
 from jinja2 import ChoiceLoader, Environment, FileSystemLoader, Template
 
 from viur.core import conf, current, errors, securitykey
+from viur.core.cache import CacheExtension
 from viur.core.bones import *
 from viur.core.i18n import translate, LanguageWrapper, TranslationExtension
 from viur.core.skeleton import SkelList, SkeletonInstance, remove_render_preparation_deep
@@ -525,7 +526,8 @@ class Render(AbstractRenderer):
         if "env" not in dir(self):
             loaders = self.getLoaders()
             self.env = Environment(loader=loaders,
-                                   extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols", TranslationExtension])
+                                   extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols", TranslationExtension,
+                                               CacheExtension])
             self.env.trCache = {}
             self.env.policies["json.dumps_kwargs"]["cls"] = CustomJsonEncoder
 
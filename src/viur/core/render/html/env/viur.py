@@ -5,14 +5,14 @@ import typing as t
 import urllib
 import urllib.parse
 from datetime import timedelta
-from hashlib import sha512
 import jinja2
 from deprecated.sphinx import deprecated
+from markupsafe import Markup
 from qrcode import make as qrcode_make
 from qrcode.image import svg as qrcode_svg
 
 import string
-from viur.core import Method, current, db, errors, prototypes, securitykey, utils
+from viur.core import Method, cache, current, db, errors, prototypes, securitykey, utils
 from viur.core.config import conf
 from viur.core.i18n import LanguageWrapper
 from viur.core.i18n import translate as translate_class
@@ -49,40 +49,45 @@ def execRequest(render: Render, path: str, *args, **kwargs) -> t.Any:
 
     :param path: Local part of the url, e.g. user/list. Must not start with an /.
         Must not include an protocol or hostname.
+    :param cachetime: Caches the result for this many seconds in the fragment cache, see
+        :func:`viur.core.cache.fragment`. Only string results are cached, and only if all parameters are
+        plain values (strings, numbers, keys and lists or dicts thereof). The result is cached per user.
 
     :returns: Whatever the requested resource returns. This is *not* limited to strings!
     """
-    request = current.request.get()
-    cachetime = kwargs.pop("cachetime", 0)
-    if conf.debug.disable_cache or request.disableCache:  # Caching disabled by config
-        cachetime = 0
-    cacheEnvKey = None
-    if conf.cache_environment_key:
-        try:
-            cacheEnvKey = conf.cache_environment_key()
-        except RuntimeError:
-            cachetime = 0
-    if cachetime:
-        # Calculate the cache key that entry would be stored under
-        tmpList = [f"{k}:{v}" for k, v in kwargs.items()]
-        tmpList.sort()
-        tmpList.extend(list(args))
-        tmpList.append(path)
-        if cacheEnvKey is not None:
-            tmpList.append(cacheEnvKey)
+    if cachetime := kwargs.pop("cachetime", 0):
         try:
-            appVersion = request.request.environ["CURRENT_VERSION_ID"].split('.')[0]
-        except:
-            appVersion = ""
-            logging.error("Could not determine the current application id! Caching might produce unexpected results!")
-        tmpList.append(appVersion)
-        mysha512 = sha512()
-        mysha512.update(str(tmpList).encode("UTF8"))
-        # TODO: Add hook for optional memcache or remove these remnants
-        cacheKey = f"jinja2_cache_{mysha512.hexdigest()}"
-        res = None  # memcache.get(cacheKey)
-        if res:
-            return res
+            params = _normalize_fragment_param((args, kwargs))
+        except TypeError:  # the parameters can't be part of a cache key
+            logging.debug(f"Not caching execRequest of {path=}, as its parameters can't be normalized")
+        else:
+            # The result is cached in the fragment cache, see viur.core.cache.fragment
+            user = current.user.get()
+            name = ("execRequest", path, params, user["key"] if user else None)
+            res = cache.fragment(name, cachetime, lambda: _exec_request(path, *args, **kwargs))
+            return Markup(res) if isinstance(res, str) else res
+
+    return _exec_request(path, *args, **kwargs)
+
+
+def _normalize_fragment_param(value: t.Any) -> t.Hashable:
+    """
+    Turns a parameter of execRequest into a hashable value with a stable repr, to be part of a cache key.
+
+    :raises TypeError: If the value can't be normalized.
+    """
+    if value is None or isinstance(value, (str, int, float, bool, db.Key)):
+        return value
+    elif isinstance(value, (list, tuple)):
+        return tuple(_normalize_fragment_param(item) for item in value)
+    elif isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return tuple(sorted((key, _normalize_fragment_param(item)) for key, item in value.items()))
+
+    raise TypeError(f"Can't normalize {type(value)}")
+
+
+def _exec_request(path: str, *args, **kwargs) -> t.Any:
+    request = current.request.get()
     # Pop this key after building the cache string with it
     template_style = kwargs.pop(TEMPLATE_STYLE_KEY, None)
     tmp_params = request.kwargs.copy()
@@ -119,9 +124,6 @@ def execRequest(render: Render, path: str, *args, **kwargs) -> t.Any:
     request.kwargs = tmp_params
     request.internalRequest = lastRequestState
     request.template_style = last_template_style
-    if cachetime:
-        pass
-    # memcache.set(cacheKey, resstr, cachetime)
     return resstr
 
 
@@ -5,6 +5,7 @@
     Additionally, this module defines the RequestValidator interface which provides a very early hook into the
     request processing (useful for global ratelimiting, DDoS prevention or access control).
 """
+import contextvars
 import datetime
 import fnmatch
 import json
@@ -94,6 +95,33 @@ class FetchMetaDataValidator(RequestValidator):
         return 403, "Forbidden", "Request rejected due to fetch metadata"
 
 
+class _AfterResponseIterator:
+    """
+        Wraps the body of a response to call *tasks* once the WSGI server has sent it.
+
+        The tasks run in a copy of the context it has been created in, as the request's context variables
+        (current.request, current.user, current.language, ...) are unset by then.
+    """
+
+    def __init__(self, app_iter: t.Iterable[bytes], tasks: list[t.Callable[[], None]]):
+        self.app_iter = app_iter
+        self.tasks = tasks
+        self.context = contextvars.copy_context()
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        return iter(self.app_iter)
+
+    def close(self) -> None:
+        if hasattr(self.app_iter, "close"):
+            self.app_iter.close()
+
+        for task in self.tasks:
+            try:
+                self.context.run(task)
+            except Exception:  # noqa
+                logging.exception(f"Task {task} after the response failed")
+
+
 class Router:
     """
         This class accepts the requests, collect its parameters and routes the request
@@ -136,6 +164,8 @@ class Router:
         self.internalRequest = False
         self.disableCache = False  # Shall this request bypass the caches?
         self.pendingTasks = []
+        self.after_response_tasks: list[t.Callable[[], None]] = []  # Called after the response has been sent
+        self.task_buffer = None  # Collects the tasks created during this request, see tasks.TaskBuffer
         self.args = ()
         self.kwargs = {}
         self.context = {}
@@ -148,6 +178,7 @@ class Router:
         self.isSSLConnection = self.request.host_url.lower().startswith("https://")  # We have an encrypted channel
 
         db.current_db_access_log.set(set())
+        db.current_db_stats.set(db.DatabaseStats() if conf.db.stats else None)
 
         # Set context variables
         current.language.set(conf.i18n.default_language)
@@ -160,12 +191,21 @@ class Router:
 
         self._cors()
 
+        self._db_stats()
+
+        if self.after_response_tasks:
+            # must be wrapped before the context variables are unset
+            content_length = self.response.content_length
+            self.response.app_iter = _AfterResponseIterator(self.response.app_iter, self.after_response_tasks)
+            self.response.content_length = content_length
+
         # Unset context variables
         current.language.set(None)
         current.request_data.set(None)
         current.session.set(None)
         current.request.set(None)
         current.user.set(None)
+        db.current_db_stats.set(None)
 
     @property
     def isDevServer(self) -> bool:
@@ -664,10 +704,55 @@ class Router:
             self.response.status = "204 No Content"
             return
 
+        if self.response.status_int == 304:
+            # Not Modified responses don't have a body
+            return
+
         if not isinstance(res, bytes):  # Convert the result to bytes if it is not already!
             res = str(res).encode("UTF-8")
         self.response.write(res)
 
+    def not_modified(self, etag: str, weak: bool = False) -> bool:
+        """
+        Sets the ETag of the response and answers a matching If-None-Match header with 304 Not Modified.
+
+        Call this as soon as the validator of the response is known, and skip rendering if it returns True.
+
+        :param etag: The entity-tag of the response, without quotes.
+        :param weak: Emits a weak validator, for responses which are semantically but not byte-for-byte equal.
+        :return: True, if the client's copy is still valid and the response has been turned into a 304.
+        """
+        if self.internalRequest:
+            # The validator would apply to the outer response
+            return False
+
+        self.response.etag = (etag, not weak)
+
+        if self.method not in ("get", "head") or etag not in self.request.if_none_match:
+            return False
+
+        self.response.status = 304
+        return True
+
+    def _db_stats(self) -> None:
+        """
+        Emits the datastore statistics of this request, see :attr:`conf.db.stats`.
+        """
+        if (stats := db.current_db_stats.get()) is None:
+            return
+
+        if conf.db.stats_server_timing:
+            self.response.headers["Server-Timing"] = stats.server_timing()
+
+        if conf.db.stats_log:
+            logging.info(f"{self.method.upper()} {self.path}: {stats.summary()}")
+
+        if conf.db.stats_exporter:
+            try:
+                conf.db.stats_exporter(stats)
+            except Exception:  # noqa
+                logging.exception("conf.db.stats_exporter failed")
+
     def _cors(self) -> None:
         """
         Set CORS headers to the HTTP response.
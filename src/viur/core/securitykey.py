@@ -16,10 +16,20 @@
         programmatic access (admin tools, import tools etc.) where CSRF attacks are not applicable.
 
         Therefor that header is prefixed with "Sec-" - so it cannot be read or set using JavaScript.
+
+    ..note:
+        With `conf.security.stateless_skeys` enabled, security-keys are issued as signed, expiring tokens
+        instead of datastore entities, see :func:`create`.
 """
 import typing as t
+import base64
+import binascii
 import datetime
+import hashlib
 import hmac
+import json
+import logging
+import time
 from viur.core import conf, utils, current, db, tasks
 
 SECURITYKEY_KINDNAME = "viur-securitykey"
@@ -30,12 +40,120 @@ and must be specified in requests that require a skey."""
 SECURITYKEY_STATIC_SKEY: t.Final[str] = "STATIC_SESSION_KEY"
 """Value that must be used as a marker in the payload (key: skey) to indicate
 that the session key from the headers should be used."""
+STATELESS_PREFIX: t.Final[str] = "s1."
+"""Prefix of stateless security-keys"""
+USED_NONCES_NAMESPACE: t.Final[str] = "viur-securitykey"
+"""Memcache namespace of the nonces of stateless security-keys which have already been used"""
+USED_NONCES_SESSION_KEY: t.Final[str] = "viur_used_skeys"
+"""Session key of the nonces of stateless security-keys which have already been used, if there's no memcache"""
+
+
+def _sign(secret: bytes, payload: str, session_key: t.Optional[str]) -> str:
+    msg = f"viur-securitykey\x00{payload}\x00{session_key or ''}".encode("UTF-8")
+    return base64.urlsafe_b64encode(hmac.new(secret, msg, hashlib.sha3_256).digest()).rstrip(b"=").decode("ASCII")
+
+
+def _create_stateless(
+        until: datetime.datetime,
+        session_bound: bool,
+        custom_data: dict[str, t.Any],
+) -> t.Optional[str]:
+    """
+        Creates a stateless security-key, or returns None if the key has to be stored in the datastore.
+
+        The key is a token signed with :func:`viur.core.session.signing_secret`, holding a nonce, the expiration
+        and the custom data, which is bound to the current session by its signature. To make it usable only once,
+        the nonce is remembered as used in the memcache, or inside the session if there's no memcache and the
+        session is stored server-side.
+    """
+    from viur.core.session import signing_secret
+
+    if not (secret := signing_secret()) or not (conf.db.memcache_client or (session_bound and _server_side_session())):
+        return None
+
+    try:
+        data = json.dumps(custom_data)
+    except (TypeError, ValueError):  # custom data which can only be stored in the datastore
+        return None
+
+    # Custom data must survive the JSON round-trip unchanged (e.g. no tuples or non-string dict keys)
+    if len(data) > conf.security.stateless_skeys_max_data or json.loads(data) != custom_data:
+        return None
+
+    payload = {"n": utils.string.random(13), "u": int(until.timestamp())}
+    if custom_data:
+        payload["d"] = custom_data
+
+    payload = json.dumps(payload, separators=(",", ":"))
+    payload = base64.urlsafe_b64encode(payload.encode("UTF-8")).rstrip(b"=").decode("ASCII")
+    session_key = current.session.get().cookie_key if session_bound else None
+    return f"{STATELESS_PREFIX}{payload}.{_sign(secret, payload, session_key)}"
+
+
+def _server_side_session() -> bool:
+    """
+        Checks if the current session is stored in the session backend. Sessions kept in a guest cookie
+        can't record used nonces, as the client could simply send an older cookie again.
+    """
+    return current.session.get().server_side or not conf.user.session_guest_cookie
+
+
+def _use_nonce(nonce: str, until: int, session_bound: bool) -> bool:
+    """
+        Marks the *nonce* of a stateless security-key as used. Returns False if it has been used before,
+        or if it can't be recorded.
+    """
+    if conf.db.memcache_client:
+        try:
+            return bool(conf.db.memcache_client.add(
+                nonce, 1, time=max(until - time.time(), 1), namespace=USED_NONCES_NAMESPACE
+            ))
+        except Exception as e:
+            logging.error(f"Failed to mark the security-key as used with {e=}")
+
+    if not (session_bound and _server_side_session()):
+        return False
+
+    session = current.session.get()
+    now = time.time()
+    used = {k: v for k, v in (session.get(USED_NONCES_SESSION_KEY) or {}).items() if v >= now}
+    if nonce in used:
+        return False
+
+    used[nonce] = until
+    session[USED_NONCES_SESSION_KEY] = used
+    return True
+
+
+def _validate_stateless(key: str, session_bound: bool) -> bool | db.Entity:
+    from viur.core.session import signing_secret
+
+    if not (secret := signing_secret()):
+        return False
+
+    payload, _, signature = key.removeprefix(STATELESS_PREFIX).rpartition(".")
+    session_key = current.session.get().cookie_key if session_bound else None
+    if (session_bound and not session_key) or not hmac.compare_digest(_sign(secret, payload, session_key), signature):
+        return False
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (binascii.Error, ValueError):
+        return False
+
+    # Key has expired or has been used before?
+    if payload["u"] < time.time() or not _use_nonce(payload["n"], payload["u"], session_bound):
+        return False
+
+    entity = db.Entity()
+    entity |= payload.get("d") or {}
+    return entity or True
 
 
 def create(
         duration: None | int | datetime.timedelta = None,
         session_bound: bool = True,
-        key_length: int = 13,
+        key_length: t.Optional[int] = None,
         indexed: bool = True,
         **custom_data,
 ) -> str:
@@ -45,10 +163,15 @@ def create(
         The custom data (given as **custom_data) that can be stored with the key.
         Any data provided must be serializable by the datastore.
 
+        With `conf.security.stateless_skeys` enabled, the key is a signed token instead of a datastore entity,
+        unless a *key_length* is given, the custom data isn't JSON-serializable or larger than
+        `conf.security.stateless_skeys_max_data`, or the key isn't session bound and there's no memcache
+        to remember its use.
+
         :param duration: Make this CSRF-token valid for a fixed timeframe.
         :param session_bound: Bind this CSRF-token to the current session.
         :param indexed: Indexes all values stored with the security-key (default), set False to not index.
-        :param key_length: Allows to modify the length of the generated randomized key
+        :param key_length: Allows to modify the length of the generated randomized key (13 by default)
         :param custom_data: Any other data is stored with the CSRF-token, for later re-use.
 
         :returns: The new one-time key, which is a randomized string.
@@ -59,21 +182,23 @@ def create(
     if not duration:
         duration = conf.user.session_life_time if session_bound else SECURITYKEY_DURATION
 
-    key = utils.string.random(key_length)
+    until = utils.utcNow() + utils.parse.timedelta(duration)
 
-    entity = db.Entity(db.Key(SECURITYKEY_KINDNAME, key))
-    entity |= custom_data
     if session_bound:
         session = current.session.get()
         if not session.loaded:
             session.reset()
-        entity["viur_session"] = session.cookie_key
 
-    else:
-        entity["viur_session"] = None
+    if conf.security.stateless_skeys and key_length is None \
+            and (key := _create_stateless(until, session_bound, custom_data)):
+        return key
 
-    entity["viur_until"] = utils.utcNow() + utils.parse.timedelta(duration)
+    key = utils.string.random(key_length or 13)
 
+    entity = db.Entity(db.Key(SECURITYKEY_KINDNAME, key))
+    entity |= custom_data
+    entity["viur_session"] = session.cookie_key if session_bound else None
+    entity["viur_until"] = until
 
     if not indexed:
         entity.exclude_from_indexes = [k for k in entity.keys() if not k.startswith("viur_")]
@@ -98,11 +223,14 @@ def validate(key: str, session_bound: bool = True) -> bool | db.Entity:
 
         return False
 
+    if key and key.startswith(STATELESS_PREFIX):
+        return _validate_stateless(key, session_bound)
+
     if not key or not (entity := db.get(db.Key(SECURITYKEY_KINDNAME, key))):
         return False
 
     # First of all, delete the entity, validation is done afterward.
-    db.delete(entity)
+    db.delete(entity.key)
 
     # Key has expired?
     if entity["viur_until"] < utils.utcNow():
@@ -129,7 +257,7 @@ def periodic_clear_skeys():
         Removes expired CSRF-security-keys periodically.
     """
     query = db.Query(SECURITYKEY_KINDNAME).filter("viur_until <", utils.utcNow() - datetime.timedelta(seconds=300))
-    tasks.DeleteEntitiesIter.startIterOnQuery(query)
+    tasks.DeleteEntitiesIter.startIterOnQuery(query.keys())
 
 
 @tasks.CallDeferred
@@ -140,4 +268,4 @@ def clear_session_skeys(session_key):
         This function is called by the Session-module based on reset-actions.
     """
     query = db.Query(SECURITYKEY_KINDNAME).filter("viur_session", session_key)
-    tasks.DeleteEntitiesIter.startIterOnQuery(query)
+    tasks.DeleteEntitiesIter.startIterOnQuery(query.keys())
@@ -1,4 +1,10 @@
+import abc
+import base64
+import binascii
 import datetime
+import hashlib
+import hmac
+import json
 import logging
 import time
 import typing as t
@@ -7,6 +13,11 @@ from viur.core import current, db, tasks, utils
 from viur.core.config import conf  # this import has to stay alone due partial import
 from viur.core.tasks import DeleteEntitiesIter
 
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ModuleNotFoundError:
+    Fernet = None
+
 """
     Provides the session implementation for the Google AppEngine™ based on the datastore.
     To access the current session,  and call current.session.get()
@@ -29,6 +40,246 @@ _SENTINEL: t.Final[object] = object()
 TObserver = t.TypeVar("TObserver", bound=t.Callable[[db.Entity], None])
 """Type of the observer for :meth:`Session.on_delete`"""
 
+REFRESH_INTERVAL: t.Final[int] = 5 * 60
+"""Seconds after which the lastseen timestamp of an unchanged session is refreshed"""
+
+GUEST_COOKIE_PREFIX: t.Final[str] = "g1."
+"""Prefix of cookie values holding a signed guest session, see :attr:`conf.user.session_guest_cookie`"""
+
+ENCRYPTED_GUEST_COOKIE_PREFIX: t.Final[str] = "g1e."
+"""Prefix of cookie values holding a signed and encrypted guest session"""
+
+
+class SessionBackend(abc.ABC):
+    """
+    Storage of the sessions, see :attr:`conf.user.session_backend`.
+
+    Sessions are passed as entities of the *viur-session* kind, named by their cookie key.
+    """
+
+    @abc.abstractmethod
+    def get(self, cookie_key: str) -> t.Optional[db.Entity]:
+        """
+        Returns the session stored under *cookie_key*, or None if there is no such session.
+        """
+        ...
+
+    @abc.abstractmethod
+    def put(self, entity: db.Entity) -> None:
+        """
+        Writes a new session, or a session whose data has been changed.
+        """
+        ...
+
+    @abc.abstractmethod
+    def touch(self, entity: db.Entity) -> None:
+        """
+        Writes the lastseen timestamp of a session whose data hasn't been changed.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete(self, cookie_key: str) -> None:
+        ...
+
+    def evict(self, cookie_key: str) -> None:
+        """
+        Drops copies of the session kept outside the datastore; called when it has been modified in the datastore.
+        """
+        pass
+
+
+class DatastoreSessionBackend(SessionBackend):
+    """
+    Keeps the sessions in the datastore only; each refresh of lastseen rewrites the whole session.
+    """
+
+    def get(self, cookie_key: str) -> t.Optional[db.Entity]:
+        return db.get(db.Key(Session.kindName, cookie_key))
+
+    def put(self, entity: db.Entity) -> None:
+        db.put(entity)
+
+    def touch(self, entity: db.Entity) -> None:
+        db.put(entity)
+
+    def delete(self, cookie_key: str) -> None:
+        db.delete(db.Key(Session.kindName, cookie_key))
+
+
+class MemcacheSessionBackend(DatastoreSessionBackend):
+    """
+    Serves the sessions from the memcache configured as :attr:`conf.db.memcache_client`, in front of the datastore.
+
+    Changed sessions are written to both. Refreshes of lastseen only go to the memcache and are written behind
+    to the datastore at most every *write_behind* (but at least twice per :attr:`conf.user.session_life_time`,
+    so the sessions aren't removed as expired).
+    """
+
+    NAMESPACE = "viur-session"
+
+    def __init__(self, write_behind: datetime.timedelta = datetime.timedelta(minutes=30)):
+        self.write_behind = write_behind
+
+    def _write_behind_seconds(self) -> float:
+        return min(self.write_behind.total_seconds(), conf.user.session_life_time.total_seconds() / 2)
+
+    def _cache(self, entity: db.Entity, persisted: float) -> None:
+        try:
+            conf.db.memcache_client.set(
+                entity.key.name,
+                {
+                    "data": dict(entity["data"]),
+                    "static_security_key": entity["static_security_key"],
+                    "lastseen": entity["lastseen"],
+                    "user": entity["user"],
+                    "persisted": persisted,  # lastseen of the copy in the datastore
+                },
+                time=conf.user.session_life_time.total_seconds(),
+                namespace=self.NAMESPACE,
+            )
+        except Exception as e:
+            logging.error(f"Failed to cache the session with {e=}")
+
+    def _get_cached(self, cookie_key: str) -> t.Optional[dict]:
+        try:
+            return conf.db.memcache_client.get(cookie_key, namespace=self.NAMESPACE)
+        except Exception as e:
+            logging.error(f"Failed to read the cached session with {e=}")
+            return None
+
+    def get(self, cookie_key: str) -> t.Optional[db.Entity]:
+        if cached := self._get_cached(cookie_key):
+            entity = db.Entity(db.Key(Session.kindName, cookie_key), exclude_from_indexes=["data"])
+            entity.update({name: cached[name] for name in ("data", "static_security_key", "lastseen", "user")})
+            return entity
+
+        if entity := super().get(cookie_key):
+            self._cache(entity, entity["lastseen"])
+
+        return entity
+
+    def put(self, entity: db.Entity) -> None:
+        super().put(entity)
+        self._cache(entity, entity["lastseen"])
+
+    def touch(self, entity: db.Entity) -> None:
+        cached = self._get_cached(entity.key.name)
+        if not cached or entity["lastseen"] - cached["persisted"] >= self._write_behind_seconds():
+            self.put(entity)
+        else:
+            self._cache(entity, cached["persisted"])
+
+    def delete(self, cookie_key: str) -> None:
+        super().delete(cookie_key)
+        self.evict(cookie_key)
+
+    def evict(self, cookie_key: str) -> None:
+        try:
+            conf.db.memcache_client.delete(cookie_key, namespace=self.NAMESPACE)
+        except Exception as e:
+            logging.error(f"Failed to evict the cached session with {e=}")
+
+
+def get_backend() -> SessionBackend:
+    """
+    Returns the configured :class:`SessionBackend`.
+    """
+    return conf.user.session_backend or _datastore_backend
+
+
+def signing_secret() -> t.Optional[bytes]:
+    """
+    Returns the secret to sign guest session cookies and stateless security keys with,
+    which is :attr:`conf.user.session_secret` or :attr:`conf.file_hmac_key`.
+    """
+    secret = conf.user.session_secret or conf.file_hmac_key
+    return secret.encode("UTF-8") if isinstance(secret, str) else secret
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ASCII")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _fernet(secret: bytes) -> "Fernet":
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(b"viur-session-encryption" + secret).digest()))
+
+
+def _sign(secret: bytes, payload: str) -> str:
+    return _b64encode(hmac.new(secret, payload.encode("ASCII"), hashlib.sha3_256).digest())
+
+
+def encode_guest_cookie(data: dict) -> t.Optional[str]:
+    """
+    Encodes the data of a guest session into a signed (and, if configured, encrypted) cookie value.
+
+    Returns None if guest session cookies are disabled or not possible for *data*,
+    so the session has to be stored in the session backend.
+    """
+    if not conf.user.session_guest_cookie or not (secret := signing_secret()):
+        return None
+
+    try:
+        payload = json.dumps(data, separators=(",", ":"))
+    except (TypeError, ValueError):  # contains values which can only be stored in the datastore
+        return None
+
+    # Data which changes on the JSON round-trip (e.g. tuples or non-string dict keys) is kept in the session backend
+    if json.loads(payload) != data:
+        return None
+
+    payload = payload.encode("UTF-8")
+
+    if conf.user.session_guest_cookie_encrypt:
+        if Fernet is None:
+            logging.error("session_guest_cookie_encrypt requires the cryptography package")
+            return None
+
+        prefix, payload = ENCRYPTED_GUEST_COOKIE_PREFIX, _b64encode(_fernet(secret).encrypt(payload))
+    else:
+        prefix, payload = GUEST_COOKIE_PREFIX, _b64encode(payload)
+
+    value = f"{prefix}{payload}.{_sign(secret, prefix + payload)}"
+    if len(value) > conf.user.session_guest_cookie_max_size:
+        return None
+
+    return value
+
+
+def decode_guest_cookie(value: str) -> t.Optional[dict]:
+    """
+    Verifies and decodes a cookie value created by :func:`encode_guest_cookie`.
+
+    Returns None if it's not a valid guest session cookie.
+    """
+    if not (secret := signing_secret()):
+        return None
+
+    payload, _, signature = value.rpartition(".")
+    if not hmac.compare_digest(_sign(secret, payload), signature):
+        logging.warning("Rejected a guest session cookie with an invalid signature")
+        return None
+
+    try:
+        if payload.startswith(ENCRYPTED_GUEST_COOKIE_PREFIX):
+            if Fernet is None:
+                return None
+
+            try:
+                data = _fernet(secret).decrypt(_b64decode(payload.removeprefix(ENCRYPTED_GUEST_COOKIE_PREFIX)))
+            except InvalidToken:
+                return None
+        else:
+            data = _b64decode(payload.removeprefix(GUEST_COOKIE_PREFIX))
+
+        return json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+
 
 class Session(db.Entity):
     """
@@ -49,6 +300,10 @@ class Session(db.Entity):
             database object will be created and a new cookie with a different key is sent to the browser). This causes
             all data currently stored to be lost. Only keys listed in these variables will be copied into the new
             session.
+        - The config variable conf.user.session_guest_cookie keeps the sessions of guests inside a signed cookie
+            instead of the session backend. They are moved into the backend as soon as a user logs in or the data
+            doesn't fit into the cookie anymore. Note that such sessions can't be invalidated server-side
+            (e.g. by :func:`killSessionByUser`) before their lifetime has expired.
     """
     kindName = "viur-session"
     same_site = "lax"  # Either None (don't issue same_site header), "none", "lax" or "strict"
@@ -61,47 +316,57 @@ class Session(db.Entity):
     def __init__(self):
         super().__init__()
         self.changed = False
+        self.refresh = False  # lastseen has to be refreshed
         self.cookie_key = None
         self.static_security_key = None
         self.loaded = False
+        self.server_side = False  # the session is stored in the session backend, not in a guest cookie
 
     def load(self):
         """
             Initializes the Session.
 
-            If the client supplied a valid Cookie, the session is read from the datastore, otherwise a new,
-            empty session will be initialized.
+            If the client supplied a valid Cookie, the session is read from the cookie or the session backend,
+            otherwise a new, empty session will be initialized.
         """
 
-        if cookie_key := current.request.get().request.cookies.get(self.cookie_name):
-            cookie_key = str(cookie_key)
-            if data := db.get(db.Key(self.kindName, cookie_key)):  # Loaded successfully
+        if cookie := current.request.get().request.cookies.get(self.cookie_name):
+            cookie = str(cookie)
+            if guest := cookie.startswith((GUEST_COOKIE_PREFIX, ENCRYPTED_GUEST_COOKIE_PREFIX)):
+                if data := decode_guest_cookie(cookie):
+                    cookie_key = data["cookie_key"]
+            else:
+                cookie_key, data = cookie, get_backend().get(cookie)
+
+            if data:  # Loaded successfully
                 if data["lastseen"] < time.time() - conf.user.session_life_time.total_seconds():
                     # This session is too old
                     self.reset()
                     return False
 
                 self.loaded = True
+                self.server_side = not guest
                 self.cookie_key = cookie_key
 
                 super().clear()
                 super().update(data["data"])
 
                 self.static_security_key = data.get("static_security_key") or data.get("staticSecurityKey")
-                if data["lastseen"] < time.time() - 5 * 60:  # Refresh every 5 Minutes
-                    self.changed = True
+                if data["lastseen"] < time.time() - REFRESH_INTERVAL:
+                    self.refresh = True
 
             else:
                 self.reset()
 
     def save(self):
         """
-            Writes the session into the database.
+            Writes the session into a guest cookie or the session backend.
 
-            Does nothing, in case the session hasn't been changed in the current request.
+            Does nothing, in case the session hasn't been changed in the current request
+            and its lastseen timestamp is recent enough.
         """
 
-        if not self.changed:
+        if not (self.changed or self.refresh):
             return
         current_request = current.request.get()
         # We will not issue sessions over http anymore
@@ -119,19 +384,34 @@ class Session(db.Entity):
             self.cookie_key = utils.string.random(42)
             self.static_security_key = utils.string.random(13)
 
-        dbSession = db.Entity(db.Key(self.kindName, self.cookie_key))
-
-        dbSession["data"] = db.fix_unindexable_properties(self)
-        dbSession["static_security_key"] = self.static_security_key
-        dbSession["lastseen"] = time.time()
-        dbSession["user"] = str(user_key)  # allow filtering for users
-        dbSession.exclude_from_indexes = {"data"}
+        lastseen = time.time()
+
+        # Sessions of guests are kept in the cookie, until they have to be moved into the session backend
+        if self.server_side or user_key != Session.GUEST_USER or not (cookie := encode_guest_cookie({
+            "cookie_key": self.cookie_key,
+            "static_security_key": self.static_security_key,
+            "lastseen": lastseen,
+            "data": dict(self),
+        })):
+            dbSession = db.Entity(db.Key(self.kindName, self.cookie_key))
+
+            dbSession["data"] = db.fix_unindexable_properties(self)
+            dbSession["static_security_key"] = self.static_security_key
+            dbSession["lastseen"] = lastseen
+            dbSession["user"] = str(user_key)  # allow filtering for users
+            dbSession.exclude_from_indexes = {"data"}
+
+            if self.changed or not self.server_side:
+                get_backend().put(dbSession)
+            else:
+                get_backend().touch(dbSession)
 
-        db.put(dbSession)
+            self.server_side = True
+            cookie = self.cookie_key
 
         # Provide Set-Cookie header entry with configured properties
         current_request.response.headerlist.append(
-            ("Set-Cookie", f"{self.cookie_name}={self.cookie_key};{self.build_flags()}")
+            ("Set-Cookie", f"{self.cookie_name}={cookie};{self.build_flags()}")
         )
 
     @classmethod
@@ -240,13 +520,15 @@ class Session(db.Entity):
 
     def clear(self) -> None:
         if self.cookie_key:
-            db.delete(db.Key(self.kindName, self.cookie_key))
+            if self.server_side:
+                get_backend().delete(self.cookie_key)
             from viur.core import securitykey
             securitykey.clear_session_skeys(self.cookie_key)
 
         current.request.get().response.unset_cookie(self.cookie_name, strict=False)
 
         self.loaded = False
+        self.server_side = False
         self.cookie_key = None
         super().clear()
 
@@ -282,7 +564,7 @@ class DeleteSessionsIter(DeleteEntitiesIter):
 
     @classmethod
     def handleEntry(cls, entry: db.Entity, customData: t.Any) -> None:
-        db.delete(entry.key)
+        get_backend().delete(entry.key.name)
         Session.dispatch_on_delete(entry)
 
 
@@ -330,6 +612,7 @@ def update_session_user(user_key: "db.Key"):
 
     for e in db.Query(Session.kindName).filter("user =", str(user_key)).iter():
         db.run_in_transaction(_update_txn, e.key)
+        get_backend().evict(e.key.name)
 
 
 @tasks.PeriodicTask(interval=datetime.timedelta(hours=4))
@@ -340,3 +623,6 @@ def start_clear_sessions():
     query = db.Query(Session.kindName).filter(
         "lastseen <", time.time() - (conf.user.session_life_time.total_seconds() + 300))
     DeleteSessionsIter.startIterOnQuery(query)
+
+
+_datastore_backend = DatastoreSessionBackend()
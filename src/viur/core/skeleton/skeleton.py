@@ -1,5 +1,6 @@
 from __future__ import annotations  # noqa: required for pre-defined annotations
 
+import functools
 import logging
 import time
 import typing as t
@@ -7,7 +8,7 @@ import warnings
 
 from deprecated.sphinx import deprecated
 
-from viur.core import conf, db, errors, utils
+from viur.core import cache, conf, db, errors, utils
 from . import tasks
 from .meta import BaseSkeleton, MetaSkel, _UNDEFINED_KINDNAME
 from .utils import skeletonByKind
@@ -30,6 +31,17 @@ if t.TYPE_CHECKING:
     from .adapter import DatabaseAdapter
 
 
+def _invalidate_cache(key: t.Optional[db.Key] = None, kind: t.Optional[str] = None) -> None:
+    """
+    Invalidates the cache entries depending on a written entity, see :attr:`conf.cache_invalidate_on_write`.
+    The write has already succeeded at this point, so failures are only logged.
+    """
+    try:
+        cache.invalidate(key=key, kind=kind)
+    except Exception:  # noqa
+        logging.exception(f"Failed to invalidate the cache for {key=}, {kind=}")
+
+
 class SeoKeyBone(StringBone):
     """
     Special kind of StringBone saving its contents as `viurCurrentSeoKeys` into the entity's `viur` dict.
@@ -633,6 +645,12 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
         for adapter in skel.database_adapters:
             adapter.write(skel, is_add, change_list)
 
+        if conf.cache_invalidate_on_write:
+            if is_add:
+                db.on_commit(functools.partial(_invalidate_cache, kind=skel.kindName))
+            else:
+                db.on_commit(functools.partial(_invalidate_cache, key=key))
+
         return skel
 
     @classmethod
@@ -721,6 +739,9 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
         for adapter in skel.database_adapters:
             adapter.delete(skel)
 
+        if conf.cache_invalidate_on_write:
+            db.on_commit(functools.partial(_invalidate_cache, key=key))
+
     @classmethod
     def patch(
         cls,
@@ -123,6 +123,8 @@ class SkelIterTask(tasks.QueryIter):
     Iterates the skeletons of a query, and additionally checks a Logics expression.
     When the skeleton is valid, it performs the action `data["action"]` on each entry.
     """
+    batch_size = 20
+    time_budget = tasks.QueryIter.TASK_TIME_BUDGET
 
     @classmethod
     def handleEntry(cls, skel, data):
@@ -1,20 +1,24 @@
 import abc
+import concurrent.futures
+import contextlib
 import datetime
 import functools
 import logging
 import os
 import sys
+import time
 import traceback
 import typing as t
 
 import grpc
 import requests
 from google import protobuf
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import tasks_v2
 
 from viur.core import current, db, errors, utils
 from viur.core.config import conf
-from viur.core.decorators import exposed, skey
+from viur.core.decorators import access, exposed, skey
 from viur.core.module import Module
 
 CUSTOM_OBJ = t.TypeVar("CUSTOM_OBJ")  # A JSON serializable object
@@ -363,6 +367,21 @@ class TaskHandler(Module):
 
         return self.render.addSuccess(skel)
 
+    @exposed
+    @access("root")
+    def cache_stats(self, hours: float = 24, top: int = 10, *args, **kwargs):
+        """
+        Returns the hit ratios and the top misses of the caches as JSON, see :func:`viur.core.cache.statistics`.
+
+        :param hours: The period to aggregate the statistics of.
+        :param top: The number of paths listed as top misses.
+        """
+        from viur.core import cache
+
+        stats = cache.statistics(datetime.timedelta(hours=float(hours)), int(top))
+        current.request.get().response.headers["Content-Type"] = "application/json"
+        return utils.json.dumps(stats)
+
 
 TaskHandler.admin = True
 TaskHandler.vi = True
@@ -445,7 +464,87 @@ def noRetry(f):
     return retry_n_times(0)(f)
 
 
-def CallDeferred(func: t.Callable) -> t.Callable:
+class TaskBuffer:
+    """
+    Collects the tasks created during a request, to create them concurrently after the response has been sent.
+    See :attr:`conf.tasks_enqueue_after_response`.
+    """
+
+    MAX_WORKERS = 8
+    """Maximum number of tasks created at the same time"""
+
+    def __init__(self):
+        self.requests: dict[bytes | object, tasks_v2.CreateTaskRequest] = {}
+        self.closed = False
+
+    def add(self, request: tasks_v2.CreateTaskRequest, deduplicate: bool = False) -> bool:
+        """
+        Adds a task to be created. If *deduplicate* is set, identical tasks are only created once.
+
+        :returns: False if the buffer has already been closed, so the task has to be created directly.
+        """
+        if self.closed:
+            return False
+
+        self.requests[tasks_v2.CreateTaskRequest.serialize(request) if deduplicate else object()] = request
+        return True
+
+    def flush(self) -> None:
+        """
+        Creates all collected tasks.
+        """
+        if not self.requests:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(self.requests), self.MAX_WORKERS)) as pool:
+            futures = {pool.submit(taskClient.create_task, request): request for request in self.requests.values()}
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except AlreadyExists:
+                    # Named tasks are created only once, a duplicate is the expected outcome
+                    logging.debug(f"Task {futures[future].task.name} already exists")
+                except Exception:  # noqa
+                    logging.exception(f"Failed to create task {futures[future].task}")
+
+        self.requests.clear()
+
+    def close(self) -> None:
+        """
+        Creates all collected tasks, the tasks created afterward are created directly.
+        """
+        self.closed = True
+        self.flush()
+
+
+def flush_deferred_tasks() -> None:
+    """
+    Creates the tasks collected so far in the current request right away.
+
+    Tasks collected by :attr:`conf.tasks_enqueue_after_response` are lost if the instance dies before the response
+    has been sent; call this function before answering when the tasks must be enqueued at that point.
+    """
+    if (req := current.request.get()) is not None and req.task_buffer is not None:
+        req.task_buffer.flush()
+
+
+def _create_task(req, request: tasks_v2.CreateTaskRequest, deduplicate: bool = False) -> None:
+    """
+    Creates a task, or adds it to the :class:`TaskBuffer` of the request *req*.
+    """
+    if conf.tasks_enqueue_after_response and req is not None:
+        if req.task_buffer is None:
+            req.task_buffer = TaskBuffer()
+            req.after_response_tasks.append(req.task_buffer.close)
+
+        if req.task_buffer.add(request, deduplicate):
+            return
+
+    taskClient.create_task(request)
+
+
+def CallDeferred(func: t.Optional[t.Callable] = None, *, deduplicate: bool = False) -> t.Callable:
     """
     This is a decorator, which always calls the wrapped method deferred.
 
@@ -490,10 +589,17 @@ def CallDeferred(func: t.Callable) -> t.Callable:
                 super().task(_call_deferred=False)  # avoid secondary deferred call
                 ...
 
+    With :attr:`conf.tasks_enqueue_after_response` enabled, the tasks are created after the response has been
+    sent. Functions which are safe to be called only once for identical calls within a request can opt into
+    merging them with ``@CallDeferred(deduplicate=True)``.
+
     See also:
         https://cloud.google.com/python/docs/reference/cloudtasks/latest/google.cloud.tasks_v2.types.Task
         https://cloud.google.com/python/docs/reference/cloudtasks/latest/google.cloud.tasks_v2.types.CreateTaskRequest
     """
+    if func is None:
+        return functools.partial(CallDeferred, deduplicate=deduplicate)
+
     if "viur_doc_build" in dir(sys):
         return func
 
@@ -587,7 +693,7 @@ def CallDeferred(func: t.Callable) -> t.Callable:
             except AttributeError:  # This isn't originating from a normal request
                 pass
 
-            if db.is_in_transaction():
+            if in_transaction := db.is_in_transaction():
                 # We have to ensure transaction guarantees for that task also
                 env["transactionMarker"] = db.acquire_transaction_success_marker()
                 # We move that task at least 90 seconds into the future so the transaction has time to settle
@@ -623,7 +729,13 @@ def CallDeferred(func: t.Callable) -> t.Callable:
             # Use the client to build and send the task.
             parent = taskClient.queue_path(conf.instance.project_id, queueRegion, _queue)
             logging.debug(f"{parent=}, {task=}")
-            taskClient.create_task(tasks_v2.CreateTaskRequest(parent=parent, task=task))
+            request = tasks_v2.CreateTaskRequest(parent=parent, task=task)
+
+            if in_transaction and conf.tasks_enqueue_after_response:
+                # The task is only collected if the transaction succeeds
+                db.on_commit(functools.partial(_create_task, req, request, deduplicate and _name is None))
+            else:
+                _create_task(req, request, deduplicate and _name is None)
 
             logging.info(f"Created task {func.__name__}.{func.__module__} with {args=} {kwargs=} {env=}")
 
@@ -741,8 +853,17 @@ class QueryIter(object, metaclass=MetaQueryIter):
 
         To use this class create a subclass, override the classmethods handleEntry and handleFinish and then
         call startIterOnQuery with an instance of a database Query (and possible some custom data to pass along)
+
+        Each step processes a batch of *batch_size* entries. If a *time_budget* is set (like
+        :attr:`TASK_TIME_BUDGET`), a step continues with the next batches as long as another batch fits into the
+        budget, and only then reschedules the remaining entries.
     """
     queueName = "default"  # Name of the taskqueue we will run on
+    keys_only = False  # Only fetch the keys of the entries, see db.Query.keys()
+    batch_size = 5  # Number of entries fetched at once
+    time_budget: t.Optional[datetime.timedelta] = None  # Time a step may run more batches, None for one batch only
+    TASK_TIME_BUDGET: t.Final[datetime.timedelta] = datetime.timedelta(minutes=6)
+    """Recommended time_budget, 60% of the 10 minutes deadline of tasks"""
 
     @classmethod
     def startIterOnQuery(cls, query: db.Query, customData: t.Any = None) -> None:
@@ -765,6 +886,8 @@ class QueryIter(object, metaclass=MetaQueryIter):
             "endCursor": query.queries.endCursor,
             "origKind": query.origKind,
             "distinct": query.queries.distinct,
+            "keysOnly": query.queries.keys_only,
+            "projection": query.queries.projection,
             "classID": cls.__classID__,
             "customData": customData,
             "totalCount": 0
@@ -800,8 +923,8 @@ class QueryIter(object, metaclass=MetaQueryIter):
     @classmethod
     def _qryStep(cls, qryDict: dict[str, t.Any]) -> None:
         """
-            Internal use only. Processes one block of five entries from the query defined in qryDict and
-            reschedules the next block.
+            Internal use only. Processes one or more batches of entries from the query defined in qryDict and
+            reschedules the next batch.
         """
         from viur.core.skeleton import skeletonByKind
 
@@ -812,12 +935,43 @@ class QueryIter(object, metaclass=MetaQueryIter):
         qry.setCursor(qryDict["startCursor"], qryDict["endCursor"])
         qry.origKind = qryDict["origKind"]
         qry.queries.distinct = qryDict["distinct"]
+        qry.queries.keys_only = cls.keys_only or qryDict.get("keysOnly", False)
+        qry.queries.projection = qryDict.get("projection")
 
-        if qry.srcSkel is not None:
-            qryIter = qry.fetch(5)
-        else:
-            qryIter = qry.run(5)
+        deadline = time.monotonic() + cls.time_budget.total_seconds() if cls.time_budget else None
 
+        while True:
+            batch_start = time.monotonic()
+            if qry.srcSkel is not None:
+                qryIter = qry.fetch(cls.batch_size)
+            else:
+                qryIter = qry.run(cls.batch_size)
+
+            with cls.batch_context(qryDict):
+                if not cls._handleBatch(qry, qryIter, qryDict):
+                    return
+
+            if not (cursor := qry.getCursor()):
+                cls.handleFinish(qryDict["totalCount"], qryDict["customData"])
+                return
+
+            qryDict["startCursor"] = cursor
+
+            # Another batch must fit into the budget, assuming it takes as long as the last one
+            now = time.monotonic()
+            if deadline is None or now + (now - batch_start) >= deadline:
+                cls._requeueStep(qryDict)
+                return
+
+            qry.setCursor(cursor, qryDict["endCursor"])
+
+    @classmethod
+    def _handleBatch(cls, qry: db.Query, qryIter: t.Iterable, qryDict: dict[str, t.Any]) -> bool:
+        """
+            Internal use only. Calls handleEntry for the entries of a batch.
+
+            :returns: False if the iteration has been aborted by handleError.
+        """
         for item in qryIter:
             try:
                 cls.handleEntry(item, qryDict["customData"])
@@ -835,17 +989,19 @@ class QueryIter(object, metaclass=MetaQueryIter):
 
                     if not doCont:
                         logging.error(f"Exiting queryIter on cursor {qry.getCursor()!r}")
-                        return
+                        return False
 
             qryDict["totalCount"] += 1
 
-        cursor = qry.getCursor()
+        return True
 
-        if cursor:
-            qryDict["startCursor"] = cursor
-            cls._requeueStep(qryDict)
-        else:
-            cls.handleFinish(qryDict["totalCount"], qryDict["customData"])
+    @classmethod
+    def batch_context(cls, qryDict: dict[str, t.Any]) -> t.ContextManager:
+        """
+            Overridable hook returning the context a batch of entries is processed in,
+            e.g. :func:`db.batch` to buffer the writes of handleEntry.
+        """
+        return contextlib.nullcontext()
 
     @classmethod
     def handleEntry(cls, entry, customData):
@@ -884,7 +1040,17 @@ class DeleteEntitiesIter(QueryIter):
         query was created using `Skeleton().all()`.
         This way the `Skeleton.delete()` method can be used and
         the appropriate post-processing can be done.
+
+    Plain database queries should be passed as keys-only query (see :meth:`db.Query.keys`),
+    as only the keys of their entries are needed. Their entities are deleted in a single call per batch.
     """
+    batch_size = 100
+    time_budget = QueryIter.TASK_TIME_BUDGET
+
+    @classmethod
+    def batch_context(cls, qryDict: dict[str, t.Any]) -> t.ContextManager:
+        # Skeleton.delete() relies on reading its own writes, so only plain entities are deleted buffered
+        return contextlib.nullcontext() if qryDict["srcSkel"] else db.batch()
 
     @classmethod
     def handleEntry(cls, entry, customData):
@@ -904,4 +1070,4 @@ def start_clear_transaction_marker():
     """
     query = db.Query("viur-transactionmarker").filter("creationdate <",
                                                       datetime.datetime.now() - datetime.timedelta(days=31))
-    DeleteEntitiesIter.startIterOnQuery(query)
+    DeleteEntitiesIter.startIterOnQuery(query.keys())
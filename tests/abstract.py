@@ -17,3 +17,23 @@ class ViURTestCase(unittest.TestCase):
 
     def tearDown(self) -> None:
         self.testbed.deactivate()
+
+    def use_memory_backend(self):
+        """Runs the test against an empty in-memory datastore, which is removed again after the test."""
+        from viur.core import db
+        from viur.core.db.memory import MemoryBackend
+
+        backend = MemoryBackend()
+        self.addCleanup(db.set_backend, db.set_backend(backend))
+        return backend
+
+    def use_memcache(self):
+        """Sets conf.db.memcache_client to a client of the testbed's memcache stub for this test."""
+        from google.appengine.api.memcache import Client
+        from viur.core import conf
+
+        client = Client()
+        patcher = mock.patch.object(conf.db, "memcache_client", client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return client
@@ -0,0 +1,503 @@
+from functools import partial
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class CacheTestCase(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import webob
+        from viur.core import conf, current
+        from viur.core.request import Router
+
+        self.conf = conf
+        self.use_memory_backend()
+
+        self.request = mock.Mock(
+            disableCache=False,
+            args=(),
+            path_list=("page", "view"),
+            request=webob.Request.blank("/"),
+            response=webob.Response(),
+            after_response_tasks=[],
+            method="get",
+            internalRequest=False,
+        )
+        self.request.not_modified = partial(Router.not_modified, self.request)
+        self.request_token = current.request.set(self.request)
+        self.calls = 0
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request.reset(self.request_token)
+        super().tearDown()
+
+    def view(self, *_args, **_kwargs) -> str:
+        self.calls += 1
+        return f"rendered {self.calls}"
+
+    def _expire(self, age: int) -> None:
+        """Moves the creation time of all cache entries *age* seconds into the past."""
+        import datetime
+        from viur.core import cache, db, utils
+
+        creationtime = utils.utcNow() - datetime.timedelta(seconds=age)
+        for entity in db.Query(cache.viurCacheName).iter():
+            entity["creationtime"] = creationtime
+            db.put(entity)
+        for entry in cache.front_cache._entries.values():
+            entry.creationtime = creationtime
+
+
+class TestFrontCache(CacheTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import cache
+
+        self.conf.cache_front_size = 1_000_000
+        self.patcher = mock.patch.object(cache, "front_cache", cache.FrontCache())
+        self.front_cache = self.patcher.start()
+
+    def tearDown(self) -> None:
+        self.patcher.stop()
+        self.conf.cache_front_size = 0
+        super().tearDown()
+
+    def test_front_cache(self) -> None:
+        from viur.core import cache, db
+
+        view = cache.enableCache(["/page/view"], maxCacheTime=60)(self.view)
+        self.assertEqual(view(None), "rendered 1")
+        self.assertEqual(len(self.front_cache), 1)
+
+        with mock.patch.object(db, "get") as get:
+            self.assertEqual(view(None), "rendered 1")
+            get.assert_not_called()
+
+        self._expire(120)
+        self.assertEqual(view(None), "rendered 2")
+
+    def test_size_bound(self) -> None:
+        from viur.core import cache
+
+        self.conf.cache_front_size = 200
+        for index in range(10):
+            entry = cache.CacheEntry(data="x", content_type="text/html", creationtime=None, size=50)
+            self.front_cache.put(f"key-{index}", entry)
+
+        self.assertEqual(len(self.front_cache), 4)
+        self.assertIsNone(self.front_cache.get("key-0"))
+        self.assertIsNotNone(self.front_cache.get("key-9"))
+
+    def test_stale_while_revalidate(self) -> None:
+        from viur.core import cache
+
+        view = cache.enableCache(["/page/view"], maxCacheTime=60, staleWhileRevalidate=60)(self.view)
+        view(None)
+        self._expire(90)
+
+        # served stale, rebuilt once after the response
+        self.assertEqual(view(None), "rendered 1")
+        self.assertEqual(view(None), "rendered 1")
+        self.assertEqual(len(self.request.after_response_tasks), 1)
+        self.request.after_response_tasks.pop()()
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(view(None), "rendered 2")
+
+        self._expire(150)  # beyond the stale window
+        self.assertEqual(view(None), "rendered 3")
+
+
+class TestDependencyIndex(CacheTestCase):
+    def test_invalidate(self) -> None:
+        from viur.core import cache, db
+
+        entity = db.Entity(db.Key("viur-test", "entity"))
+        db.put(entity)
+
+        def view_entity(_self):
+            db.get(entity.key)
+            return self.view()
+
+        def view_list(_self):
+            db.current_db_access_log.get().add("viur-test")
+            return self.view()
+
+        view_entity = cache.enableCache(["/page/view"])(view_entity)
+        view_list = cache.enableCache(["/page/list"])(view_list)
+
+        view_entity(None)
+        self.request.path_list = ("page", "list")
+        view_list(None)
+        self.request.path_list = ("page", "view")
+        self.assertEqual(db.Query(cache.viurCacheName).count(), 2)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 2)
+
+        self.assertEqual(cache.invalidate(kind="other-kind"), 0)
+        self.assertEqual(cache.invalidate(key=entity.key), 2)  # depends on the entity and its kind
+        self.assertEqual(db.Query(cache.viurCacheName).count(), 0)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 0)
+
+        view_entity(None)
+        self.assertEqual(self.calls, 3)
+
+    def test_replace_dependencies(self) -> None:
+        from viur.core import cache, db, tasks
+
+        first, second = db.Key("viur-test", "first"), db.Key("viur-test", "second")
+        accessed = [first, second]
+
+        def view(_self):
+            db.current_db_access_log.get().update(accessed)
+            return self.view()
+
+        view = cache.enableCache(["/page/view"], maxCacheTime=60)(view)
+        view(None)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 2)
+
+        # rebuilt with fewer dependencies, the outdated index entity is removed
+        accessed = [first]
+        self._expire(120)
+        view(None)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 1)
+        self.assertEqual(cache.invalidate(key=second), 0)
+
+        # flushing by path removes the index along with the entry
+        tasks._deferred_tasks["flushCache.viur.core.cache"](prefix="/page/*")
+        self.assertEqual(db.Query(cache.viurCacheName).count(), 0)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 0)
+
+        # invalidating by one dependency removes the index entities of the others too
+        accessed = [first, second]
+        view(None)
+        self.assertEqual(cache.invalidate(key=first), 1)
+        self.assertEqual(db.Query(cache.viurCacheDependencyName).count(), 0)
+
+
+class TestSingleFlight(CacheTestCase):
+    def test_concurrent_misses(self) -> None:
+        import contextvars
+        import threading
+        from viur.core import cache
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_view(_self):
+            started.set()
+            release.wait(5)
+            return self.view()
+
+        view = cache.enableCache(["/page/view"])(slow_view)
+        results = []
+        stats = cache.single_flight_stats.copy()
+        waiting = threading.Semaphore(0)
+
+        class Flight(cache._Flight):
+            def __init__(self):
+                super().__init__()
+                wait = self.done.wait
+                self.done.wait = lambda timeout: waiting.release() or wait(timeout)
+
+        def request():
+            results.append(view(None))
+
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(request,)) for _ in range(5)]
+        with mock.patch.object(cache, "_Flight", Flight):
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            for _ in threads[1:]:
+                waiting.acquire(timeout=5)
+            release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ["rendered 1"] * 5)
+        self.assertEqual(cache.single_flight_stats["builds"] - stats["builds"], 1)
+        self.assertEqual(cache.single_flight_stats["coalesced"] - stats["coalesced"], 4)
+        self.assertEqual(cache._flights, {})
+
+    def test_lease_taken(self) -> None:
+        import datetime
+        from viur.core import cache
+
+        view = cache.enableCache(["/page/view"], maxCacheTime=60)(self.view)
+        view(None)
+        self._expire(120)
+
+        # another instance holds the lease: the expired entry isn't served, but waited for to be rebuilt
+        memcache = mock.Mock(**{"add.return_value": False})
+        with mock.patch.object(self.conf.db, "memcache_client", memcache), \
+                mock.patch.object(self.conf, "cache_single_flight_timeout", datetime.timedelta(seconds=0.2)):
+            self.assertEqual(view(None), "rendered 2")
+            memcache.delete.assert_not_called()
+
+        self.assertEqual(view(None), "rendered 2")
+
+
+class TestCompression(CacheTestCase):
+    def view(self, *_args, **_kwargs) -> str:
+        self.calls += 1
+        return f"rendered {self.calls} " + "<p>lorem ipsum</p>" * 1000
+
+    def test_compressed(self) -> None:
+        from viur.core import cache, db
+
+        view = cache.enableCache(["/page/view"])(self.view)
+        body = view(None)
+        self.assertEqual(db.Query(cache.viurCacheName).getEntry()["encoding"], "br" if cache.brotli else "gzip")
+
+        # the client doesn't accept the encoding
+        self.assertEqual(view(None), body)
+        self.assertNotIn("Content-Encoding", self.request.response.headers)
+
+        self.request.request.headers["Accept-Encoding"] = "gzip, deflate, br"
+        compressed = view(None)
+        self.assertIsInstance(compressed, bytes)
+        self.assertLess(len(compressed), len(body))
+        self.assertEqual(cache._decompress(self.request.response.headers["Content-Encoding"], compressed),
+                         body.encode("UTF-8"))
+        self.assertIn("Accept-Encoding", self.request.response.vary)
+        self.assertEqual(self.calls, 1)
+
+        # internal requests always receive the decompressed body, as it's embedded into another response
+        self.request.response.headers.pop("Content-Encoding")
+        self.request.internalRequest = True
+        self.assertEqual(view(None), body)
+        self.assertNotIn("Content-Encoding", self.request.response.headers)
+        self.assertEqual(self.calls, 1)
+
+    def test_chunked(self) -> None:
+        from viur.core import cache, db
+
+        entity = db.Entity(db.Key("viur-test", "entity"))
+        db.put(entity)
+
+        def view(_self):
+            db.get(entity.key)
+            return self.view()
+
+        self.conf.cache_compression_threshold = 0
+        try:
+            with mock.patch.object(cache, "CHUNK_SIZE", 5000):
+                view = cache.enableCache(["/page/view"])(view)
+                body = view(None)
+                self.assertEqual(db.Query(cache.viurCacheChunkName).count(), 4)
+                self.assertEqual(view(None), body)
+                self.assertEqual(self.calls, 1)
+
+                cache.invalidate(key=entity.key)
+                self.assertEqual(db.Query(cache.viurCacheChunkName).count(), 0)
+        finally:
+            self.conf.cache_compression_threshold = 1024
+
+    def test_chunked_text(self) -> None:
+        from viur.core import cache, db
+
+        self.conf.cache_compression_threshold = 0
+        try:
+            with mock.patch.object(cache, "CHUNK_SIZE", 5000):
+                view = cache.enableCache(["/page/view"])(self.view)
+                body = view(None)
+                self.assertIsInstance(body, str)
+                self.assertTrue(db.Query(cache.viurCacheName).getEntry()["text"])
+                self.assertEqual(view(None), body)
+
+                self.request.internalRequest = True
+                self.assertEqual(view(None), body)
+                self.assertEqual(self.calls, 1)
+        finally:
+            self.conf.cache_compression_threshold = 1024
+
+
+class TestETag(CacheTestCase):
+    def test_not_modified(self) -> None:
+        import webob
+        from viur.core import cache
+
+        view = cache.enableCache(["/page/view"])(self.view)
+        self.assertEqual(view(None), "rendered 1")
+        etag = self.request.response.etag
+        self.assertTrue(etag)
+        self.assertTrue(self.request.response.etag_strong)
+
+        self.request.request.headers["If-None-Match"] = f'"{etag}"'
+        self.assertEqual(view(None), "")
+        self.assertEqual(self.request.response.status_int, 304)
+
+        self.request.response = webob.Response()
+        self.request.request.headers["If-None-Match"] = '"outdated"'
+        self.assertEqual(view(None), "rendered 1")
+        self.assertEqual(self.request.response.status_int, 200)
+        self.assertEqual(self.request.response.etag, etag)
+
+
+class TestKeyPlan(CacheTestCase):
+    def test_key(self) -> None:
+        from viur.core import cache
+
+        def view(_self, key, page="1", *args, **kwargs):
+            pass
+
+        plan = cache.KeyPlan(view, 0, False, ["key", "page"])
+        key = plan("/page/view", ("abc",), {})
+        self.assertEqual(key, plan("/page/view", (), {"key": "abc", "page": "1"}))
+        self.assertEqual(key, plan("/page/view", ("abc",), {"ignored": "x"}))
+        self.assertEqual(key, cache.keyFromArgs(view, 0, False, ["key", "page"], "/page/view", ("abc",), {}))
+        self.assertNotEqual(key, plan("/page/view", ("abc", "2"), {}))
+        self.assertNotEqual(key, plan("/page/list", ("abc",), {}))
+
+        self.assertIsNone(plan("/page/view", (), {}))  # missing key
+        self.assertIsNone(cache.KeyPlan(view, 0, False, ["page"])("/page/view", ("abc",), {}))
+        with self.assertRaises(AssertionError):
+            plan("/page/view", ("abc",), {"key": "abc"})
+
+
+class TestFragment(CacheTestCase):
+    def test_fragment(self) -> None:
+        from viur.core import cache, db
+
+        entity = db.Entity(db.Key("viur-test", "entity"))
+        db.put(entity)
+
+        def build():
+            db.get(entity.key)
+            return self.view()
+
+        for backend in (None, cache.LocalFragmentBackend()):
+            self.conf.cache_fragment_backend = backend
+            self.calls = 0
+            try:
+                self.assertEqual(cache.fragment("navigation", 60, build), "rendered 1")
+                self.assertEqual(cache.fragment("navigation", 60, build), "rendered 1")
+                self.assertEqual(cache.fragment("footer", 60, build), "rendered 2")
+
+                # served fragments are dependencies of the entries built around them
+                outer = db.start_data_access_log()
+                cache.fragment("navigation", 60, build)
+                self.assertIn(entity.key, db.end_data_access_log(outer))
+
+                self.assertEqual(cache.invalidate(key=entity.key), 2)
+                self.assertEqual(cache.fragment("navigation", 60, build), "rendered 3")
+            finally:
+                self.conf.cache_fragment_backend = None
+
+    def test_consistent_type(self) -> None:
+        from markupsafe import Markup
+        from viur.core import cache
+
+        built = cache.fragment("markup", 60, lambda: Markup("<b>bold</b>"))
+        self.assertIs(type(built), str)
+        self.assertIs(type(cache.fragment("markup", 60, lambda: Markup("<b>other</b>"))), str)
+        self.assertEqual(cache.fragment("markup", 60, lambda: ""), built)
+        self.assertIn(cache.DatastoreFragmentBackend.STATS_PATH, cache.cache_stats.snapshot())
+
+    def test_without_request(self) -> None:
+        from viur.core import cache, current
+
+        token = current.request.set(None)
+        try:
+            self.assertEqual(cache.fragment("navigation", 60, self.view), "rendered 1")
+            self.assertEqual(cache.fragment("navigation", 60, self.view), "rendered 1")
+        finally:
+            current.request.reset(token)
+
+    def test_template(self) -> None:
+        import jinja2
+        from viur.core import cache
+
+        env = jinja2.Environment(extensions=[cache.CacheExtension], autoescape=True)
+        env.globals["view"] = self.view
+        template = env.from_string("{% cache 'section', 60 %}<b>{{ view() }}</b>{% endcache %}")
+
+        self.assertEqual(template.render(), "<b>rendered 1</b>")
+        self.assertEqual(template.render(), "<b>rendered 1</b>")
+        self.assertEqual(env.from_string("{% cache 'other' %}{{ view() }}{% endcache %}").render(), "rendered 2")
+
+    def test_exec_request(self) -> None:
+        from viur.core import current, db
+        from viur.core.render.html.env import viur
+
+        with mock.patch.object(viur, "_exec_request", side_effect=self.view):
+            self.assertEqual(viur.execRequest(None, "page/view", "a", key=db.Key("viur-test", 1), cachetime=60),
+                             "rendered 1")
+            self.assertEqual(viur.execRequest(None, "page/view", "a", key=db.Key("viur-test", 1), cachetime=60),
+                             "rendered 1")
+
+            # parameters which can't be normalized aren't cached
+            self.assertEqual(viur.execRequest(None, "page/view", object(), cachetime=60), "rendered 2")
+            self.assertEqual(viur.execRequest(None, "page/view", object(), cachetime=60), "rendered 3")
+
+            # results are cached per user
+            token = current.user.set({"key": db.Key("user", 1)})
+            try:
+                self.assertEqual(viur.execRequest(None, "page/view", "a", key=db.Key("viur-test", 1), cachetime=60),
+                                 "rendered 4")
+            finally:
+                current.user.reset(token)
+
+
+class TestStatistics(CacheTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import cache
+
+        self.patcher = mock.patch.object(cache, "cache_stats", cache.CacheStats())
+        self.cache_stats = self.patcher.start()
+
+    def tearDown(self) -> None:
+        self.patcher.stop()
+        self.conf.cache_stats_flush_interval = None
+        super().tearDown()
+
+    def test_statistics(self) -> None:
+        import datetime
+        from viur.core import cache, db
+
+        view = cache.enableCache(["/page/view"])(self.view)
+        view(None)
+        view(None)
+        view(None)
+
+        stats = self.cache_stats.snapshot()["/page/view"]
+        self.assertEqual((stats.hits, stats.misses, stats.builds), (2, 1, 1))
+        self.assertGreater(stats.bytes, 0)
+
+        # flushed after the response, then aggregated with this instance's counters
+        self.conf.cache_stats_flush_interval = datetime.timedelta(seconds=0)
+        view(None)
+        self.assertEqual(len(self.request.after_response_tasks), 1)
+        self.request.after_response_tasks.pop()()
+        self.assertEqual(self.cache_stats.snapshot(), {})
+        self.assertEqual(db.Query(cache.viurCacheStatsName).count(), 1)
+        self.conf.cache_stats_flush_interval = None
+        view(None)
+
+        res = cache.statistics()
+        self.assertEqual(res["paths"][0]["path"], "/page/view")
+        self.assertEqual(res["paths"][0]["hits"], 4)
+        self.assertEqual(res["paths"][0]["hit_ratio"], 0.8)
+        self.assertEqual(res["top_misses"][0]["misses"], 1)
+
+    def test_flush_without_request(self) -> None:
+        import datetime
+        from viur.core import cache, current, db
+
+        self.conf.cache_stats_flush_interval = datetime.timedelta(seconds=0)
+        self.cache_stats.record("/page/view", hits=1)
+
+        # after the response, the request's context has been unset
+        token = current.request.set(None)
+        try:
+            self.request.after_response_tasks.pop()()
+        finally:
+            current.request.reset(token)
+
+        self.assertEqual(self.cache_stats.snapshot(), {})
+        self.assertEqual(db.Query(cache.viurCacheStatsName).count(), 1)
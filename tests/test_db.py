@@ -1,8 +1,16 @@
 # TODO: Add more tests from https://github.com/viur-framework/viur-datastore/tree/master/tests
+from unittest import mock
 
 from abstract import ViURTestCase
 
 
+def _entity(name: str, **values):
+    from viur.core import db
+    entity = db.Entity(db.Key("viur-test", name))
+    entity.update(values)
+    return entity
+
+
 class TestDb(ViURTestCase):
     def test_key_init(self) -> None:
         from viur.core import db
@@ -27,3 +35,501 @@ class TestDb(ViURTestCase):
         key = db.Key("viur", "bar", parent=parent_key)
         self.assertEqual(key.name, "bar")
         self.assertEqual(key.parent, parent_key)
+
+
+class TestEntityCache(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import conf
+        self.conf = conf
+        self.use_memcache()
+        conf.db.cache_entities = True
+
+    def tearDown(self) -> None:
+        self.conf.db.cache_entities = False
+        super().tearDown()
+
+    def test_read_through(self) -> None:
+        from viur.core.db import transport
+        first, second = _entity("first", value=1), _entity("second", value=2)
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+            client.get_multi.return_value = [first]
+            self.assertEqual(transport.get([first.key]), [first])
+
+            # the second lookup must only fetch the key missing in the cache
+            client.get_multi.return_value = [second]
+            self.assertEqual(transport.get([second.key, first.key]), [second, first])
+            client.get_multi.assert_called_with([second.key])
+
+            client.get.return_value = None
+            self.assertEqual(transport.get(first.key), first)
+            client.get.assert_not_called()
+
+    def test_write_invalidates(self) -> None:
+        from viur.core.db import transport
+        entity = _entity("entity", value=1)
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+            client.get.return_value = entity
+            transport.get(entity.key)
+            transport.put(entity)
+            transport.get(entity.key)
+            self.assertEqual(client.get.call_count, 2)
+
+            transport.delete(entity.key)
+            client.get.return_value = None
+            self.assertIsNone(transport.get(entity.key))
+            self.assertEqual(client.get.call_count, 3)
+
+    def test_transaction_bypasses_cache(self) -> None:
+        from viur.core.db import transport
+        entity = _entity("entity", value=1)
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+            client.get.return_value = entity
+            transport.get(entity.key)
+
+            client.current_transaction = mock.Mock()
+            transport.get(entity.key)
+            self.assertEqual(client.get.call_count, 2)
+
+    def test_serialization(self) -> None:
+        import datetime
+        from viur.core import db
+        from viur.core.db import cache
+
+        entity = _entity("entity", ref=db.Key("viur-test", 42), text="x" * 5000, number=1.5)
+        entity["date"] = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        entity["nested"] = db.Entity()
+        entity["nested"]["values"] = [1, "two"]
+        entity.exclude_from_indexes = {"text"}
+
+        data = cache.serialize(entity)
+        self.assertLess(len(data), 1000)  # compressed
+        decoded = cache.deserialize(data)
+        self.assertEqual(decoded, entity)
+        self.assertEqual(decoded.key, entity.key)
+        self.assertEqual(decoded.exclude_from_indexes, {"text"})
+        self.assertIsInstance(decoded["ref"], db.Key)
+
+        cache.put(entity)
+        self.assertEqual(cache.get(entity.key), entity)
+
+        cache.flush()
+        entity["text"] = "x" * cache.MEMCACHE_MAX_SIZE
+        cache.MEMCACHE_COMPRESSION_THRESHOLD = None
+        try:
+            cache.put(entity)
+        finally:
+            cache.MEMCACHE_COMPRESSION_THRESHOLD = 1024
+        self.assertIsNone(cache.get(entity.key))  # too large to be cached
+
+    def test_outdated_fill(self) -> None:
+        from viur.core.db import cache
+        entity = _entity("entity", value=1)
+
+        # a read which has fetched the entity before it has been written can't put it back
+        cache.delete(entity.key)
+        self.assertTrue(cache.put(entity))
+        self.assertIsNone(cache.get(entity.key))
+
+        # nor replace an entry filled by a more recent read
+        cache.flush()
+        cache.put(entity)
+        cache.put(_entity("entity", value=0))
+        self.assertEqual(cache.get(entity.key)["value"], 1)
+
+
+class TestLocalCache(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import conf
+        from viur.core.db import cache
+        self.conf = conf
+        conf.db.cache_entities = True
+        conf.db.cache_local_size = 2
+        self.patcher = mock.patch.object(cache, "local_cache", cache.LocalCache())
+        self.local_cache = self.patcher.start()
+
+    def tearDown(self) -> None:
+        self.patcher.stop()
+        self.conf.db.cache_entities = False
+        self.conf.db.cache_local_size = 0
+        self.conf.db.cache_local_kinds = None
+        super().tearDown()
+
+    def test_negative_caching(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+        entity = db.Entity(db.Key("viur-test", "entity"))
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+            client.get.return_value = None
+            self.assertIsNone(transport.get(entity.key))
+            self.assertIsNone(transport.get(entity.key))
+            self.assertEqual(client.get.call_count, 1)
+            self.assertEqual(self.local_cache.stats()["negative_hits"], 1)
+
+            transport.put(entity)  # invalidates the negative entry
+            client.get.return_value = entity
+            self.assertEqual(transport.get(entity.key), entity)
+            self.assertEqual(transport.get(entity.key), entity)
+            self.assertEqual(client.get.call_count, 2)
+
+    def test_lru_and_kinds(self) -> None:
+        from viur.core import db
+        from viur.core.db import cache
+
+        entities = [db.Entity(db.Key("viur-test", f"entity-{i}")) for i in range(3)]
+        cache.put(entities)
+        self.assertEqual(len(self.local_cache), 2)
+        self.assertIsNone(cache.get(entities[0].key))  # evicted
+        self.assertEqual(cache.get(entities[2].key), entities[2])
+
+        self.conf.db.cache_local_kinds = {"other-kind"}
+        cache.flush()
+        cache.put(entities[0])
+        self.assertEqual(len(self.local_cache), 0)
+
+
+class TestIdentityMap(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import conf, current
+        self.conf = conf
+        conf.db.identity_map = True
+        self.token = current.request_data.set({})
+
+    def tearDown(self) -> None:
+        from viur.core import current
+        current.request_data.reset(self.token)
+        self.conf.db.identity_map = False
+        super().tearDown()
+
+    def test_repeated_get(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+        entity = db.Entity(db.Key("viur-test", "entity"))
+        entity["values"] = [1, 2]
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+            client.get.return_value = entity
+
+            first = transport.get(entity.key)
+            first["values"].append(3)  # must not leak into the map
+            second = transport.get(entity.key)
+            self.assertEqual(second["values"], [1, 2])
+            self.assertEqual(transport.get([entity.key]), [second])
+            self.assertEqual(client.get.call_count, 1)
+            client.get_multi.assert_not_called()
+            self.assertEqual(db.get_identity_map().rpcs_avoided, 2)
+
+            transport.put(entity)
+            transport.get(entity.key)
+            self.assertEqual(client.get.call_count, 2)
+
+
+class TestMultiQuery(ViURTestCase):
+    def test_concurrent_subqueries(self) -> None:
+        import threading
+        import time
+        from viur.core import db
+        from viur.core.db import query as query_module
+
+        threads = set()
+
+        def run_single_filter(query_def, limit):
+            value = query_def.filters["value ="]
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01 * (3 - value))  # the first query finishes last
+            entity = db.Entity(db.Key("viur-test", f"entity-{value}"))
+            entity["value"] = value
+            query_def.currentCursor = f"cursor-{value}".encode()
+            return [entity]
+
+        with mock.patch.object(query_module, "run_single_filter", side_effect=run_single_filter):
+            qry = db.Query("viur-test").filter("value IN", [0, 1, 2])
+            res = qry.run(10)
+
+        self.assertEqual([entity["value"] for entity in res], [0, 1, 2])
+        self.assertEqual([q.currentCursor for q in qry.queries], [b"cursor-0", b"cursor-1", b"cursor-2"])
+        self.assertEqual(len(threads), 3)
+
+    def test_resize_executor(self) -> None:
+        from viur.core import conf
+        from viur.core.db import query as query_module
+
+        executor = query_module._get_executor()
+        with mock.patch.object(conf.db, "multi_query_workers", conf.db.multi_query_workers + 1):
+            self.assertIsNot(query_module._get_executor(), executor)
+
+        # a thread still holding the previous pool can submit to it
+        self.assertEqual(executor.submit(lambda: 42).result(), 42)
+
+    def _merge(self, orders, results, limit=-1):
+        from viur.core import db
+        qry = db.Query("viur-test").filter("value IN", [0, 1])
+        qry.order(*orders)
+        return [entity.key.id_or_name for entity in qry._merge_multi_query_results(results, limit)]
+
+    def test_merge(self) -> None:
+        from viur.core import db
+        a, b, c = _entity("a", x=1, y=[5, 1]), _entity("b", x=2), _entity("c", x=2, y=3)
+        d = _entity("d", x="str")
+
+        self.assertEqual(self._merge([("x", db.SortOrder.Ascending)], [[a, c], [a, b, d]]), ["a", "c", "b", "d"])
+        self.assertEqual(self._merge([("x", db.SortOrder.Ascending)], [[a, c], [a, b, d]], limit=2), ["a", "c"])
+        self.assertEqual(
+            self._merge([("x", db.SortOrder.Descending), ("y", db.SortOrder.Descending)], [[d, c, b], [c, a]]),
+            ["d", "c", "b", "a"]
+        )
+        self.assertEqual(self._merge([(db.KEY_SPECIAL_PROPERTY, db.SortOrder.Descending)], [[d, a], [c, b]]),
+                         ["d", "c", "b", "a"])
+        # paging backwards keeps the entries closest to the cursor
+        e = _entity("e", x=3)
+        self.assertEqual(self._merge([("x", db.SortOrder.InvertedAscending)], [[a, e], [b, d]], limit=2),
+                         ["e", "d"])
+
+
+class TestKeysOnlyAndProjection(ViURTestCase):
+    def test_run_single_filter(self) -> None:
+        from viur.core import db
+        from viur.core.db import backends, transport
+
+        client = mock.MagicMock()
+        with mock.patch.object(transport, "__client__", backends.DatastoreBackend(client)):
+            qry = client.query.return_value
+            qry.fetch.return_value = mock.MagicMock(next_page_token=None, __iter__=lambda _: iter([]))
+
+            transport.run_single_filter(db.Query("viur-test").keys().queries, 10)
+            qry.keys_only.assert_called_once()
+
+            query = db.Query("viur-test").project("name", "value").queries
+            self.assertEqual(query.projection, ["name", "value"])
+            transport.run_single_filter(query, 10)
+            self.assertEqual(qry.projection, ["name", "value"])
+            qry.keys_only.assert_called_once()
+
+
+class TestBatch(ViURTestCase):
+    def test_batch(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+
+        entities = [db.Entity(db.Key("viur-test", f"entity-{i}")) for i in range(5)]
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+
+            with db.batch(chunk_size=3):
+                db.put(entities[0])
+                db.delete(entities[0].key)  # coalesced into a delete
+                db.put(entities[1])
+                self.assertEqual(client.put_multi.call_count, 0)
+
+                db.put(entities[2:])  # flushes a full chunk
+                self.assertEqual(client.put_multi.call_count, 1)
+                client.delete_multi.assert_called_once_with([entities[0].key])
+
+                new_entity = db.Entity(db.Key("viur-test"))
+                db.put(new_entity)
+
+            self.assertEqual(
+                [call.kwargs["entities"] for call in client.put_multi.call_args_list],
+                [[entities[1], entities[2]], [new_entity, entities[3], entities[4]]]
+            )
+
+    def test_discard_on_error(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = None
+
+            with self.assertRaises(ValueError):
+                with db.batch():
+                    db.put(db.Entity(db.Key("viur-test", "entity")))
+                    db.delete(db.Key("viur-test", "other"))
+                    raise ValueError()
+
+            client.put_multi.assert_not_called()
+            client.delete_multi.assert_not_called()
+
+    def test_transaction_passes_through(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+
+        entity = db.Entity(db.Key("viur-test", "entity"))
+
+        with mock.patch.object(transport, "__client__") as client:
+            client.current_transaction = mock.Mock()
+
+            with db.batch():
+                db.put(entity)
+                client.put.assert_called_once_with(entity)
+
+
+class TestDatabaseStats(ViURTestCase):
+    def test_record(self) -> None:
+        from viur.core import db
+        from viur.core.db import transport
+
+        entity = db.Entity(db.Key("viur-test", "entity"))
+        entity["name"] = "test"
+        stats = db.DatabaseStats()
+        token = db.current_db_stats.set(stats)
+
+        try:
+            with mock.patch.object(transport, "__client__") as client:
+                client.current_transaction = None
+                client.get_multi.return_value = [entity]
+
+                db.put(entity)
+                db.get([entity.key, db.Key("viur-test", "missing")])
+                db.delete(entity.key)
+        finally:
+            db.current_db_stats.reset(token)
+
+        self.assertEqual(stats.calls, 3)
+        self.assertEqual(
+            {operation: (op_stats.calls, op_stats.entities) for operation, op_stats in stats.operations.items()},
+            {"put": (1, 1), "get": (1, 1), "delete": (1, 1)},
+        )
+        self.assertGreater(stats.operations["put"].bytes, stats.operations["delete"].bytes)
+        self.assertEqual(stats.operations["put"].bytes, stats.operations["get"].bytes)
+        self.assertTrue(stats.server_timing().startswith('db;dur='))
+        self.assertIn("db-get;dur=", stats.server_timing())
+
+
+class TestMemoryBackend(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.backend = self.use_memory_backend()
+
+    def _put(self, name: str, **values):
+        from viur.core import db
+
+        entity = _entity(name, **values)
+        db.put(entity)
+        return entity
+
+    def test_get_put_delete(self) -> None:
+        from viur.core import db
+
+        entity = self._put("a", x=1)
+        entity["x"] = 2  # the stored entity must not change
+        self.assertEqual(db.get(entity.key)["x"], 1)
+
+        new_entity = db.Entity(db.Key("viur-test"))
+        db.put(new_entity)
+        self.assertFalse(new_entity.key.is_partial)
+        self.assertEqual([e.key for e in db.get([new_entity.key, entity.key])], [new_entity.key, entity.key])
+
+        db.delete(entity.key)
+        self.assertIsNone(db.get(entity.key))
+
+    def test_query(self) -> None:
+        from viur.core import db
+
+        self._put("a", x=3, tags=["red", "green"])
+        self._put("b", x=1, tags=["green"])
+        self._put("c", x=2, tags=["blue"])
+        self._put("d", tags=["red"])  # without x
+        self._put("e", x="text")  # strings are ordered after numbers
+
+        def names(query: db.Query) -> list[str]:
+            return [entity.key.name for entity in query.run(100)]
+
+        self.assertEqual(names(db.Query("viur-test").order("x")), ["b", "c", "a", "e"])
+        self.assertEqual(names(db.Query("viur-test").order(("x", db.SortOrder.Descending))), ["e", "a", "c", "b"])
+        self.assertEqual(names(db.Query("viur-test").filter("x >", 1).filter("x <", 3)), ["c"])
+        self.assertEqual(names(db.Query("viur-test").filter("tags =", "red")), ["a", "d"])
+        self.assertEqual(names(db.Query("viur-test").filter("tags IN", ["red", "blue"]).order("x")), ["c", "a"])
+        self.assertEqual(db.Query("viur-test").filter("tags =", "green").count(), 2)
+
+        entity = db.Query("viur-test").filter("x =", 3).project("x").getEntry()
+        self.assertEqual(dict(entity), {"x": 3})
+        self.assertEqual(dict(db.Query("viur-test").filter("x =", 3).keys().getEntry()), {})
+
+    def test_cursors(self) -> None:
+        from viur.core import db
+
+        for i in range(5):
+            self._put(f"entity-{i}", x=i)
+
+        query = db.Query("viur-test").order("x")
+        self.assertEqual([e["x"] for e in query.run(2)], [0, 1])
+        cursor = query.getCursor()
+
+        query = db.Query("viur-test").order("x").setCursor(cursor)
+        self.assertEqual([e["x"] for e in query.run(2)], [2, 3])
+
+        # entities deleted while iterating must not make the query skip others
+        seen = []
+        for entity in db.Query("viur-test").order("x").iter():
+            seen.append(entity["x"])
+            db.delete(entity.key)
+
+        self.assertEqual(seen, [0, 1, 2, 3, 4])
+
+    def test_transaction(self) -> None:
+        from viur.core import db
+
+        entity = self._put("a", x=1)
+
+        def txn():
+            entity["x"] = 2
+            db.put(entity)
+            self.assertEqual(db.get(entity.key)["x"], 1)  # not committed yet
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            db.run_in_transaction(txn)
+
+        self.assertEqual(db.get(entity.key)["x"], 1)
+
+        db.run_in_transaction(db.put, entity)
+        self.assertEqual(db.get(entity.key)["x"], 2)
+
+    def test_on_commit(self) -> None:
+        from viur.core import db
+
+        entity = self._put("a", x=1)
+        called = []
+
+        def txn():
+            entity["x"] = 2
+            db.put(entity)
+            db.on_commit(lambda: called.append(1))
+            db.on_commit(lambda: 1 / 0)
+            db.on_commit(lambda: called.append(2))
+            return "done"
+
+        # a failing callback neither fails the committed transaction nor skips the others
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(db.run_in_transaction(txn), "done")
+
+        self.assertEqual(called, [1, 2])
+        self.assertEqual(db.get(entity.key)["x"], 2)
+
+    def test_keys_only_multi_query(self) -> None:
+        from viur.core import db
+
+        self._put("a", x=0, y=3, z="a")
+        self._put("b", x=1, y=1, z="b")
+        self._put("c", x=0, y=2, z="c")
+        self._put("d", x=1, y=4, z="d")
+
+        # the merge needs the values the results are ordered by, even if they aren't fetched
+        res = db.Query("viur-test").filter("x IN", [0, 1]).order("y").keys().run(3)
+        self.assertEqual([entity.key.name for entity in res], ["b", "c", "a"])
+        self.assertEqual([dict(entity) for entity in res], [{}, {}, {}])
+
+        res = db.Query("viur-test").filter("x IN", [0, 1]).order(("y", db.SortOrder.Descending)).project("z").run(2)
+        self.assertEqual([dict(entity) for entity in res], [{"z": "d"}, {"z": "a"}])
@@ -0,0 +1,123 @@
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class TestPagination(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import current, db
+
+        self.use_memory_backend()
+        for i in range(23):
+            entity = db.Entity(db.Key("post", i + 1))
+            entity["thread"] = "test"
+            entity["index"] = i
+            db.put(entity)
+
+        # without a task queue, deferred tasks are collected in pendingTasks
+        self.request = mock.Mock(pendingTasks=[])
+        self.request_token = current.request.set(self.request)
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request.reset(self.request_token)
+        super().tearDown()
+
+    def _query(self):
+        from viur.core import db
+
+        return db.Query("post").filter("thread =", "test").order("index")
+
+    def _run_deferred_tasks(self) -> None:
+        while self.request.pendingTasks:
+            self.request.pendingTasks.pop(0)()
+
+    def test_lazy_index(self) -> None:
+        from viur.core import pagination as pagination_module
+        from viur.core.pagination import Pagination
+
+        pagination = Pagination(page_size=5, prefetch=1)
+        with (
+            mock.patch.object(pagination, "_extend", wraps=pagination._extend) as extend,
+            mock.patch.object(pagination_module, "_build_index", wraps=pagination_module._build_index) as build,
+        ):
+            self.assertIsNone(pagination.cursor_for_query(self._query(), 0))
+            self.assertEqual(len(pagination.get_pages(self._query())), 2)
+            extend.assert_called_once()
+
+        # both requests ask for the same task, which the task queue creates only once
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(build.call_args_list[0].kwargs["_name"], build.call_args_list[1].kwargs["_name"])
+        self.request.pendingTasks = self.request.pendingTasks[:1]
+        self._run_deferred_tasks()
+
+        pages = pagination.get_pages(self._query())
+        self.assertEqual(len(pages), 5)
+        self.assertFalse(self.request.pendingTasks)
+
+        query = self._query()
+        query.setCursor(pagination.cursor_for_query(self._query(), 4))
+        self.assertEqual([entity["index"] for entity in query.run(5)], [20, 21, 22])
+        self.assertIsNone(pagination.cursor_for_query(self._query(), 5))
+
+    def test_max_pages(self) -> None:
+        from viur.core.pagination import Pagination
+
+        pagination = Pagination(page_size=5, max_pages=3)
+        self.assertEqual(len(pagination.get_or_build_index(self._query())), 3)
+        self.assertFalse(self.request.pendingTasks)
+
+    def test_refresh_index(self) -> None:
+        from viur.core import db
+        from viur.core.pagination import Pagination
+
+        pagination = Pagination(page_size=5)
+        self.assertEqual(len(pagination.get_or_build_index(self._query())), 5)
+
+        for i in range(23, 26):
+            entity = db.Entity(db.Key("post", i + 1))
+            entity["thread"] = "test"
+            entity["index"] = i
+            db.put(entity)
+
+        # the previous index is used until it has been rebuilt
+        pagination.refresh_index(self._query())
+        self.assertEqual(len(pagination.get_pages(self._query())), 5)
+        self._run_deferred_tasks()
+        self.assertEqual(len(pagination.get_pages(self._query())), 6)
+
+    def test_refresh_while_building(self) -> None:
+        from viur.core import db
+        from viur.core.pagination import Pagination
+
+        pagination = Pagination(page_size=5, prefetch=1)
+        pagination.get_pages(self._query())
+        extend = Pagination._extend
+
+        def refreshing_extend(instance, *args):
+            pagination.refresh_index(self._query())  # e.g. a new post while the index is built
+            return extend(instance, *args)
+
+        with mock.patch.object(Pagination, "_extend", refreshing_extend):
+            self._run_deferred_tasks()
+
+        # the refresh isn't lost, the index is rebuilt on its next use
+        index = db.get(db.Key(Pagination._db_type, pagination.key_from_query(self._query())))
+        self.assertTrue(index["stale"])
+        pagination.get_pages(self._query())
+        self._run_deferred_tasks()
+        self.assertEqual(len(pagination.get_pages(self._query())), 5)
+
+    def test_query_restored(self) -> None:
+        from viur.core import pagination as pagination_module
+
+        query = self._query()
+        query.queries.distinct = ["thread"]
+        restored = pagination_module._load_query(pagination_module._dump_query(query))
+        self.assertEqual(restored.queries, query.queries)
+
+        query._fulltextQueryString = "search"
+        self.assertIsNone(pagination_module._dump_query(query))
+
@@ -0,0 +1,88 @@
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class TestRateLimit(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import webob
+        from viur.core import current
+
+        self.use_memory_backend()
+        self.request = mock.Mock(request=webob.Request.blank("/", remote_addr="192.0.2.1"))
+        self.request_token = current.request.set(self.request)
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request.reset(self.request_token)
+        super().tearDown()
+
+    def _exhaust(self, backend) -> None:
+        import webob
+        from viur.core import conf, errors
+        from viur.core.ratelimit import RateLimit
+
+        ratelimit = RateLimit("test", 3, 5, "ip")
+        with mock.patch.object(conf.security, "ratelimit_backend", backend):
+            for _ in range(4):
+                self.assertTrue(ratelimit.assertQuotaIsAvailable(setRetryAfterHeader=False))
+                ratelimit.decrementQuota()
+
+            self.assertFalse(ratelimit.isQuotaAvailable())
+            with self.assertRaises(errors.TooManyRequests):
+                ratelimit.assertQuotaIsAvailable(setRetryAfterHeader=False)
+
+            # other endpoints aren't affected
+            self.request.request = webob.Request.blank("/", remote_addr="192.0.2.2")
+            self.assertTrue(ratelimit.isQuotaAvailable())
+
+    def test_datastore(self) -> None:
+        from viur.core import db
+        from viur.core.ratelimit import RateLimit
+
+        self._exhaust(None)
+        self.assertTrue(list(db.Query(RateLimit.rateLimitKind).iter()))
+
+    def test_memcache(self) -> None:
+        from viur.core import db
+        from viur.core.ratelimit import MemcacheRateLimitBackend, RateLimit
+
+        memcache = self.use_memcache()
+        self._exhaust(MemcacheRateLimitBackend())
+
+        keys = RateLimit("test", 3, 5, "ip")._getStepKeys("192.0.2.1")
+        self.assertEqual(sum(memcache.get_multi(keys, namespace=MemcacheRateLimitBackend.NAMESPACE).values()), 4)
+        self.assertFalse(list(db.Query(RateLimit.rateLimitKind).iter()))
+
+    def test_memcache_fails_closed(self) -> None:
+        from viur.core import conf
+        from viur.core.ratelimit import MemcacheRateLimitBackend, RateLimit
+
+        # the client is resolved once it's used
+        with mock.patch.object(conf.security, "ratelimit_backend", MemcacheRateLimitBackend()):
+            self.assertFalse(RateLimit("test", 3, 5, "ip").isQuotaAvailable())
+
+            memcache = mock.Mock(**{"get_multi.side_effect": ConnectionError()})
+            with mock.patch.object(conf.db, "memcache_client", memcache):
+                self.assertFalse(RateLimit("test", 3, 5, "ip").isQuotaAvailable())
+
+            # App Engine's client returns nothing on service errors instead of raising
+            memcache = mock.Mock(**{"get_multi.return_value": {}, "set.return_value": False})
+            with mock.patch.object(conf.db, "memcache_client", memcache):
+                self.assertFalse(RateLimit("test", 3, 5, "ip").isQuotaAvailable())
+
+    def test_local(self) -> None:
+        import time
+        from viur.core.ratelimit import LocalRateLimitBackend, RateLimit
+
+        backend = LocalRateLimitBackend()
+        self._exhaust(backend)
+
+        # the tokens are given back over the time-span
+        ratelimit = RateLimit("test", 3, 5, "ip")
+        with mock.patch.object(time, "monotonic", return_value=time.monotonic() + 100):
+            self.assertAlmostEqual(backend.count(ratelimit, "192.0.2.1"), 3, places=1)
+        with mock.patch.object(time, "monotonic", return_value=time.monotonic() + 400):
+            self.assertEqual(backend.count(ratelimit, "192.0.2.1"), 0)
@@ -0,0 +1,108 @@
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class TestStatelessSecurityKey(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import webob
+        from viur.core import conf, current
+        from viur.core.session import Session
+
+        self.conf = conf
+        self.use_memory_backend()
+        self.patchers = [
+            mock.patch.object(conf.security, "stateless_skeys", True),
+            mock.patch.object(conf.user, "session_secret", b"secret"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.request = mock.Mock(request=webob.Request.blank("/"), response=webob.Response())
+        self.request_token = current.request.set(self.request)
+        self.session_token = current.session.set(Session())
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.session.reset(self.session_token)
+        current.request.reset(self.request_token)
+        for patcher in self.patchers:
+            patcher.stop()
+        super().tearDown()
+
+    def test_session_bound(self) -> None:
+        from viur.core import current, db, securitykey
+        from viur.core.session import Session
+
+        key = securitykey.create(action="delete")
+        self.assertTrue(key.startswith(securitykey.STATELESS_PREFIX))
+        self.assertFalse(list(db.Query(securitykey.SECURITYKEY_KINDNAME).iter()))
+
+        self.assertFalse(securitykey.validate(key, session_bound=False))
+        self.assertEqual(securitykey.validate(key), {"action": "delete"})
+        self.assertFalse(securitykey.validate(key))  # one-time
+
+        # keys are only valid in the session they have been created in
+        key = securitykey.create()
+        current.session.get().reset()
+        self.assertFalse(securitykey.validate(key))
+
+        current.session.set(Session())
+        self.assertFalse(securitykey.validate(key))
+
+    def test_memcache(self) -> None:
+        from viur.core import securitykey
+
+        # without a memcache, keys which aren't session bound have to be stored in the datastore
+        key = securitykey.create(session_bound=False)
+        self.assertFalse(key.startswith(securitykey.STATELESS_PREFIX))
+        self.assertTrue(securitykey.validate(key, session_bound=False))
+
+        self.use_memcache()
+        key = securitykey.create(session_bound=False, user_name="test")
+        self.assertTrue(key.startswith(securitykey.STATELESS_PREFIX))
+        self.assertEqual(securitykey.validate(key, session_bound=False), {"user_name": "test"})
+        self.assertFalse(securitykey.validate(key, session_bound=False))
+
+    def test_fallback(self) -> None:
+        import datetime
+        from viur.core import db, securitykey
+
+        for key in (
+            securitykey.create(key_length=42),
+            securitykey.create(user_key=db.Key("user", 1)),
+            securitykey.create(data="x" * self.conf.security.stateless_skeys_max_data),
+        ):
+            self.assertFalse(key.startswith(securitykey.STATELESS_PREFIX))
+            self.assertTrue(securitykey.validate(key))
+
+        key = securitykey.create(duration=datetime.timedelta(seconds=-1))
+        self.assertTrue(key.startswith(securitykey.STATELESS_PREFIX))
+        self.assertFalse(securitykey.validate(key))
+
+    def test_guest_cookie_session(self) -> None:
+        from viur.core import current, securitykey
+
+        with mock.patch.object(self.conf.user, "session_guest_cookie", True):
+            # a session kept in a cookie can't record used nonces
+            key = securitykey.create()
+            self.assertFalse(key.startswith(securitykey.STATELESS_PREFIX))
+            self.assertTrue(securitykey.validate(key))
+
+            current.session.get().server_side = True
+            key = securitykey.create()
+            self.assertTrue(key.startswith(securitykey.STATELESS_PREFIX))
+
+            # the session moved into a cookie again, so the key can't be used anymore
+            current.session.get().server_side = False
+            self.assertFalse(securitykey.validate(key))
+
+    def test_json_round_trip(self) -> None:
+        from viur.core import securitykey
+
+        for data in ({"ids": (1, 2)}, {"mapping": {1: "a"}}):
+            key = securitykey.create(**data)
+            self.assertFalse(key.startswith(securitykey.STATELESS_PREFIX))
+            self.assertEqual(securitykey.validate(key), data)
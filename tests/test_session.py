@@ -0,0 +1,150 @@
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class TestMemcacheSessionBackend(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core.session import MemcacheSessionBackend
+
+        self.use_memory_backend()
+        self.memcache = self.use_memcache()
+        self.backend = MemcacheSessionBackend()
+
+    def _session(self, lastseen: float):
+        from viur.core import db
+        from viur.core.session import Session
+
+        entity = db.Entity(db.Key(Session.kindName, "cookie"))
+        entity["data"] = {"language": "de"}
+        entity["static_security_key"] = "skey"
+        entity["lastseen"] = lastseen
+        entity["user"] = Session.GUEST_USER
+        entity.exclude_from_indexes = {"data"}
+        return entity
+
+    def test_read_from_memcache(self) -> None:
+        from viur.core import db
+
+        self.backend.put(self._session(1000.0))
+        with mock.patch.object(db, "get") as get:
+            entity = self.backend.get("cookie")
+            get.assert_not_called()
+
+        self.assertEqual(entity["data"], {"language": "de"})
+        self.assertEqual(entity["lastseen"], 1000.0)
+
+        # evicted from the memcache, it's read from the datastore again
+        self.backend.evict("cookie")
+        self.assertEqual(self.backend.get("cookie")["data"], {"language": "de"})
+        self.assertTrue(self.memcache.get("cookie", namespace=self.backend.NAMESPACE))
+
+    def test_write_behind(self) -> None:
+        from viur.core import db
+        from viur.core.session import Session
+
+        key = db.Key(Session.kindName, "cookie")
+        self.backend.put(self._session(1000.0))
+
+        self.backend.touch(self._session(1300.0))
+        self.assertEqual(self.backend.get("cookie")["lastseen"], 1300.0)
+        self.assertEqual(db.get(key)["lastseen"], 1000.0)
+
+        self.backend.touch(self._session(1000.0 + self.backend._write_behind_seconds()))
+        self.assertEqual(db.get(key)["lastseen"], 1000.0 + self.backend._write_behind_seconds())
+
+        self.backend.delete("cookie")
+        self.assertIsNone(self.backend.get("cookie"))
+        self.assertIsNone(self.memcache.get("cookie", namespace=self.backend.NAMESPACE))
+
+
+class TestGuestCookie(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import webob
+        from viur.core import conf, current
+
+        self.conf = conf
+        self.use_memory_backend()
+        self.patcher = mock.patch.multiple(
+            conf.user,
+            session_guest_cookie=True,
+            session_guest_cookie_encrypt=False,
+            session_secret=b"secret",
+        )
+        self.patcher.start()
+
+        self.request = mock.Mock(
+            request=webob.Request.blank("/"),
+            response=webob.Response(),
+            isSSLConnection=True,
+        )
+        self.request_token = current.request.set(self.request)
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request.reset(self.request_token)
+        self.patcher.stop()
+        super().tearDown()
+
+    def _cookie(self) -> str:
+        """Returns the session cookie set by the last response, and sends it with the next request."""
+        import webob
+        from viur.core.session import Session
+
+        name, value = self.request.response.headerlist[-1]
+        self.assertEqual(name, "Set-Cookie")
+        cookie = value.split(";")[0].removeprefix(f"{Session.cookie_name}=")
+        self.request.request = webob.Request.blank("/", headers={"Cookie": f"{Session.cookie_name}={cookie}"})
+        return cookie
+
+    def test_encode(self) -> None:
+        from viur.core.session import decode_guest_cookie, encode_guest_cookie
+
+        data = {"cookie_key": "key", "data": {"language": "de"}}
+        cookie = encode_guest_cookie(data)
+        self.assertEqual(decode_guest_cookie(cookie), data)
+        self.assertIsNone(decode_guest_cookie(cookie[:-2] + ("AA" if cookie[-2:] != "AA" else "BB")))
+
+        self.conf.user.session_guest_cookie_encrypt = True
+        cookie = encode_guest_cookie(data)
+        self.assertNotIn(b"language", cookie.encode())
+        self.assertEqual(decode_guest_cookie(cookie), data)
+
+        # data which doesn't fit into a cookie has to be stored in the session backend
+        self.assertIsNone(encode_guest_cookie({"data": "x" * self.conf.user.session_guest_cookie_max_size}))
+        self.assertIsNone(encode_guest_cookie({"data": object()}))
+        self.assertIsNone(encode_guest_cookie({"data": (1, 2)}))
+        self.assertIsNone(encode_guest_cookie({"data": {1: "a"}}))
+
+    def test_session(self) -> None:
+        from viur.core import db
+        from viur.core.session import Session
+
+        session = Session()
+        session.reset()
+        session["language"] = "de"
+        session.save()
+
+        cookie = self._cookie()
+        self.assertTrue(cookie.startswith("g1."))
+        self.assertFalse(list(db.Query(Session.kindName).iter()))
+
+        session = Session()
+        session.load()
+        self.assertEqual(session["language"], "de")
+        self.assertFalse(session.server_side)
+
+        # grows too large, so it's moved into the session backend
+        session["data"] = "x" * self.conf.user.session_guest_cookie_max_size
+        session.save()
+
+        self.assertEqual(self._cookie(), session.cookie_key)
+        self.assertTrue(db.get(db.Key(Session.kindName, session.cookie_key)))
+
+        session = Session()
+        session.load()
+        self.assertTrue(session.server_side)
+        self.assertEqual(session["language"], "de")
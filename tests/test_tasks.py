@@ -0,0 +1,211 @@
+from unittest import mock
+
+from abstract import ViURTestCase
+
+
+class TestTaskBuffer(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import webob
+        from viur.core import conf, current, tasks
+
+        self.use_memory_backend()
+        self.patchers = [
+            mock.patch.object(conf, "tasks_enqueue_after_response", True),
+            mock.patch.object(tasks, "queueRegion", "local"),
+            mock.patch.object(tasks, "taskClient"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        tasks.taskClient.queue_path.return_value = "projects/test/locations/local/queues/default"
+        tasks.taskClient.task_path.side_effect = lambda project, region, queue, name: \
+            f"projects/{project}/locations/{region}/queues/{queue}/tasks/{name}"
+        self.create_task = tasks.taskClient.create_task
+        self.request = mock.Mock(request=webob.Request.blank("/"), after_response_tasks=[], task_buffer=None)
+        self.request_token = current.request.set(self.request)
+        self.request_data_token = current.request_data.set({})
+
+        @tasks.CallDeferred
+        def deferred(value):
+            pass
+
+        @tasks.CallDeferred(deduplicate=True)
+        def deduplicated(value):
+            pass
+
+        self.deferred = deferred
+        self.deduplicated = deduplicated
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request_data.reset(self.request_data_token)
+        current.request.reset(self.request_token)
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        super().tearDown()
+
+    def _flush(self) -> None:
+        for task in self.request.after_response_tasks:
+            task()
+
+    def test_buffer(self) -> None:
+        self.deferred("a")
+        self.deferred("a")
+        self.deduplicated("a")
+        self.deduplicated("a")
+        self.deduplicated("b", _name="named")
+        self.deduplicated("b", _name="named")
+        self.create_task.assert_not_called()
+        self.assertEqual(len(self.request.after_response_tasks), 1)
+
+        self._flush()
+        self.assertEqual(self.create_task.call_count, 5)
+
+        # tasks created after the flush are created directly
+        self.deferred("c")
+        self.assertEqual(self.create_task.call_count, 6)
+
+    def test_after_response_context(self) -> None:
+        from viur.core import current
+        from viur.core.request import _AfterResponseIterator
+
+        self.addCleanup(current.session.reset, current.session.set({"user": {"name": "user@example.com"}}))
+        self.addCleanup(current.language.reset, current.language.set("de"))
+        self.deferred("a")
+        self.request.after_response_tasks.append(lambda: self.deferred("b"))  # e.g. a stale-while-revalidate build
+        app_iter = _AfterResponseIterator([b""], self.request.after_response_tasks)
+
+        # the router unsets the context of the request before the response is sent
+        current.session.set(None)
+        current.language.set(None)
+        app_iter.close()
+
+        self.assertEqual(self.create_task.call_count, 2)
+        body = self.create_task.call_args.args[0].task.app_engine_http_request.body.decode()
+        self.assertIn("user@example.com", body)
+        self.assertIn('"lang": "de"', body)
+
+    def test_named_task_exists(self) -> None:
+        from google.api_core.exceptions import AlreadyExists
+
+        self.create_task.side_effect = AlreadyExists("task exists")
+        self.deferred("a", _name="named")
+        with self.assertNoLogs(level="ERROR"):
+            self._flush()
+
+    def test_flush_deferred_tasks(self) -> None:
+        from viur.core import tasks
+
+        self.deferred("a")
+        tasks.flush_deferred_tasks()
+        self.create_task.assert_called_once()
+
+        self.deferred("b")  # collected again
+        self.create_task.assert_called_once()
+        self._flush()
+        self.assertEqual(self.create_task.call_count, 2)
+
+    def test_transaction(self) -> None:
+        from viur.core import db
+
+        def txn(fail: bool):
+            self.deferred("a")
+            self.assertFalse(self.request.task_buffer and self.request.task_buffer.requests)
+            if fail:
+                raise ValueError()
+
+        with self.assertRaises(ValueError):
+            db.run_in_transaction(txn, True)
+        self.assertIsNone(self.request.task_buffer)
+
+        db.run_in_transaction(txn, False)
+        self.assertEqual(len(self.request.task_buffer.requests), 1)
+
+        self._flush()
+        self.create_task.assert_called_once()
+
+
+class TestQueryIter(ViURTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from viur.core import current, db, tasks
+
+        self.use_memory_backend()
+        for i in range(23):
+            db.put(db.Entity(db.Key("item", i + 1)))
+
+        self.patcher = mock.patch.object(tasks, "queueRegion", None)
+        self.patcher.start()
+        self.request = mock.Mock(pendingTasks=[])
+        self.request_token = current.request.set(self.request)
+
+        class CountingIter(tasks.QueryIter):
+            batch_size = 5
+            seen = []
+            finished = None
+
+            @classmethod
+            def handleEntry(cls, entry, customData):
+                cls.seen.append(entry.key.id_or_name)
+
+            @classmethod
+            def handleFinish(cls, totalCount, customData):
+                cls.finished = totalCount
+
+        self.iter_cls = CountingIter
+
+    def tearDown(self) -> None:
+        from viur.core import current
+
+        current.request.reset(self.request_token)
+        self.patcher.stop()
+        super().tearDown()
+
+    def _run(self) -> int:
+        from viur.core import db
+
+        self.iter_cls.startIterOnQuery(db.Query("item"))
+        steps = 0
+        while self.request.pendingTasks:
+            self.request.pendingTasks.pop()()
+            steps += 1
+
+        self.assertEqual(sorted(self.iter_cls.seen), list(range(1, 24)))
+        self.assertEqual(self.iter_cls.finished, 23)
+        return steps
+
+    def test_batch_size(self) -> None:
+        self.assertEqual(self._run(), 5)
+
+    def test_time_budget(self) -> None:
+        import datetime
+
+        self.iter_cls.time_budget = datetime.timedelta(minutes=1)
+        self.assertEqual(self._run(), 1)
+
+    def test_time_budget_fits_batch(self) -> None:
+        import datetime
+        import itertools
+        from viur.core import tasks
+
+        # every reading of the clock advances it by 10 seconds, so a batch takes 10 seconds
+        self.iter_cls.time_budget = datetime.timedelta(seconds=25)
+        with mock.patch.object(tasks, "time", mock.Mock(monotonic=mock.Mock(side_effect=itertools.count(0, 10)))):
+            self.assertEqual(self._run(), 5)
+
+    def test_delete_entities(self) -> None:
+        from viur.core import db, tasks
+        from viur.core.db import transport
+
+        backend = transport.__client__
+        with mock.patch.object(backend, "delete_multi", wraps=backend.delete_multi) as delete_multi, \
+                mock.patch.object(backend, "delete", wraps=backend.delete) as delete:
+            tasks.DeleteEntitiesIter.startIterOnQuery(db.Query("item").keys())
+            while self.request.pendingTasks:
+                self.request.pendingTasks.pop()()
+
+        self.assertEqual(db.Query("item").count(), 0)
+        delete.assert_not_called()
+        delete_multi.assert_called_once()